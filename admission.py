@@ -0,0 +1,222 @@
+import asyncio
+import os
+import time
+from collections import deque
+from pipeline import PipelineFull
+from utils import log
+
+MB = 1024 * 1024
+
+# Reasons a job is rejected outright
+REJECT_QUOTA = "quota"  # The user's daily byte quota is used up
+REJECT_USER_QUEUE = "user_queue"  # The user already has too many jobs waiting
+REJECT_BUSY = "busy"  # The waiting room is full
+REJECT_DISK = "disk"  # The file could not fit on disk even with nothing else running
+
+# Reasons an accepted job has to wait
+WAIT_USER_LIMIT = "user_limit"  # The user's other jobs are still running
+WAIT_DISK = "disk"  # Not enough free temp space right now
+WAIT_LOAD = "load"  # The host is overloaded
+WAIT_CAPACITY = "capacity"  # The pipeline is full
+
+
+def today():
+    """Current UTC day, the period of the daily quotas"""
+    return time.strftime("%Y-%m-%d", time.gmtime())
+
+
+class AdmissionController:
+    """Admit jobs into the pipeline fairly across users, within disk, load and quota limits
+
+    Accepted jobs wait in one queue per user. Whenever capacity frees up,
+    the user with the fewest running jobs relative to their weight goes
+    next, so a user with twenty files cannot starve the others. A job only
+    enters the pipeline when its expected disk usage fits into the free
+    temp space and the host is not overloaded; jobs that can never fit,
+    and users over their quotas, are rejected before anything is
+    downloaded.
+    """
+
+    def __init__(self, pipeline, scratch, cores, max_per_user, max_queued_per_user, max_waiting,
+                 daily_quota_mb, weights, max_load):
+        self.pipeline = pipeline
+        self.scratch = scratch  # scratch.ScratchSpace holding the temp space reservations
+        self.cores = cores
+        self.max_per_user = max_per_user
+        self.max_queued_per_user = max_queued_per_user
+        self.max_waiting = max_waiting
+        self.daily_quota = daily_quota_mb * MB
+        self.weights = weights
+        self.max_load = max_load
+        self._waiting = {}  # user_id -> deque of jobs, in arrival order
+        self._running = {}  # user_id -> jobs in the pipeline
+        self._admitted = set()  # Ids of the jobs admitted through here that are still running
+        self._positions = {}  # job id -> position in the first stage queue when admitted
+        self._usage = {}  # user_id -> (day, bytes accepted that day)
+        self._charged = {}  # job id -> (day, bytes) charged to the quota, until the job is refunded or released
+        self._wakeup = None
+        self.admitted = 0
+        self.deferred = 0
+        self.rejected = {REJECT_QUOTA: 0, REJECT_USER_QUEUE: 0, REJECT_BUSY: 0, REJECT_DISK: 0}
+
+    def disk_needed(self, size_bytes):
+        """Temp space a job of this input size may take at its peak"""
+        return self.scratch.estimate(size_bytes)
+
+    def usage(self, user_id):
+        """Bytes the user submitted today"""
+        day, used = self._usage.get(user_id, (None, 0))
+        return used if day == today() else 0
+
+    def check(self, user_id, size_bytes):
+        """Return a REJECT_* reason when a new job must be refused, else None"""
+        reason = None
+        if self.daily_quota and self.usage(user_id) + size_bytes > self.daily_quota:
+            reason = REJECT_QUOTA
+        elif len(self._waiting.get(user_id, ())) >= self.max_queued_per_user:
+            reason = REJECT_USER_QUEUE
+        elif sum(len(jobs) for jobs in self._waiting.values()) >= self.max_waiting:
+            reason = REJECT_BUSY
+        elif not self.scratch.could_fit(self.disk_needed(size_bytes)):
+            reason = REJECT_DISK
+        if reason:
+            self.rejected[reason] += 1
+        return reason
+
+    def enqueue(self, job):
+        """Accept a checked job and start it if it may run now
+
+        Returns (position, None) when it went straight into the pipeline,
+        or (position among the user's waiting jobs, WAIT_* reason).
+        """
+        used = self.usage(job.user_id)
+        self._usage[job.user_id] = (today(), used + int(job.original_size * MB))
+        self._charged[job.id] = (today(), int(job.original_size * MB))
+        self._waiting.setdefault(job.user_id, deque()).append(job)
+        self._admit()
+        if job.id in self._admitted:
+            return self._positions.pop(job.id, 1), None
+        self.deferred += 1
+        position = list(self._waiting[job.user_id]).index(job) + 1
+        return position, self._blocked_reason(job)
+
+    def refund(self, job):
+        """Give a job's bytes back to the user's daily quota, for jobs that ended before any real work"""
+        day, size = self._charged.pop(job.id, (None, 0))
+        used_day, used = self._usage.get(job.user_id, (None, 0))
+        if size and day == used_day:
+            self._usage[job.user_id] = (used_day, max(0, used - size))
+
+    def release(self, job, refund=False):
+        """Called when a job leaves the pipeline; frees its slot and disk reservation
+
+        refund returns its bytes to the quota, for a job that failed or was
+        stopped before its encode started.
+        """
+        if refund:
+            self.refund(job)
+        self._charged.pop(job.id, None)
+        self._positions.pop(job.id, None)
+        self.scratch.release(job.id)
+        if job.id not in self._admitted:
+            return  # Not admitted through here (e.g. restored from the job store)
+        self._admitted.discard(job.id)
+        self._running[job.user_id] -= 1
+        if self._wakeup:
+            self._wakeup.set()
+
+    def cancel(self, job):
+        """Take a job out of the waiting room; returns False when it is not waiting (already admitted)"""
+        jobs = self._waiting.get(job.user_id)
+        if not jobs or job not in jobs:
+            return False
+        jobs.remove(job)
+        self.refund(job)  # Nothing was downloaded
+        if self._wakeup:
+            self._wakeup.set()  # Another user's job may fit now
+        return True
+
+    def start(self):
+        """Start the task that admits waiting jobs; must be called from the running event loop"""
+        self._wakeup = asyncio.Event()
+        asyncio.create_task(self._run(), name="admission")
+
+    async def _run(self):
+        while True:
+            try:
+                # Load and free space also change on their own, so look again now and then
+                await asyncio.wait_for(self._wakeup.wait(), timeout=5)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            self._admit()
+
+    def _overloaded(self):
+        if not self.max_load or not self._admitted:
+            return False  # Always let one job run, whatever else loads the host
+        try:
+            return os.getloadavg()[0] / self.cores > self.max_load
+        except (AttributeError, OSError):
+            return False
+
+    def _user_limit(self, job):
+        """Jobs of the user that may run while this one waits; albums may run more at once"""
+        return max(self.max_per_user, job.user_limit or 0)
+
+    def _blocked_reason(self, job):
+        if self._running.get(job.user_id, 0) >= self._user_limit(job):
+            return WAIT_USER_LIMIT
+        if self.pipeline.in_flight >= self.pipeline.max_jobs:
+            return WAIT_CAPACITY
+        if self._overloaded():
+            return WAIT_LOAD
+        if not self.scratch.fits(self.disk_needed(job.original_size * MB)):
+            return WAIT_DISK
+        return WAIT_CAPACITY
+
+    def _candidates(self):
+        """Users with waiting jobs, the one furthest below their fair share first"""
+        users = [
+            user_id for user_id, jobs in self._waiting.items()
+            if jobs and self._running.get(user_id, 0) < self._user_limit(jobs[0])
+        ]
+        return sorted(
+            users,
+            key=lambda user_id: (
+                self._running.get(user_id, 0) / self.weights.get(user_id, 1),
+                self._waiting[user_id][0].submitted_at
+            )
+        )
+
+    def _admit(self):
+        """Move waiting jobs into the pipeline while there is room"""
+        while self.pipeline.in_flight < self.pipeline.max_jobs and not self._overloaded():
+            for user_id in self._candidates():
+                job = self._waiting[user_id][0]
+                needed = self.disk_needed(job.original_size * MB)
+                if not self.scratch.reserve(job.id, needed):
+                    continue  # Someone else's smaller file may still fit
+                try:
+                    self._positions[job.id] = self.pipeline.submit(job)
+                except PipelineFull:
+                    self.scratch.release(job.id)
+                    return
+                self._waiting[user_id].popleft()
+                self._admitted.add(job.id)
+                self._running[user_id] = self._running.get(user_id, 0) + 1
+                self.admitted += 1
+                log(f"🚦 Job #{job.id} of user {user_id} admitted ({round(needed / MB, 1)} MB of temp space reserved)")
+                break
+            else:
+                return  # Nothing that waits can start now
+
+    def stats(self):
+        """Return waiting/running counts per user and the admission counters"""
+        return {
+            "waiting": sum(len(jobs) for jobs in self._waiting.values()),
+            "running": sum(self._running.values()),
+            "users_waiting": sum(1 for jobs in self._waiting.values() if jobs),
+            "admitted": self.admitted,
+            "deferred": self.deferred,
+            "rejected": dict(self.rejected),
+        }
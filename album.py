@@ -0,0 +1,100 @@
+import asyncio
+from utils import log
+
+ALBUM_MAX_ITEMS = 10  # Telegram's limit for one media group
+
+
+class AlbumCollector:
+    """Buffer the messages of a media group (album) until the group is complete
+
+    Telegram delivers every item of an album as its own message carrying
+    the same media_group_id, and never says how many there are. A group
+    counts as complete once no further item arrived for window seconds or
+    it holds ALBUM_MAX_ITEMS; on_ready(client, [(message, media), ...]) then
+    gets all of its items in the order they were sent.
+    """
+
+    def __init__(self, window, on_ready):
+        self.window = window
+        self.on_ready = on_ready
+        self._groups = {}  # (chat_id, media_group_id) -> {"client", "items", "timer"}
+        self._tasks = set()
+        self.albums = 0
+
+    @property
+    def pending(self):
+        """Groups still collecting or being handed over"""
+        return len(self._groups) + len(self._tasks)
+
+    def add(self, client, message, media):
+        key = (message.chat.id, message.media_group_id)
+        group = self._groups.setdefault(key, {"client": client, "items": [], "timer": None})
+        group["items"].append((message, media))
+        if group["timer"]:
+            group["timer"].cancel()
+        if len(group["items"]) >= ALBUM_MAX_ITEMS:
+            self._flush(key)
+        else:
+            group["timer"] = asyncio.get_running_loop().call_later(self.window, self._flush, key)
+
+    def _flush(self, key):
+        group = self._groups.pop(key, None)
+        if group is None:
+            return
+        if group["timer"]:
+            group["timer"].cancel()
+        items = sorted(group["items"], key=lambda item: item[0].id)
+        self.albums += 1
+        log(f"📚 Album {key[1]} in chat {key[0]}: {len(items)} items")
+        task = asyncio.create_task(self._hand_over(group["client"], items), name=f"album-{key[1]}")
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _hand_over(self, client, items):
+        try:
+            await self.on_ready(client, items)
+        except Exception as e:
+            log(f"❌ Album of chat {items[0][0].chat.id} could not be submitted: {str(e)}")
+
+
+class Album:
+    """The jobs of one media group: one status message while they run, one album as the answer
+
+    Every member reports a line for the shared status message and, when it
+    is done, its result - the media to send, or None when it failed. The
+    member that finishes last triggers the reply.
+    """
+
+    def __init__(self, client, messages):
+        self.client = client
+        self.messages = messages  # The user's messages, in album order
+        self.status_msg = None
+        self.lines = ["⏳ در صف"] * len(messages)
+        self.results = [None] * len(messages)  # (job, item) per member that produced something to send
+        self.done = [False] * len(messages)
+        self.held = []  # Finished jobs whose files have to stay until the album is sent
+        self.sent = False
+
+    def index(self, message):
+        return next(n for n, member in enumerate(self.messages) if member is message)
+
+    def update(self, message, text):
+        """Record the newest state of a member; only the first line of its status text is shown"""
+        index = self.index(message)
+        if not self.done[index]:
+            self.lines[index] = text.splitlines()[0] if text else ""
+
+    def finish(self, message, line, job=None, item=None):
+        """Record a member's final line and result; returns True when it was the last one"""
+        index = self.index(message)
+        self.lines[index] = line
+        self.results[index] = (job, item) if item else None
+        self.done[index] = True
+        return all(self.done)
+
+    def text(self):
+        """Aggregate status message text"""
+        finished = sum(self.done)
+        lines = [f"📚 آلبوم {len(self.messages)} فایلی: {finished} از {len(self.messages)} آماده"]
+        lines += [f"{n}. {line}" for n, line in enumerate(self.lines, 1)]
+        return "\n".join(lines)
@@ -0,0 +1,72 @@
+from config import ANIMATION_MAX_SIDE, ANIMATION_FPS, ANIMATION_CRF, ANIMATION_PRESET, ANIMATION_COPY_MAX_MB
+from filtergraph import frame_rate
+from probe import get_stream
+
+# Bump when the command template changes so cached results are not reused
+ANIMATION_VERSION = 1
+
+def animation_fps(info):
+    """Output frame rate: the source rate, capped at ANIMATION_FPS"""
+    rate = frame_rate(get_stream(info, "video"))
+    return round(min(rate, ANIMATION_FPS), 3) if rate else ANIMATION_FPS
+
+def animation_copyable(info, input_size):
+    """Whether the video of an animation can be kept as is; input_size is in MB"""
+    video = get_stream(info, "video")
+    if not video or input_size > ANIMATION_COPY_MAX_MB:
+        return False
+    format_name = (info.get("format") or {}).get("format_name", "")
+    return (
+        video.get("codec_name") == "h264"
+        and video.get("pix_fmt") in ("yuv420p", "yuvj420p")
+        and max(video.get("width") or 0, video.get("height") or 0) <= ANIMATION_MAX_SIDE
+        and ("mp4" in format_name or "mov" in format_name)
+    )
+
+def build_animation_command(input_file, output_file, info=None, copy=False, threads=None):
+    """Build an ffmpeg argv that turns an animation into a silent MP4 loop in one pass
+
+    Only the first video stream is read and audio is dropped with -an, which
+    is what makes Telegram show the result as an animation. With copy the
+    H.264 stream is kept and only the container changes; otherwise frames
+    are dropped to the target rate before scaling, so the scaler and the
+    encoder only see frames that are kept.
+    """
+    if copy:
+        codec_args = ['-c:v', 'copy']
+    else:
+        side = ANIMATION_MAX_SIDE
+        # Longest side at most ANIMATION_MAX_SIDE, even dimensions for yuv420p
+        scale = (
+            f"scale=w='if(gte(iw,ih),trunc(min(iw,{side})/2)*2,-2)'"
+            f":h='if(gte(iw,ih),-2,trunc(min(ih,{side})/2)*2)':flags=bicubic"
+        )
+        codec_args = [
+            '-vf', f"fps={animation_fps(info)},{scale}",
+            '-c:v', 'libx264',
+            '-preset', ANIMATION_PRESET,
+            '-crf', str(ANIMATION_CRF),
+            '-pix_fmt', 'yuv420p',
+            *(['-threads', str(threads)] if threads else []),
+        ]
+    return [
+        'ffmpeg', *(['-threads', str(threads)] if threads and not copy else []),
+        '-i', input_file,
+        '-map', '0:v:0', '-an', '-sn', '-dn',
+        *codec_args,
+        '-movflags', '+faststart',
+        '-map_metadata', '-1',
+        '-progress', 'pipe:1', '-nostats',
+        '-y', output_file,
+    ]
+
+def animation_profile():
+    """Settings that determine the output of build_animation_command"""
+    return {
+        "version": ANIMATION_VERSION,
+        "max_side": ANIMATION_MAX_SIDE,
+        "fps": ANIMATION_FPS,
+        "crf": ANIMATION_CRF,
+        "preset": ANIMATION_PRESET,
+        "copy_max_mb": ANIMATION_COPY_MAX_MB,
+    }
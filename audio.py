@@ -0,0 +1,46 @@
+from config import AUDIO_BITRATE, AUDIO_FORMAT, AUDIO_CHANNELS, AUDIO_SAMPLE_RATE
+from config import AUDIO_SPEECH_BITRATE, AUDIO_SPEECH_SAMPLE_RATE
+
+# ffmpeg encoder for each output format
+AUDIO_CODECS = {
+    "mp3": "libmp3lame",
+    "ogg": "libopus",
+    "opus": "libopus",
+    "m4a": "aac",
+    "aac": "aac",
+}
+
+def audio_output_suffix(speech=False):
+    """File extension of the compressed audio"""
+    return ".ogg" if speech else f".{AUDIO_FORMAT}"
+
+def build_audio_command(input_file, output_file, speech=False):
+    """Build an ffmpeg argv that transcodes audio as a stream, in constant memory
+
+    The music profile uses the AUDIO_* settings. The speech profile is meant
+    for voice notes: mono Opus in VBR mode tuned for voice, which Telegram
+    plays back as a voice message.
+    """
+    if speech:
+        codec_args = [
+            '-c:a', 'libopus',
+            '-b:a', AUDIO_SPEECH_BITRATE,
+            '-vbr', 'on',  # Spend bits on speech, not on pauses
+            '-application', 'voip',  # Opus mode tuned for intelligibility
+            '-ac', '1',
+            '-ar', str(AUDIO_SPEECH_SAMPLE_RATE),
+        ]
+    else:
+        codec_args = [
+            '-c:a', AUDIO_CODECS.get(AUDIO_FORMAT, "libmp3lame"),
+            '-b:a', AUDIO_BITRATE,
+            '-ac', str(AUDIO_CHANNELS),
+            '-ar', str(AUDIO_SAMPLE_RATE),
+        ]
+    return [
+        'ffmpeg', '-i', input_file,
+        '-map', '0:a:0', '-vn',  # Drop embedded cover art
+        *codec_args,
+        '-progress', 'pipe:1', '-nostats',  # Machine-readable progress on stdout
+        '-y', output_file,
+    ]
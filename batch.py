@@ -0,0 +1,223 @@
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from config import BATCH_PROCESSES, BATCH_MANIFEST, CPU_CORES, CPU_PIN_CORES, TARGET_SIZE_MB
+from engine import compress_file, result_profile, VIDEO_EXTENSIONS, ANIMATION_EXTENSIONS, OUTCOME_ORIGINAL, OUTCOME_FAILED
+from resources import CpuBudget, available_cores
+from scratch import scratch_from_config
+from utils import log
+from watchdog import watchdog
+
+MB = 1024 * 1024
+MANIFEST_VERSION = 1
+
+# Per pool process, set up by init_process
+_loop = None
+_budget = None
+_space = None
+
+
+def find_inputs(paths, list_file=None):
+    """(path, name) of every input; name is relative to the directory it was found in"""
+    if list_file:
+        with open(list_file) as f:
+            paths = list(paths) + [line.strip() for line in f if line.strip()]
+    inputs = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for filename in sorted(files):
+                    if os.path.splitext(filename.lower())[1] in VIDEO_EXTENSIONS + ANIMATION_EXTENSIONS:
+                        full = os.path.join(root, filename)
+                        inputs.append((full, os.path.relpath(full, path)))
+        elif os.path.isfile(path):
+            inputs.append((path, os.path.basename(path)))
+        else:
+            log(f"⚠️  {path}: no such file or directory, skipped")
+    return inputs
+
+def output_name(name, outcome=None, keep_extension=False):
+    """Name of a result in the output directory: MP4, or the input's own name when it was kept
+
+    keep_extension names clip.mkv's result clip.mkv.mp4, for inputs whose
+    plain name would collide with another result or the input itself.
+    """
+    if outcome == OUTCOME_ORIGINAL:
+        return name
+    return name + ".mp4" if keep_extension else os.path.splitext(name)[0] + ".mp4"
+
+def colliding_names(inputs, output_dir):
+    """Names of the inputs that need keep_extension: clip.mkv and clip.mp4 would both become clip.mp4"""
+    stems = {}
+    for _, name in inputs:
+        stem = os.path.normcase(os.path.splitext(name)[0])
+        stems[stem] = stems.get(stem, 0) + 1
+    colliding = set()
+    for input_file, name in inputs:
+        output_file = os.path.join(output_dir, output_name(name))
+        same_file = os.path.exists(output_file) and os.path.samefile(input_file, output_file)
+        if same_file or stems[os.path.normcase(os.path.splitext(name)[0])] > 1:
+            colliding.add(name)
+    return colliding
+
+def is_animation(name):
+    return os.path.splitext(name.lower())[1] in ANIMATION_EXTENSIONS
+
+def load_manifest(path):
+    """Entries of an earlier run, by input name; empty when there is none"""
+    try:
+        with open(path) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return manifest.get("files", {}) if manifest.get("version") == MANIFEST_VERSION else {}
+
+def write_manifest(path, entries, started):
+    """Write the manifest atomically, so an interrupted run leaves the previous one intact; returns it"""
+    done = [entry for entry in entries.values() if entry["outcome"] != OUTCOME_FAILED]
+    input_bytes = sum(entry["input_bytes"] for entry in done)
+    output_bytes = sum(entry["output_bytes"] for entry in done)
+    manifest = {
+        "version": MANIFEST_VERSION,
+        "updated_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "wall_seconds": round(time.time() - started, 3),
+        "input_bytes": input_bytes,
+        "output_bytes": output_bytes,
+        "reduction": round((input_bytes - output_bytes) / input_bytes * 100, 2) if input_bytes else 0.0,
+        "files": dict(sorted(entries.items())),
+    }
+    temp = path + ".tmp"
+    with open(temp, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(temp, path)
+    return manifest
+
+def up_to_date(entry, input_file, output_dir, profile):
+    """Whether an earlier result for input_file is still valid: same input, same settings, output present"""
+    if not entry or entry.get("outcome") == OUTCOME_FAILED or entry.get("profile") != profile:
+        return False
+    stat = os.stat(input_file)
+    return (
+        entry.get("input_bytes") == stat.st_size and entry.get("input_mtime") == stat.st_mtime
+        and os.path.exists(os.path.join(output_dir, entry["output"]))
+    )
+
+def core_sets(processes):
+    """Split the cores between the pool processes, so their encodes do not compete for the same ones"""
+    cores = list(CPU_CORES) if CPU_CORES else available_cores()
+    return [cores[n::processes] or cores for n in range(processes)]
+
+def init_process(cores_queue):
+    """Pool initializer: one event loop, CPU budget and scratch space per process"""
+    global _loop, _budget, _space
+    _loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(_loop)
+    _budget = CpuBudget(cores_queue.get(), pin=CPU_PIN_CORES)
+    _space = scratch_from_config(ram=False)
+
+async def compress_in_process(input_file, output_file, name, target_size):
+    watchdog.start()  # Stays on this process's loop between files
+    work = _space.open(f"batch{os.getpid()}", _space.estimate(os.path.getsize(input_file)))
+    try:
+        return await compress_file(
+            input_file, output_file, _budget, work, animation=is_animation(name), target_size=target_size, label=name
+        )
+    finally:
+        work.close()
+
+def compress_one(input_file, output_file, name, target_size):
+    """Runs in a pool process: compress one file and return the engine's result dict"""
+    try:
+        return _loop.run_until_complete(compress_in_process(input_file, output_file, name, target_size))
+    except Exception as e:
+        log(f"❌ {name}: {type(e).__name__}: {str(e)}")
+        return {"outcome": OUTCOME_FAILED, "input_bytes": os.path.getsize(input_file), "output_bytes": None,
+                "error": str(e) or type(e).__name__}
+
+def main():
+    parser = argparse.ArgumentParser(description="Compress video files and directories with the bot's encoding engine")
+    parser.add_argument("inputs", nargs="*", help="Files or directories (searched recursively for videos and GIFs)")
+    parser.add_argument("-o", "--output-dir", required=True, help="Where results go, in the same layout as the inputs")
+    parser.add_argument("--list", help="File with one input path per line")
+    parser.add_argument("-j", "--processes", type=int, default=BATCH_PROCESSES, help="Files encoded at the same time (0 = one per 4 cores)")
+    parser.add_argument("--target-size", type=float, default=TARGET_SIZE_MB, help="Aim every video at this many MB")
+    parser.add_argument("--manifest", help=f"Manifest path (default: {BATCH_MANIFEST} in the output directory)")
+    parser.add_argument("--force", action="store_true", help="Compress again even when a result is up to date")
+    args = parser.parse_args()
+
+    inputs = find_inputs(args.inputs, args.list)
+    if not inputs:
+        parser.error("no input files found")
+    os.makedirs(args.output_dir, exist_ok=True)
+    manifest_path = args.manifest or os.path.join(args.output_dir, BATCH_MANIFEST)
+    entries = load_manifest(manifest_path)
+    colliding = colliding_names(inputs, args.output_dir)
+    started = time.time()
+
+    todo = []
+    for input_file, name in inputs:
+        profile = result_profile(is_animation(name), args.target_size)
+        if not args.force and up_to_date(entries.get(name), input_file, args.output_dir, profile):
+            continue
+        todo.append((input_file, name, profile))
+    log(f"📦 {len(inputs)} files, {len(inputs) - len(todo)} up to date, {len(todo)} to compress")
+
+    processes = max(1, args.processes or len(available_cores()) // 4)
+    processes = min(processes, max(1, len(todo)))
+    cores_queue = multiprocessing.Queue()
+    for cores in core_sets(processes):
+        cores_queue.put(cores)
+
+    failed = 0
+    with ProcessPoolExecutor(processes, initializer=init_process, initargs=(cores_queue,)) as pool:
+        futures = {}
+        for input_file, name, profile in todo:
+            output_file = os.path.join(args.output_dir, output_name(name, keep_extension=name in colliding))
+            os.makedirs(os.path.dirname(output_file), exist_ok=True)
+            stat = os.stat(input_file)
+            future = pool.submit(compress_one, input_file, output_file, name, args.target_size)
+            futures[future] = (input_file, name, profile, stat)
+
+        for done, future in enumerate(as_completed(futures), 1):
+            input_file, name, profile, stat = futures[future]
+            result = future.result()
+            if result["outcome"] == OUTCOME_ORIGINAL:
+                # The archive stays complete: the input is the result, unless the output directory holds the input
+                kept = os.path.join(args.output_dir, output_name(name, OUTCOME_ORIGINAL))
+                if not (os.path.exists(kept) and os.path.samefile(input_file, kept)):
+                    shutil.copyfile(input_file, kept)
+            if result["outcome"] == OUTCOME_FAILED:
+                failed += 1
+                log(f"❌ [{done}/{len(todo)}] {name}: {result.get('error')}")
+            else:
+                log(
+                    f"✅ [{done}/{len(todo)}] {name}: {round(result['input_bytes'] / MB, 2)} → "
+                    f"{round(result['output_bytes'] / MB, 2)} MB (-{result['reduction']}%, {result['outcome']}) "
+                    f"in {result['total_seconds']} seconds"
+                )
+            entries[name] = {
+                **result,
+                "input": os.path.abspath(input_file),
+                "input_mtime": stat.st_mtime,
+                "output": output_name(name, result["outcome"], name in colliding),
+                "profile": profile,
+            }
+            write_manifest(manifest_path, entries, started)
+
+    manifest = write_manifest(manifest_path, entries, started)
+    log(
+        f"📊 {len(todo) - failed} done, {failed} failed in {round(time.time() - started, 2)} seconds | "
+        f"{round(manifest['input_bytes'] / MB, 2)} → {round(manifest['output_bytes'] / MB, 2)} MB "
+        f"(-{manifest['reduction']}%) | manifest: {manifest_path}"
+    )
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
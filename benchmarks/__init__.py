@@ -0,0 +1,7 @@
+"""Reproducible benchmarks: synthetic media run through the real bot handlers
+
+    python -m benchmarks.run --suite quick
+    python -m benchmarks.run --set VIDEO_PRESET=veryfast --compare benchmarks/results/<earlier>.json
+    python -m benchmarks.run --bot engine
+    python -m benchmarks.filters --suite filters
+"""
@@ -0,0 +1,178 @@
+import asyncio
+import itertools
+import os
+import shutil
+
+MB = 1024 * 1024
+
+
+class FakeChat:
+    def __init__(self, chat_id):
+        self.id = chat_id
+
+
+class FakeUser:
+    def __init__(self, user_id):
+        self.id = user_id
+        self.username = f"bench{user_id}"
+
+
+class FakeMedia:
+    """Attributes of a Pyrogram Video/Document/Animation/Audio/Voice that the bots read"""
+
+    def __init__(self, file_id, path, duration=None, width=None, height=None, mime_type=None):
+        self.file_id = file_id
+        self.file_unique_id = f"unique-{file_id}"
+        self.file_size = os.path.getsize(path)
+        self.file_name = os.path.basename(path)
+        self.duration = duration
+        self.width = width
+        self.height = height
+        self.mime_type = mime_type
+
+
+class FakeMessage:
+    """A message in a fake chat; replies are recorded on the client instead of sent"""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, client, chat_id, text=None, caption=None, user_id=1, media_group_id=None, **media):
+        self.client = client
+        self.id = next(FakeMessage._ids)
+        self.chat = FakeChat(chat_id)
+        self.from_user = FakeUser(user_id)
+        self.text = text
+        self.caption = caption
+        self.command = text.lstrip("/").split() if text and text.startswith("/") else None
+        self.media_group_id = media_group_id
+        for attr in ("video", "document", "animation", "audio", "voice"):
+            setattr(self, attr, media.get(attr))
+        self.edits = 0
+        self.deleted = False
+
+    def __repr__(self):
+        return f"FakeMessage(id={self.id}, chat={self.chat.id})"
+
+    async def reply_text(self, text, **kwargs):
+        return self.client._reply(self, "text", text=text)
+
+    async def edit_text(self, text, **kwargs):
+        self.text = text
+        self.edits += 1
+        return self
+
+    async def delete(self):
+        self.deleted = True
+
+    async def _reply_file(self, kind, path, progress=None, progress_args=(), caption=None, **kwargs):
+        path = path if isinstance(path, str) else getattr(path, "name", "")
+        size = os.path.getsize(path)
+        if progress:
+            progress(size, size, *progress_args)  # One tick, like a finished upload
+        return self.client._reply(self, kind, path=path, caption=caption, size=size, options=kwargs)
+
+    async def reply_video(self, video, **kwargs):
+        return await self._reply_file("video", video, **kwargs)
+
+    async def reply_document(self, document, **kwargs):
+        return await self._reply_file("document", document, **kwargs)
+
+    async def reply_animation(self, animation, **kwargs):
+        return await self._reply_file("animation", animation, **kwargs)
+
+    async def reply_voice(self, voice, **kwargs):
+        return await self._reply_file("voice", voice, **kwargs)
+
+    async def reply_audio(self, audio, **kwargs):
+        return await self._reply_file("audio", audio, **kwargs)
+
+
+class FakeClient:
+    """Stand-in for pyrogram.Client that serves files from disk
+
+    Downloads are served from the registered paths in 1 MB chunks, like
+    Telegram's stream_media; everything the bots send is kept in replies.
+    """
+
+    def __init__(self, chunk_delay=0):
+        self.files = {}  # file_id -> path
+        self.replies = []  # Dicts describing every message the bots sent
+        self.chunk_delay = chunk_delay  # Seconds per chunk, to simulate a slow link
+        self.bytes_served = 0
+        self._file_ids = itertools.count(1)
+        self._message_ids = itertools.count(1000000)
+
+    def add_file(self, path):
+        """Register a file and return its file_id"""
+        file_id = f"file{next(self._file_ids)}"
+        self.files[file_id] = path
+        return file_id
+
+    def message(self, kind, path, chat_id=1, user_id=1, caption=None, media_group_id=None, **info):
+        """A message carrying path as a video, document, animation, audio or voice"""
+        media = FakeMedia(self.add_file(path), path, **info)
+        return FakeMessage(self, chat_id, caption=caption, user_id=user_id, media_group_id=media_group_id, **{kind: media})
+
+    def _reply(self, to, kind, **details):
+        sent = FakeMessage(self, to.chat.id)
+        sent.id = next(self._message_ids)
+        if "path" in details:
+            # A sent file gets a file_id of its own, so the result can be served from cache
+            media = FakeMedia(self.add_file(details["path"]), details["path"])
+            setattr(sent, kind if kind in ("video", "document", "animation", "audio", "voice") else "document", media)
+        self.replies.append({"kind": kind, "reply_to": to.id, "message": sent, **details})
+        return sent
+
+    async def stream_media(self, file_id, offset=0, limit=0):
+        """Yield the file in 1 MB chunks starting at chunk offset"""
+        with open(self.files[file_id], 'rb') as f:
+            f.seek(offset * MB)
+            sent = 0
+            while not limit or sent < limit:
+                chunk = f.read(MB)
+                if not chunk:
+                    return
+                if self.chunk_delay:
+                    await asyncio.sleep(self.chunk_delay)
+                self.bytes_served += len(chunk)
+                sent += 1
+                yield chunk
+
+    async def download_media(self, file_id, file_name=None, progress=None, progress_args=(), in_memory=False, **kwargs):
+        """Copy the file to file_name, like Client.download_media"""
+        source = self.files[getattr(file_id, "file_id", file_id)]
+        target = file_name or os.path.join("downloads", os.path.basename(source))
+        os.makedirs(os.path.dirname(target) or ".", exist_ok=True)
+        shutil.copyfile(source, target)
+        size = os.path.getsize(target)
+        self.bytes_served += size
+        if progress:
+            progress(size, size, *progress_args)
+        return target
+
+    async def send_cached_media(self, chat_id, file_id, caption=None, reply_to_message_id=None, **kwargs):
+        path = self.files.get(file_id)
+        to = FakeMessage(self, chat_id)
+        to.id = reply_to_message_id
+        if not (path and os.path.exists(path)):
+            return self._reply(to, "cached", caption=caption, size=None)  # Its temp file is gone; Telegram still has it
+        return self._reply(to, "cached", path=path, caption=caption, size=os.path.getsize(path))
+
+    async def send_video(self, chat_id, video, reply_to_message_id=None, **kwargs):
+        to = FakeMessage(self, chat_id)
+        to.id = reply_to_message_id
+        return await to.reply_video(video, **kwargs)
+
+    async def send_media_group(self, chat_id, media, reply_to_message_id=None, **kwargs):
+        """Record an album; every item becomes a message of its own, like in Telegram"""
+        to = FakeMessage(self, chat_id)
+        to.id = reply_to_message_id
+        sent = []
+        for item in media:
+            kind = "document" if type(item).__name__ == "InputMediaDocument" else "video"
+            path = self.files.get(item.media, item.media)  # A file_id or a local file
+            sent.append(self._reply(to, kind, path=path, caption=item.caption, size=os.path.getsize(path), album=True))
+        return sent
+
+    async def get_messages(self, chat_id, message_ids):
+        return None  # Nothing to restore in a benchmark
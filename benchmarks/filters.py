@@ -0,0 +1,131 @@
+import argparse
+import json
+import os
+import resource
+import shutil
+import subprocess
+import tempfile
+import time
+from benchmarks.media import PROFILES, SUITES, ensure_media
+from benchmarks.run import MEDIA_DIR, RESULTS_DIR, host_info, media_info
+from config import VIDEO_SCALE, VIDEO_FPS, VIDEO_CRF, VIDEO_PIXEL_FORMAT
+from encoder import build_fast_ffmpeg_command, audio_encode_args
+from utils import log
+
+COMMANDS = ("legacy", "graph")
+
+
+def legacy_command(input_file, output_file, threads):
+    """build_fast_ffmpeg_command before the filter graph: scale every frame, then drop frames with -r"""
+    return [
+        'ffmpeg', '-threads', str(threads), '-i', input_file,
+        '-vf', f'scale={VIDEO_SCALE}:flags=fast_bilinear',
+        '-r', str(VIDEO_FPS),
+        '-c:v', 'libx264', '-preset', 'ultrafast', '-crf', str(VIDEO_CRF),
+        '-pix_fmt', VIDEO_PIXEL_FORMAT, '-threads', str(threads),
+        '-movflags', '+faststart',
+        *audio_encode_args(),
+        '-map_metadata', '-1',
+        '-progress', 'pipe:1', '-nostats',
+        '-y', output_file,
+    ]
+
+def probe(path):
+    result = subprocess.run(
+        ['ffprobe', '-v', 'error', '-print_format', 'json', '-show_format', '-show_streams', path],
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+    )
+    return json.loads(result.stdout or b'{}')
+
+def time_command(cmd):
+    """Run an ffmpeg argv and return (returncode, wall seconds, CPU seconds)"""
+    before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    started = time.perf_counter()
+    result = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    wall = time.perf_counter() - started
+    after = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu = (after.ru_utime - before.ru_utime) + (after.ru_stime - before.ru_stime)
+    return result.returncode, wall, cpu
+
+def run_profile(name, media_dir, threads, repeat, work_dir):
+    """Encode one input with both commands and return a result dict per command; the best of repeat runs counts"""
+    path = ensure_media(name, media_dir)
+    info = probe(path)
+    frames = media_info(path)["frames"]
+    results = []
+    for command in COMMANDS:
+        output = os.path.join(work_dir, f"{name}.{command}.mp4")
+        if command == "legacy":
+            cmd = legacy_command(path, output, threads)
+        else:
+            cmd, _ = build_fast_ffmpeg_command(path, output, threads=threads, info=info)
+        runs = [time_command(cmd) for _ in range(max(1, repeat))]
+        returncode, wall, cpu = min(runs, key=lambda run: run[1])
+        video = next((s for s in probe(output).get("streams", []) if s.get("codec_type") == "video"), {}) if returncode == 0 else {}
+        results.append({
+            "profile": name,
+            "command": command,
+            "returncode": returncode,
+            "wall_seconds": round(wall, 3),
+            "cpu_seconds": round(cpu, 3),
+            # Input frames per wall second, the figure the filter graph is meant to raise
+            "fps": round(frames / wall, 1) if frames and wall else None,
+            "output_bytes": os.path.getsize(output) if returncode == 0 else None,
+            "output_size": f"{video.get('width')}x{video.get('height')}" if video else None,
+            "argv": cmd,
+        })
+    return results
+
+def print_results(results):
+    """Table of both commands per input, with the fps gained by the filter graph"""
+    log(f"{'profile':28} {'command':7} {'wall s':>8} {'cpu s':>8} {'fps':>8} {'out MB':>7} {'size':>10}")
+    by_profile = {}
+    for r in results:
+        by_profile.setdefault(r["profile"], {})[r["command"]] = r
+        out_mb = round(r["output_bytes"] / (1024 * 1024), 2) if r["output_bytes"] else "-"
+        log(f"{r['profile']:28} {r['command']:7} {r['wall_seconds']:>8} {r['cpu_seconds']:>8} "
+            f"{r['fps'] or '-':>8} {out_mb:>7} {r['output_size'] or 'failed':>10}")
+    for name, pair in by_profile.items():
+        legacy, graph = pair.get("legacy"), pair.get("graph")
+        if legacy and graph and legacy["fps"] and graph["fps"]:
+            log(f"⚡ {name}: {(graph['fps'] - legacy['fps']) / legacy['fps'] * 100:+.1f}% fps, "
+                f"{(graph['cpu_seconds'] - legacy['cpu_seconds']) / max(legacy['cpu_seconds'], 0.001) * 100:+.1f}% CPU")
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the old fixed video filter with the probe-based filter graph")
+    parser.add_argument("--suite", choices=sorted(SUITES), default="filters", help="Profiles to run")
+    parser.add_argument("--profile", action="append", choices=sorted(PROFILES), help="Run these profiles instead of a suite")
+    parser.add_argument("--threads", type=int, default=os.cpu_count() or 4, help="ffmpeg threads for both commands")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per command; the fastest counts")
+    parser.add_argument("--media-dir", default=MEDIA_DIR, help="Where generated inputs are cached")
+    parser.add_argument("--output", help="JSON report path (default: benchmarks/results/filters-<time>.json)")
+    args = parser.parse_args()
+
+    names = [name for name in args.profile or SUITES[args.suite] if PROFILES[name]["kind"] not in ("voice", "audio")]
+    for name in names:
+        ensure_media(name, args.media_dir)  # Generated up front, outside the measurements
+
+    work_dir = tempfile.mkdtemp(prefix="filters_")
+    try:
+        results = []
+        for name in names:
+            log(f"⏱️  {name}")
+            results += run_profile(name, args.media_dir, args.threads, args.repeat, work_dir)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "host": host_info(),
+        "threads": args.threads,
+        "results": results,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, "filters-" + time.strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print_results(results)
+    log(f"📄 Report written to {output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+import os
+import subprocess
+from utils import log
+
+# Every input is generated from ffmpeg's lavfi sources with bit-exact
+# flags and a single thread, so the same profile gives the same bytes on
+# every run and benchmark numbers stay comparable.
+PROFILES = {
+    "video_480p_h264": {
+        "kind": "video", "width": 854, "height": 480, "fps": 30, "duration": 30,
+        "video_codec": "libx264", "audio": True, "container": "mp4", "faststart": False,
+    },
+    "video_720p_h264_faststart": {
+        "kind": "video", "width": 1280, "height": 720, "fps": 30, "duration": 30,
+        "video_codec": "libx264", "audio": True, "container": "mp4", "faststart": True,
+    },
+    "video_1080p_h264": {
+        "kind": "video", "width": 1920, "height": 1080, "fps": 30, "duration": 20,
+        "video_codec": "libx264", "audio": True, "container": "mp4", "faststart": False,
+    },
+    "document_720p_mpeg4_mkv": {
+        "kind": "document", "width": 1280, "height": 720, "fps": 25, "duration": 30,
+        "video_codec": "mpeg4", "audio": True, "container": "mkv",
+    },
+    "document_480p_vp8_webm": {
+        "kind": "document", "width": 854, "height": 480, "fps": 30, "duration": 15,
+        "video_codec": "libvpx", "audio": True, "container": "webm",
+    },
+    "animation_480p": {
+        "kind": "animation", "width": 480, "height": 270, "fps": 25, "duration": 5,
+        "video_codec": "libx264", "audio": False, "container": "mp4", "faststart": True,
+    },
+    "voice_30s": {
+        "kind": "voice", "duration": 30, "audio_codec": "libopus", "container": "ogg",
+    },
+    "audio_120s": {
+        "kind": "audio", "duration": 120, "audio_codec": "aac", "container": "m4a",
+    },
+    "video_2160p60_h264": {
+        "kind": "video", "width": 3840, "height": 2160, "fps": 60, "duration": 5,
+        "video_codec": "libx264", "audio": True, "container": "mp4", "faststart": False,
+    },
+    "video_1080p_h264_long": {
+        "kind": "video", "width": 1920, "height": 1080, "fps": 30, "duration": 660,
+        "video_codec": "libx264", "audio": True, "container": "mp4", "faststart": False,
+    },
+}
+
+SUITES = {
+    "quick": ["video_480p_h264", "document_720p_mpeg4_mkv", "animation_480p", "voice_30s"],
+    "full": [name for name in PROFILES if name != "video_1080p_h264_long"],
+    "long": ["video_1080p_h264_long"],  # Long enough for the segmented encoder
+    # One input per class the filter graph treats differently: big downscale, high fps, lowres codec, no scaling
+    "filters": ["video_2160p60_h264", "video_1080p_h264", "document_720p_mpeg4_mkv", "document_480p_vp8_webm", "animation_480p"],
+}
+
+MIME_TYPES = {"mp4": "video/mp4", "mkv": "video/x-matroska", "webm": "video/webm", "ogg": "audio/ogg", "m4a": "audio/mp4"}
+
+
+def build_media_command(profile, output_file):
+    """ffmpeg argv that renders a profile from lavfi test sources"""
+    duration = str(profile["duration"])
+    cmd = ['ffmpeg', '-v', 'error', '-threads', '1']
+    if profile["kind"] in ("voice", "audio"):
+        cmd += ['-f', 'lavfi', '-i', f'sine=frequency=440:beep_factor=4:sample_rate=48000:duration={duration}']
+        cmd += ['-c:a', profile["audio_codec"], '-b:a', '128k']
+    else:
+        size = f'{profile["width"]}x{profile["height"]}'
+        cmd += ['-f', 'lavfi', '-i', f'testsrc2=size={size}:rate={profile["fps"]}:duration={duration}']
+        if profile["audio"]:
+            cmd += ['-f', 'lavfi', '-i', f'sine=frequency=1000:sample_rate=48000:duration={duration}']
+            cmd += ['-c:a', 'libopus' if profile["container"] == "webm" else 'aac', '-b:a', '128k']
+        else:
+            cmd += ['-an']
+        cmd += ['-c:v', profile["video_codec"], '-pix_fmt', 'yuv420p', '-b:v', '4M', '-threads', '1']
+        if profile["video_codec"] == "libx264":
+            cmd += ['-preset', 'ultrafast']
+        if profile.get("faststart"):
+            cmd += ['-movflags', '+faststart']
+    cmd += ['-fflags', '+bitexact', '-flags', '+bitexact', '-map_metadata', '-1', '-y', output_file]
+    return cmd
+
+def media_path(directory, name):
+    return os.path.join(directory, f"{name}.{PROFILES[name]['container']}")
+
+def ensure_media(name, directory):
+    """Path of a profile's input, rendered on first use and reused afterwards"""
+    path = media_path(directory, name)
+    if os.path.exists(path):
+        return path
+    os.makedirs(directory, exist_ok=True)
+    partial = os.path.join(directory, f"{name}.partial.{PROFILES[name]['container']}")  # Never reused half-written
+    cmd = build_media_command(PROFILES[name], partial)
+    log(f"🧪 Generating {name}...")
+    result = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        raise RuntimeError(f"Could not generate {name}: {result.stderr.decode('utf-8', 'replace').strip()}")
+    os.replace(partial, path)
+    return path
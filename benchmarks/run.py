@@ -0,0 +1,284 @@
+import argparse
+import ast
+import asyncio
+import importlib
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from benchmarks.fake_client import FakeClient
+from benchmarks.media import PROFILES, SUITES, MIME_TYPES, ensure_media
+from utils import log
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MEDIA_DIR = os.path.join(REPO_DIR, "benchmarks", "media")
+RESULTS_DIR = os.path.join(REPO_DIR, "benchmarks", "results")
+RESULT_MARKER = "BENCHMARK_RESULT "
+
+# Handler each bot registers for a kind of message; "engine" runs engine.compress_file without a bot
+HANDLERS = {
+    "video": {"bot2": "handle_video", "bot": "handle_media", "engine": "compress_file"},
+    "animation": {"bot2": "handle_video", "bot": "handle_media", "engine": "compress_file"},
+    "document": {"bot2": "handle_document_video", "bot": "handle_document", "engine": "compress_file"},
+    "voice": {"bot": "handle_audio"},
+    "audio": {"bot": "handle_audio"},
+}
+
+FILE_REPLIES = ("video", "document", "animation", "voice", "audio", "cached")
+
+
+def parse_overrides(pairs):
+    """KEY=VALUE strings to a dict; values are Python literals where possible"""
+    overrides = {}
+    for pair in pairs:
+        key, _, value = pair.partition("=")
+        try:
+            overrides[key] = ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            overrides[key] = value
+    return overrides
+
+def apply_overrides(overrides, work_dir):
+    """Patch config before a bot is imported: no cache, no endpoint, state kept in work_dir"""
+    import config
+    settings = {
+        "CACHE_ENABLED": False,
+        "CACHE_PATH": os.path.join(work_dir, "cache.db"),
+        "REMOTE_ENCODE": False,
+        "METRICS_PORT": 0,
+        "METRICS_HISTORY_PATH": os.path.join(work_dir, "history.db"),
+        "SCRATCH_DIR": os.path.join(work_dir, "scratch"),
+        "SCRATCH_RAM_DIR": f"/dev/shm/compressbot_bench_{os.getpid()}",
+        "USER_DAILY_QUOTA_MB": 0,
+    }
+    settings.update(overrides)
+    for key, value in settings.items():
+        setattr(config, key, value)
+    return settings["SCRATCH_RAM_DIR"]
+
+def media_info(path):
+    """Duration, size and frame count of an input, from ffprobe"""
+    result = subprocess.run(
+        ['ffprobe', '-v', 'error', '-print_format', 'json', '-show_format', '-show_streams', path],
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+    )
+    info = json.loads(result.stdout or b'{}')
+    duration = float(info.get("format", {}).get("duration") or 0)
+    video = next((s for s in info.get("streams", []) if s.get("codec_type") == "video"), None)
+    frames = None
+    if video:
+        numerator, _, denominator = (video.get("avg_frame_rate") or "0/1").partition("/")
+        rate = float(numerator) / float(denominator or 1) if float(denominator or 1) else 0
+        frames = int(duration * rate)
+    return {
+        "duration": duration,
+        "width": video.get("width") if video else None,
+        "height": video.get("height") if video else None,
+        "frames": frames,
+    }
+
+async def wait_for_pipeline(bot):
+    """Wait until bot2 has no admitted or waiting job and no album left to collect or send"""
+    while bot.pipeline.in_flight or bot.admission.stats()["waiting"] or bot.albums.pending or bot.album_tasks:
+        await asyncio.sleep(0.05)
+
+async def run_child(name, bot_name, media_dir):
+    """Run one profile through one bot's handler in this process and return its figures"""
+    profile = PROFILES[name]
+    handler_name = HANDLERS[profile["kind"]][bot_name]
+    path = ensure_media(name, media_dir)
+    info = media_info(path)
+
+    client = FakeClient()
+    if bot_name == "engine":
+        # Imported only now, after apply_overrides changed config
+        engine = importlib.import_module("engine")
+        budget = importlib.import_module("resources").CpuBudget()
+        space = importlib.import_module("scratch").scratch_from_config()
+        work = space.open(name, space.estimate(os.path.getsize(path)))
+        output_path = work.path("output.mp4")
+        run = lambda: engine.compress_file(path, output_path, budget, work, animation=profile["kind"] == "animation")
+    else:
+        bot = importlib.import_module(bot_name)
+        message = client.message(
+            profile["kind"], path, duration=int(info["duration"]), width=info["width"], height=info["height"],
+            mime_type=MIME_TYPES.get(profile["container"])
+        )
+        bot.progress.start()
+        bot.scratch.start()
+        if bot_name == "bot2":
+            bot.pipeline.start()
+            bot.admission.start()
+        run = lambda: getattr(bot, handler_name)(client, message)
+
+    self_before = resource.getrusage(resource.RUSAGE_SELF)
+    children_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    started = time.perf_counter()
+    handled = await run()
+    if bot_name == "bot2":
+        await wait_for_pipeline(bot)
+    wall = time.perf_counter() - started
+    self_after = resource.getrusage(resource.RUSAGE_SELF)
+    children_after = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    input_bytes = os.path.getsize(path)
+    if bot_name == "engine":
+        outcome, output_bytes = handled["outcome"], handled["output_bytes"]
+        work.close()
+    else:
+        files = [reply for reply in client.replies if reply["kind"] in FILE_REPLIES]
+        outcome = files[-1]["kind"] if files else "error"
+        output_bytes = files[-1]["size"] if files else None
+    bot_cpu = (self_after.ru_utime - self_before.ru_utime) + (self_after.ru_stime - self_before.ru_stime)
+    ffmpeg_cpu = (children_after.ru_utime - children_before.ru_utime) + (children_after.ru_stime - children_before.ru_stime)
+
+    encode_seconds = ffmpeg_fps = None
+    if bot_name == "engine":
+        encode_seconds = handled["encode_seconds"]
+    elif bot_name == "bot2":
+        summary = bot.job_history.summary(0)
+        encode_seconds = summary["latency"]["encode"]["p50"]
+        ffmpeg_fps = summary["encode_fps_p50"]
+    frames = info["frames"]
+    return {
+        "profile": name,
+        "bot": bot_name,
+        "handler": handler_name,
+        "outcome": outcome,
+        "input_bytes": input_bytes,
+        "output_bytes": output_bytes,
+        "reduction_percent": round((1 - output_bytes / input_bytes) * 100, 2) if output_bytes else None,
+        "wall_seconds": round(wall, 3),
+        "cpu_seconds": round(bot_cpu + ffmpeg_cpu, 3),
+        "bot_cpu_seconds": round(bot_cpu, 3),
+        "ffmpeg_cpu_seconds": round(ffmpeg_cpu, 3),
+        "cpu_utilisation": round((bot_cpu + ffmpeg_cpu) / wall, 2) if wall else None,
+        "peak_rss_mb": round(self_after.ru_maxrss / 1024, 1),  # Linux reports KB
+        "ffmpeg_peak_rss_mb": round(children_after.ru_maxrss / 1024, 1),
+        "frames": frames,
+        "encode_seconds": round(encode_seconds, 3) if encode_seconds else None,
+        # Frames per second of the whole request, and as ffmpeg itself reported it
+        "fps": round(frames / (encode_seconds or wall), 1) if frames else None,
+        "ffmpeg_fps": ffmpeg_fps,
+        "replies": [reply["kind"] for reply in client.replies],
+    }
+
+def child_main(args):
+    """Entry point of the subprocess that runs one profile, so RSS and CPU are per profile"""
+    work_dir = tempfile.mkdtemp(prefix="benchmark_")
+    ram_dir = apply_overrides(parse_overrides(args.set), work_dir)
+    try:
+        result = asyncio.run(run_child(args.child, args.bot, args.media_dir))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        shutil.rmtree(ram_dir, ignore_errors=True)
+    print(RESULT_MARKER + json.dumps(result), flush=True)
+
+def run_profile(name, bot_name, args):
+    """Run one profile in a fresh interpreter and return its result dict"""
+    cmd = [sys.executable, "-m", "benchmarks.run", "--child", name, "--bot", bot_name, "--media-dir", args.media_dir]
+    for pair in args.set:
+        cmd += ["--set", pair]
+    result = subprocess.run(cmd, cwd=REPO_DIR, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    for line in reversed(result.stdout.splitlines()):
+        if line.startswith(RESULT_MARKER):
+            return json.loads(line[len(RESULT_MARKER):])
+    tail = (result.stderr or result.stdout).strip().splitlines()[-5:]
+    return {"profile": name, "bot": bot_name, "outcome": "crashed", "error": "\n".join(tail)}
+
+def host_info():
+    try:
+        ffmpeg = subprocess.run(['ffmpeg', '-version'], stdout=subprocess.PIPE, text=True).stdout.splitlines()[0]
+    except (OSError, IndexError):
+        ffmpeg = None
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True
+        ).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "ffmpeg": ffmpeg,
+    }
+
+def print_results(results, baseline=None):
+    """Table of the main figures, with the change against a baseline report when given"""
+    previous = {(r["profile"], r["bot"]): r for r in (baseline or {}).get("results", [])}
+    log(f"{'profile':28} {'bot':6} {'outcome':10} {'wall s':>8} {'cpu s':>8} {'rss MB':>7} {'out MB':>7} {'fps':>7}")
+    for r in results:
+        out_mb = round(r["output_bytes"] / (1024 * 1024), 2) if r.get("output_bytes") else "-"
+        line = (f"{r['profile']:28} {r['bot']:6} {r['outcome']:10} {r.get('wall_seconds', '-'):>8} "
+                f"{r.get('cpu_seconds', '-'):>8} {r.get('peak_rss_mb', '-'):>7} {out_mb:>7} {r.get('fps') or '-':>7}")
+        old = previous.get((r["profile"], r["bot"]))
+        if old and old.get("wall_seconds") and r.get("wall_seconds"):
+            change = (r["wall_seconds"] - old["wall_seconds"]) / old["wall_seconds"] * 100
+            line += f"  wall {change:+.1f}%"
+            if old.get("output_bytes") and r.get("output_bytes"):
+                line += f", size {(r['output_bytes'] - old['output_bytes']) / old['output_bytes'] * 100:+.1f}%"
+        log(line)
+
+def main():
+    parser = argparse.ArgumentParser(description="Run synthetic media through the bot handlers and report timings")
+    parser.add_argument("--suite", choices=sorted(SUITES), default="quick", help="Profiles to run")
+    parser.add_argument("--profile", action="append", choices=sorted(PROFILES), help="Run these profiles instead of a suite")
+    parser.add_argument(
+        "--bot", choices=("bot2", "bot", "engine", "both"), default="bot2",
+        help="Which bot's handlers to run; engine runs the compression engine without a bot"
+    )
+    parser.add_argument("--set", action="append", default=[], metavar="KEY=VALUE", help="Override a config.py setting")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per profile")
+    parser.add_argument("--media-dir", default=MEDIA_DIR, help="Where generated inputs are cached")
+    parser.add_argument("--output", help="JSON report path (default: benchmarks/results/<time>.json)")
+    parser.add_argument("--compare", help="Earlier JSON report to compare against")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child_main(args)
+        return
+
+    bots = ("bot2", "bot") if args.bot == "both" else (args.bot,)
+    names = args.profile or SUITES[args.suite]
+    for name in names:
+        ensure_media(name, args.media_dir)  # Generated up front, outside the measurements
+
+    results = []
+    for name in names:
+        for bot_name in bots:
+            if bot_name not in HANDLERS[PROFILES[name]["kind"]]:
+                continue  # e.g. bot2 has no voice handler
+            for run in range(max(1, args.repeat)):
+                log(f"⏱️  {name} on {bot_name} (run {run + 1})")
+                result = run_profile(name, bot_name, args)
+                result["run"] = run + 1
+                results.append(result)
+
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "host": host_info(),
+        "overrides": parse_overrides(args.set),
+        "results": results,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, time.strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+    log(f"📄 Report written to {output}")
+
+if __name__ == "__main__":
+    main()
@@ -1,137 +1,141 @@
 import os
-import tempfile
-import subprocess
-import re
-import threading
-from pyrogram import Client, filters
+from pyrogram import Client, filters, idle
 from pyrogram.types import InlineKeyboardButton, InlineKeyboardMarkup, CallbackQuery
-from pydub import AudioSegment
 from config import *
+from audio import build_audio_command, audio_output_suffix
+from encoder import run_ffmpeg
+from engine import compress_file, VIDEO_EXTENSIONS, OUTCOME_COMPRESSED, OUTCOME_ORIGINAL
+from probe import probe_media, get_duration
+from progress import ProgressUpdater, format_progress, ffmpeg_percentage
+from resources import CpuBudget
+from target_size import parse_target_size
+from scratch import scratch_from_config
+from utils import log
+from watchdog import watchdog
 
 app = Client("bot", api_id=API_ID, api_hash=API_HASH, bot_token=API_TOKEN)
+progress = ProgressUpdater(PROGRESS_GLOBAL_RATE, PROGRESS_CHAT_INTERVAL)
+scratch = scratch_from_config()
+cpu_budget = CpuBudget(CPU_CORES, pin=CPU_PIN_CORES)
+
+BUSY_TEXT = "🚫 سرور در حال حاضر فضای کافی ندارد. لطفا چند دقیقه دیگر دوباره تلاش کنید."
+
+async def open_scratch(message, media):
+    """پوشه موقت مخصوص این پیام، یا None اگر فضای کافی نباشد"""
+    needed = scratch.estimate(media.file_size or 0)
+    if not scratch.fits(needed):
+        await message.reply_text(BUSY_TEXT)
+        return None
+    return scratch.open(f"msg{message.chat.id}_{message.id}", needed)
 
 @app.on_message(filters.command("start"))
-def start(client, message):
+async def start(client, message):
     markup = InlineKeyboardMarkup([[InlineKeyboardButton("Compress Audio 🎧", callback_data="compress_audio"),
                                     InlineKeyboardButton("Compress Video 🎥", callback_data="compress_video")]])
-    message.reply_text("Choose what you want to compress:", reply_markup=markup)
+    await message.reply_text("Choose what you want to compress:", reply_markup=markup)
 
 @app.on_callback_query()
-def callback(client, callback_query: CallbackQuery):
-    callback_query.message.reply_text("Send me a file.")
+async def callback(client, callback_query: CallbackQuery):
+    await callback_query.message.reply_text("Send me a file.")
 
 @app.on_message(filters.voice | filters.audio)
-def handle_audio(client, message):
-    file = client.download_media(message.voice.file_id if message.chat.type == "voice" else message.audio.file_id)
-    audio = AudioSegment.from_file(file).set_channels(AUDIO_CHANNELS).set_frame_rate(AUDIO_SAMPLE_RATE)
-    with tempfile.NamedTemporaryFile(suffix=TEMP_FILE_SUFFIX_AUDIO, delete=False) as temp_file:
-        temp_filename = temp_file.name
-        audio.export(temp_filename, format=AUDIO_FORMAT, bitrate=AUDIO_BITRATE)
-    message.reply_document(temp_filename)
-    os.remove(file)
-    os.remove(temp_filename)
-
-def parse_time_to_seconds(time_str):
-    """تبدیل زمان از فرمت HH:MM:SS.mmm به ثانیه"""
-    try:
-        parts = time_str.split(':')
-        if len(parts) == 3:
-            hours, minutes, seconds = parts
-            return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
-        return 0
-    except:
-        return 0
-
-def run_ffmpeg_with_progress(cmd, message, client):
-    """اجرای ffmpeg با نمایش پیشرفت"""
+async def handle_audio(client, message):
+    """فشرده‌سازی صدا با ffmpeg به صورت جریانی، بدون بارگذاری کل فایل در حافظه"""
+    speech = message.voice is not None  # پیام صوتی: پروفایل مخصوص گفتار
+    media = message.voice if speech else message.audio
+    work = await open_scratch(message, media)
+    if work is None:
+        return
+    # همه فایل‌های موقت در پوشه پیام هستند و در هر حالتی پاک می‌شوند
+    with work:
+        file = await client.download_media(media.file_id, file_name=work.path("input"))
+        temp_filename = work.path("output" + audio_output_suffix(speech))
+
+        cmd = build_audio_command(file, temp_filename, speech=speech)
+        returncode, status_msg = await run_ffmpeg_with_progress(cmd, message, client, file)
+        if returncode == 0:
+            await status_msg.edit_text("✅ پردازش کامل شد! در حال ارسال...")
+            if speech:
+                await message.reply_voice(temp_filename)
+            else:
+                await message.reply_document(temp_filename)
+            await status_msg.delete()
+        else:
+            await status_msg.edit_text("❌ خطا در پردازش فایل")
+
+async def run_ffmpeg_with_progress(cmd, message, client, input_file, info=None):
+    """اجرای ffmpeg با نمایش پیشرفت از خروجی -progress و مدت زمان ffprobe"""
     # ارسال پیام اولیه
-    status_msg = message.reply_text("⏳ در حال پردازش... 0%")
-    
-    process = subprocess.Popen(
-        cmd,
-        shell=True,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        universal_newlines=True,
-        bufsize=1
-    )
-    
-    duration = None
-    last_percentage = 0
-    
-    # خواندن خروجی stderr برای دریافت اطلاعات پیشرفت
-    while True:
-        output = process.stderr.readline()
-        if output == '' and process.poll() is not None:
-            break
-        if output:
-            line = output.strip()
-            # استخراج مدت زمان ویدیو
-            if duration is None:
-                duration_match = re.search(r'Duration: (\d{2}:\d{2}:\d{2}\.\d{2})', line)
-                if duration_match:
-                    duration = parse_time_to_seconds(duration_match.group(1))
-            
-            # استخراج زمان فعلی
-            time_match = re.search(r'time=(\d{2}:\d{2}:\d{2}\.\d{2})', line)
-            if time_match and duration:
-                current_time = parse_time_to_seconds(time_match.group(1))
-                percentage = int((current_time / duration) * 100)
-                
-                # به‌روزرسانی فقط اگر درصد تغییر کرده باشد
-                if percentage != last_percentage and percentage <= 100:
-                    last_percentage = percentage
-                    try:
-                        progress_bar = "█" * (percentage // 5) + "░" * (20 - percentage // 5)
-                        status_msg.edit_text(f"⏳ در حال پردازش... {percentage}%\n{progress_bar}")
-                    except:
-                        pass
-    
-    process.wait()
-    return process.returncode, status_msg
+    status_msg = await message.reply_text("⏳ در حال پردازش... 0%")
+    duration = get_duration(info or await probe_media(input_file))
+
+    def on_progress(block):
+        percentage = ffmpeg_percentage(block, duration)
+        if percentage is not None:
+            # به‌روزرسانی‌ها در ProgressUpdater ادغام و محدود می‌شوند
+            progress.update(status_msg, format_progress("⏳ در حال پردازش...", percentage))
+
+    returncode, stderr, _ = await run_ffmpeg(cmd, on_progress=on_progress)
+    progress.discard(status_msg)
+    if returncode != 0:
+        log(f"❌ FFmpeg exited with code {returncode}")
+        log("FFmpeg error: " + "\n".join(stderr.strip().splitlines()[-5:]))
+    return returncode, status_msg
 
 def is_video_file(filename):
     """بررسی اینکه آیا فایل یک فایل ویدیویی است"""
-    video_extensions = ['.mkv', '.mp4', '.avi', '.mov', '.wmv', '.flv', '.webm', '.m4v']
     if filename:
         ext = os.path.splitext(filename.lower())[1]
-        return ext in video_extensions
+        return ext in VIDEO_EXTENSIONS
     return False
 
 @app.on_message(filters.video | filters.animation)
-def handle_media(client, message):
+async def handle_media(client, message):
     print(message)
-    file = client.download_media(message.video.file_id if message.video else message.animation.file_id)
-    with tempfile.NamedTemporaryFile(suffix='.mp4', delete=False) as temp_file:
-        temp_filename = temp_file.name
-    
-    print("temp_filename", temp_filename)
-    # پردازش انیمیشن
-    if message.animation:
-        cmd = f'ffmpeg -i "{file}" "{temp_filename}"'
-        returncode, status_msg = run_ffmpeg_with_progress(cmd, message, client)
-        if returncode != 0:
-            status_msg.edit_text("❌ خطا در پردازش فایل")
-            os.remove(file)
-            return
-    
-    print("step 2")
-    # پردازش ویدیو با فشرده‌سازی
-    cmd = f'ffmpeg -i "{file}" -filter_complex "scale={VIDEO_SCALE}" -r {VIDEO_FPS} -c:v {VIDEO_CODEC} -pix_fmt {VIDEO_PIXEL_FORMAT} -b:v {VIDEO_BITRATE} -crf {VIDEO_CRF} -preset {VIDEO_PRESET} -c:a {VIDEO_AUDIO_CODEC} -b:a {VIDEO_AUDIO_BITRATE} -ac {VIDEO_AUDIO_CHANNELS} -ar {VIDEO_AUDIO_SAMPLE_RATE} -profile:v {VIDEO_PROFILE} -map_metadata -1 "{temp_filename}"'
-    returncode, status_msg = run_ffmpeg_with_progress(cmd, message, client)
-    print("step 3")
-    if returncode == 0:
-        status_msg.edit_text("✅ پردازش کامل شد! در حال ارسال...")
-        message.reply_video(temp_filename)
-        status_msg.delete()
+    work = await open_scratch(message, message.video or message.animation)
+    if work is None:
+        return
+    with work:
+        file = await client.download_media(
+            message.video.file_id if message.video else message.animation.file_id, file_name=work.path("input")
+        )
+        temp_filename = work.path("output.mp4")
+
+        print("temp_filename", temp_filename)
+        # انیمیشن: یک مرحله بدون صدا، به جای تبدیل و سپس فشرده‌سازی دوباره
+        await compress_and_reply(message, file, temp_filename, work, animation=message.animation is not None)
+
+async def compress_and_reply(message, file, temp_filename, work, animation=False):
+    """فشرده‌سازی با موتور مشترک bot2 و کارگرها (برنامه‌ریزی، حجم هدف، انیمیشن) و ارسال نتیجه"""
+    status_msg = await message.reply_text("⏳ در حال پردازش... 0%")
+    reply = message.reply_animation if animation else message.reply_video
+
+    def on_progress(block, duration):
+        percentage = ffmpeg_percentage(block, duration)
+        if percentage is not None:
+            progress.update(status_msg, format_progress("⏳ در حال پردازش...", percentage))
+
+    # حجم هدف مثل bot2: عنوانی که فقط یک حجم است (مثل 20mb)، یا TARGET_SIZE_MB
+    target_size = None if animation else parse_target_size(message.caption) or TARGET_SIZE_MB
+    result = await compress_file(
+        file, temp_filename, cpu_budget, work, animation=animation, target_size=target_size,
+        on_progress=on_progress, label=f"msg{message.chat.id}_{message.id}"
+    )
+    progress.discard(status_msg)
+    log(f"🎬 Message {message.chat.id}/{message.id}: {result['outcome']} ({result['plan']}: {result['reason']})")
+    if result["outcome"] == OUTCOME_COMPRESSED:
+        await status_msg.edit_text("✅ پردازش کامل شد! در حال ارسال...")
+        await reply(temp_filename)
+        await status_msg.delete()
+    elif result["outcome"] == OUTCOME_ORIGINAL:
+        # فشرده‌سازی کمکی نمی‌کند؛ همان فایل اصلی برگردانده می‌شود
+        await status_msg.delete()
+        await reply(file)
     else:
-        status_msg.edit_text("❌ خطا در پردازش فایل")
-    
-    os.remove(file)
-    os.remove(temp_filename)
+        await status_msg.edit_text("❌ خطا در پردازش فایل")
 
 @app.on_message(filters.document)
-def handle_document(client, message):
+async def handle_document(client, message):
     """پردازش فایل‌های document که ویدیو هستند (مثل mkv)"""
     if not message.document:
         return
@@ -142,22 +146,20 @@ def handle_document(client, message):
     if not is_video_file(filename):
         return
     
-    file = client.download_media(message.document.file_id)
-    with tempfile.NamedTemporaryFile(suffix='.mp4', delete=False) as temp_file:
-        temp_filename = temp_file.name
-    
-    # پردازش ویدیو با فشرده‌سازی
-    cmd = f'ffmpeg -i "{file}" -filter_complex "scale={VIDEO_SCALE}" -r {VIDEO_FPS} -c:v {VIDEO_CODEC} -pix_fmt {VIDEO_PIXEL_FORMAT} -b:v {VIDEO_BITRATE} -crf {VIDEO_CRF} -preset {VIDEO_PRESET} -c:a {VIDEO_AUDIO_CODEC} -b:a {VIDEO_AUDIO_BITRATE} -ac {VIDEO_AUDIO_CHANNELS} -ar {VIDEO_AUDIO_SAMPLE_RATE} -profile:v {VIDEO_PROFILE} -map_metadata -1 "{temp_filename}"'
-    returncode, status_msg = run_ffmpeg_with_progress(cmd, message, client)
-    
-    if returncode == 0:
-        status_msg.edit_text("✅ پردازش کامل شد! در حال ارسال...")
-        message.reply_video(temp_filename)
-        status_msg.delete()
-    else:
-        status_msg.edit_text("❌ خطا در پردازش فایل")
-    
-    os.remove(file)
-    os.remove(temp_filename)
+    work = await open_scratch(message, message.document)
+    if work is None:
+        return
+    with work:
+        file = await client.download_media(message.document.file_id, file_name=work.path("input"))
+        temp_filename = work.path("output.mp4")
+        await compress_and_reply(message, file, temp_filename, work)
+
+async def main():
+    async with app:
+        progress.start()
+        scratch.start()
+        watchdog.start()
+        await idle()
 
-app.run()
+if __name__ == "__main__":
+    app.run(main())
@@ -1,11 +1,41 @@
+import asyncio
 import os
 import tempfile
-import subprocess
-from datetime import datetime
-from pyrogram import Client, filters
+import time
+from pyrogram import filters, idle
+from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton, InputMediaVideo, InputMediaDocument
 from config import API_ID, API_HASH, API_TOKEN, VIDEO_SCALE, VIDEO_FPS, VIDEO_CODEC, VIDEO_PIXEL_FORMAT, VIDEO_BITRATE, VIDEO_CRF, VIDEO_PRESET, VIDEO_AUDIO_CODEC, VIDEO_AUDIO_BITRATE, VIDEO_AUDIO_CHANNELS, VIDEO_AUDIO_SAMPLE_RATE, VIDEO_PROFILE
+from config import MAX_CONCURRENT_JOBS, STAGE_QUEUE_SIZE, DOWNLOAD_WORKERS, ENCODE_WORKERS, UPLOAD_WORKERS, STREAM_ENCODE
+from config import CACHE_ENABLED, CACHE_PATH, CACHE_MAX_ENTRIES, CACHE_TTL, ADMIN_IDS
+from config import SEGMENTED_ENCODE, SEGMENTED_MIN_DURATION, PLAN_ENABLED, TARGET_SIZE_MB
+from config import PROGRESS_GLOBAL_RATE, PROGRESS_CHAT_INTERVAL
+from config import CPU_CORES, CPU_PIN_CORES
+from config import METRICS_HOST, METRICS_PORT, METRICS_HISTORY_PATH, METRICS_HISTORY_DAYS
+from config import USER_MAX_CONCURRENT, USER_MAX_QUEUED, USER_DAILY_QUOTA_MB, USER_WEIGHTS
+from config import ADMISSION_MAX_WAITING, ADMISSION_MAX_LOAD
+from config import STAGE_TIMEOUT_BASE, STAGE_TIMEOUT_PER_MB, ENCODE_TIMEOUT_FACTOR
+from config import ALBUM_ENABLED, ALBUM_COLLECT_WINDOW, ALBUM_MAX_CONCURRENT, UPLOAD_THUMBNAILS
+from config import REMOTE_ENCODE, JOB_STORE_PATH, JOB_SHARED_DIR, JOB_LEASE_SECONDS, JOB_MAX_ATTEMPTS, JOB_POLL_INTERVAL
+from admission import AdmissionController, REJECT_QUOTA, REJECT_USER_QUEUE, REJECT_DISK, WAIT_USER_LIMIT, WAIT_DISK, WAIT_LOAD
+from album import Album, AlbumCollector, ALBUM_MAX_ITEMS
+from cache import ResultCache
+from downloader import download_media_safe, resumable_chunks, prepend_chunk, media_size
+from encoder import is_streamable, log_stream_stats
+from engine import encode, plan_input, result_profile, VIDEO_EXTENSIONS
+from metrics import Metrics, JobHistory, SPANS
+from jobstore import JobStore, JOB_NEW, JOB_LEASED, JOB_ENCODED, JOB_FAILED, JOB_DONE
+from pipeline import Job, JobPipeline, PipelineFull, JobCancelled, StageTimeout
+from planner import log_plan, PLAN_ORIGINAL, PLAN_ENCODE, PLAN_REMUX
+from progress import ProgressUpdater, format_progress, ffmpeg_percentage
+from resources import CpuBudget
+from scratch import scratch_from_config, MB
+from probe import probe_media, get_duration, read_head
+from target_size import parse_target_size
+from uploader import UploadClient, reply_media, video_upload_args
+from utils import log, get_file_size
+from watchdog import watchdog, ProcessStalled
 
-app = Client(
+app = UploadClient(
     "bot", 
     api_id=API_ID, 
     api_hash=API_HASH, 
@@ -14,355 +44,980 @@ app = Client(
     max_concurrent_transmissions=5  # Allow more concurrent downloads for better speed
 )
 
-def log(message):
-    """Log messages to console with timestamp"""
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    print(f"[{timestamp}] {message}")
-
-def get_file_size(filepath):
-    """Get file size in megabytes"""
-    size = os.path.getsize(filepath)
-    return round(size / (1024 * 1024), 2)
-
-def build_fast_ffmpeg_command(input_file, output_file):
-    """Build optimized ffmpeg command for maximum speed"""
-    # Use libx264 instead of libx265 for much faster encoding (3-5x faster)
-    video_codec = "libx264"  # Much faster than libx265
-    preset = "ultrafast"    # Fastest preset
-    threads = os.cpu_count() or 4  # Use all CPU cores
-    
-    cmd = (
-        f'ffmpeg -threads {threads} '  # Use all CPU cores for parallel processing
-        f'-i "{input_file}" '
-        f'-vf "scale={VIDEO_SCALE}:flags=fast_bilinear" '  # Fast bilinear scaling algorithm
-        f'-r {VIDEO_FPS} '
-        f'-c:v {video_codec} '  # Use faster codec
-        f'-preset {preset} '  # Fastest encoding preset
-        f'-crf {VIDEO_CRF} '
-        f'-pix_fmt {VIDEO_PIXEL_FORMAT} '
-        f'-movflags +faststart '  # Enable fast start for web playback
-        f'-c:a {VIDEO_AUDIO_CODEC} '
-        f'-b:a {VIDEO_AUDIO_BITRATE} '
-        f'-ac {VIDEO_AUDIO_CHANNELS} '
-        f'-ar {VIDEO_AUDIO_SAMPLE_RATE} '
-        f'-map_metadata -1 '  # Remove metadata to save time
-        f'-y '  # Overwrite output file without asking
-        f'"{output_file}"'
+progress = ProgressUpdater(PROGRESS_GLOBAL_RATE, PROGRESS_CHAT_INTERVAL)
+cpu_budget = CpuBudget(CPU_CORES, pin=CPU_PIN_CORES)
+# With remote encoding the inputs live in the shared directory, so account for space there
+scratch = scratch_from_config(
+    root=os.path.join(JOB_SHARED_DIR, "scratch") if REMOTE_ENCODE else None, ram=not REMOTE_ENCODE
+)
+
+ERROR_TEXT = "❌ خطا در پردازش ویدیو. لطفا دوباره تلاش کنید."
+CANCELLED_TEXT = "⏹ پردازش این ویدیو لغو شد."
+TIMEOUT_TEXT = "⌛ پردازش این ویدیو بیش از حد طول کشید و متوقف شد. لطفا دوباره تلاش کنید."
+CPU_COUNT = len(cpu_budget.cores)
+ENCODE_POOL_SIZE = ENCODE_WORKERS or max(1, CPU_COUNT // 4)
+
+def job_scratch(job):
+    """The job's scratch directory, opened on first use"""
+    if job.scratch is None:
+        job.scratch = scratch.open(job.id, scratch.estimate(job.original_size * MB))
+        log(f"📁 Job #{job.id}: scratch on the {job.scratch.tier} tier")
+    return job.scratch
+
+def cleanup_job_files(job):
+    """Remove the temporary files that belong to a job"""
+    for path in (job.downloaded_file, job.output_file, job.thumb_file):
+        if path and os.path.exists(path):
+            try:
+                os.remove(path)
+            except OSError as e:
+                log(f"⚠️  Could not remove {path}: {str(e)}")
+    if job.scratch:
+        job.scratch.close()
+
+def record_job(job):
+    """Feed a finished job's spans, sizes and outcome into the metrics and the job history"""
+    job.timings["total"] = time.time() - job.submitted_at
+    outcome = job.outcome or "failed"
+    for span, seconds in job.timings.items():
+        metrics.observe("stage_seconds", seconds, stage=span)
+    metrics.inc("jobs_total", outcome=outcome)
+    input_bytes = int(job.original_size * MB)
+    metrics.inc("bytes_in_total", input_bytes)
+    if job.output_bytes:
+        metrics.inc("bytes_out_total", job.output_bytes)
+    if job.encode_fps:
+        metrics.observe("encode_fps", job.encode_fps, buckets=(5, 10, 25, 50, 100, 200, 400, 800))
+    try:
+        job_history.record(
+            job_id=job.id, user_id=job.user_id, chat_id=job.message.chat.id, outcome=outcome,
+            failed_stage=job.failed_stage, plan=job.plan.action if job.plan else None,
+            input_bytes=input_bytes, output_bytes=job.output_bytes, encode_fps=job.encode_fps,
+            **{span: job.timings.get(span) for span in SPANS}
+        )
+    except Exception as e:
+        log(f"⚠️  Could not record job #{job.id} in the history: {str(e)}")
+
+def job_done(job):
+    """Called for every job that leaves the pipeline, however it ended"""
+    active_jobs.pop(job.id, None)
+    if job.album and not job.album.sent:
+        job.album.held.append(job)  # Its output goes out with the album; send_album cleans up
+    else:
+        cleanup_job_files(job)
+    # Files that never got to the encode do not count against the user's quota
+    admission.release(job, refund=job.failed_stage in ("queued", "download"))
+    record_job(job)
+
+def report(job, text):
+    """Show a job's state in its status message, or as its line in its album's status message"""
+    if job.album:
+        job.album.update(job.message, text)
+        progress.update(job.album.status_msg, job.album.text())
+    else:
+        progress.update(job.status_msg, text)
+
+def transfer_progress(job, title):
+    """Callback that shows download/upload progress of a job in its status message"""
+    def on_progress(current, total):
+        percentage = current * 100 / total if total else 0
+        details = f"{round(current / (1024 * 1024), 1)} / {round(total / (1024 * 1024), 1)} MB"
+        report(job, format_progress(title, percentage, details))
+    return on_progress
+
+def encode_progress(job, duration, title="🎬 در حال فشرده‌سازی..."):
+    """Callback that turns ffmpeg -progress blocks into status message updates"""
+    def on_progress(block):
+        percentage = ffmpeg_percentage(block, duration)
+        if percentage is None:
+            return
+        details = f"⚡ {block.get('speed', '?').strip()} | {block.get('fps', '?')} fps"
+        try:
+            job.encode_fps = float(block.get('fps'))
+        except (TypeError, ValueError):
+            pass
+        report(job, format_progress(title, percentage, details))
+    return on_progress
+
+async def probe_job(job, input_file, data=None):
+    """probe_media, timed as the job's probe span"""
+    with metrics.span(job.timings, "probe"):
+        return await probe_media(input_file, data=data)
+
+async def open_stream(job):
+    """Start the download and keep its first chunk for inspection
+
+    Returns False when no stream could be opened; the job is then
+    downloaded by download_media_safe alone.
+    """
+    try:
+        chunks = resumable_chunks(job.client, job.file_id, end=media_size(job.message) or None)
+        head = await anext(chunks, b'')
+    except AttributeError:
+        return False  # No streaming API, download_media_safe falls back to download_media
+    except Exception as e:
+        log(f"⚠️  Job #{job.id}: could not open download stream: {str(e)}")
+        return False
+    job.stream_head, job.stream_chunks = head, chunks
+    return True
+
+async def send_original(job, caption="✅ این ویدیو از قبل بهینه است و نیازی به فشرده‌سازی ندارد."):
+    """Answer with the user's own file when compressing it would not help"""
+    if job.album:
+        # Goes out with the rest of the album
+        item = {"kind": "document" if job.message.document else "video", "media": job.file_id,
+                "caption": caption, "size": round(job.original_size, 2)}
+        album_member_done(job.album, job.message, "↩️ بدون تغییر (از قبل بهینه)", job, item)
+    else:
+        sent = await job.client.send_cached_media(
+            job.message.chat.id,
+            job.file_id,
+            caption=caption,
+            reply_to_message_id=job.message.id
+        )
+        log(f"↩️  Job #{job.id}: sent the original file back")
+        file_id = sent_file_id(sent)
+        if job.cache_key and file_id:
+            result_cache.put(job.cache_key[0], job.cache_key[1], file_id, round(job.original_size, 2))
+        await finish_followers(job, file_id, round(job.original_size, 2))
+        progress.discard(job.status_msg)
+        try:
+            await job.status_msg.delete()
+        except Exception:
+            pass
+    cleanup_job_files(job)
+    if job.store_id:
+        job_store.mark(job.store_id, JOB_DONE)
+    job.outcome = "original"
+    job.output_bytes = int(job.original_size * MB)
+    job.finished = True
+    log("=" * 60)
+
+def plan_job(job, info, faststart):
+    """Encode plan for a probed job"""
+    return plan_input(info, job.original_size, faststart, job.animation, job.target_size)
+
+async def download_stage(job):
+    """Pipeline stage: fetch the input file from Telegram and plan the encode
+
+    Streamable inputs are handed to the encode stage with the download still
+    open, so ffmpeg starts on the first chunk instead of the last one.
+    Inputs that need no work are answered right here.
+    """
+    log(f"⬇️  Job #{job.id}: starting file download...")
+    report(job, "⬇️ در حال دانلود...")
+    long_video = SEGMENTED_ENCODE and (job.duration or 0) >= SEGMENTED_MIN_DURATION
+    planning = PLAN_ENABLED or job.animation  # Animations always need a plan to pick their command
+    if (STREAM_ENCODE or planning) and not long_video and await open_stream(job):
+        # Size targets need the file on disk for the calibration samples and the corrective pass
+        streamable = STREAM_ENCODE and not REMOTE_ENCODE and not job.target_size and is_streamable(job.stream_head)
+        if planning:
+            # Probe the first chunk; fast-start MP4 and Matroska carry all stream info up front
+            job.plan = plan_job(
+                job, await probe_job(job, None, data=job.stream_head), is_streamable(job.stream_head)
+            )
+            if job.plan.action == PLAN_ORIGINAL:
+                log_plan(job.id, job.plan)
+                await send_original(job)
+                return
+            if job.plan.action == PLAN_ENCODE and SEGMENTED_ENCODE and job.plan.duration >= SEGMENTED_MIN_DURATION:
+                streamable = False  # Segmented encoding needs the file on disk
+        if streamable:
+            log(f"📡 Job #{job.id}: container is streamable, encoding while downloading")
+            if job.plan:
+                log_plan(job.id, job.plan)
+            return
+        log(f"💾 Job #{job.id}: staging the file on disk first")
+    if REMOTE_ENCODE:
+        # Workers read the input from the shared directory; the job store decides when it goes
+        input_path = os.path.join(JOB_SHARED_DIR, f"job_{job.store_id}.input")
+    else:
+        input_path = job_scratch(job).path("input")
+    try:
+        job.downloaded_file = await download_media_safe(
+            job.client, job.file_id, job.message, input_path, head=job.stream_head, chunks=job.stream_chunks,
+            on_progress=transfer_progress(job, "⬇️ در حال دانلود...")
+        )
+        job.stream_head = job.stream_chunks = None
+    except Exception:
+        if not job.album:  # An album shows the failure in its line
+            progress.discard(job.status_msg)
+            await job.status_msg.edit_text("❌ خطا در دانلود فایل. لطفا دوباره تلاش کنید.")
+        raise
+    log(f"✅ Job #{job.id}: download completed: {job.downloaded_file}")
+    log(f"📊 Downloaded file size: {get_file_size(job.downloaded_file)} MB")
+
+    if planning:
+        job.plan = plan_job(job, await probe_job(job, job.downloaded_file), is_streamable(read_head(job.downloaded_file)))
+        log_plan(job.id, job.plan)
+        if job.plan.action == PLAN_ORIGINAL:
+            await send_original(job)
+
+async def encode_stage(job):
+    """Pipeline stage: compress the downloaded file with ffmpeg"""
+    report(job, "🎬 در حال فشرده‌سازی...")
+
+    job.output_file = job_scratch(job).path("output.mp4")
+    job.thumb_file = job_scratch(job).path("thumb.jpg")  # Written by the encode when it decodes every frame
+
+    log(f"📁 Job #{job.id}: output file: {job.output_file}")
+
+    streaming = job.stream_chunks is not None
+    if streaming:
+        chunks = prepend_chunk(job.stream_head, job.stream_chunks)
+        job.stream_head = job.stream_chunks = None
+        input_file = "pipe:0"
+    else:
+        chunks = None
+        input_file = job.downloaded_file
+
+    if job.plan:
+        info = job.plan.info
+    else:
+        info = await probe_job(job, input_file) if not streaming else None
+    duration = get_duration(info)
+
+    returncode, stderr, stats = await encode(
+        input_file, job.output_file, info, job.plan, cpu_budget, job_scratch(job), f"Job #{job.id}",
+        target_size=job.target_size, chunks=chunks, thumb_file=job.thumb_file,
+        on_progress=encode_progress(job, duration)
     )
-    return cmd, threads
-
-def download_progress(current, total, message_obj=None):
-    """Display download progress - optimized for speed"""
-    downloaded_mb = round(current / (1024 * 1024), 2)
-    total_mb = round(total / (1024 * 1024), 2)
-    percentage = round((current / total) * 100, 1) if total > 0 else 0
-    # Log less frequently to reduce overhead - every 10% or every 20 MB
-    if percentage % 10 == 0 or current % (20 * 1024 * 1024) < (1024 * 1024):
-        log(f"⬇️  Downloading: {downloaded_mb} MB / {total_mb} MB ({percentage}%)")
-
-def download_media_safe(client, file_id, message, max_retries=3):
-    """Download file with error handling and retry - optimized for speed"""
-    import time
-    
-    output_path = None
-    
-    for attempt in range(1, max_retries + 1):
+    elapsed_time = stats["finished"] - stats["started"]
+    log(f"⏱️  Compression took {round(elapsed_time, 2)} seconds")
+
+    if streaming and stats.get("input_error") is not None:
+        # The download broke mid-stream; ffmpeg has consumed the bytes, so start over staged
+        log(f"⚠️  Job #{job.id}: stream interrupted ({str(stats['input_error'])}), retrying with a staged download")
+        for path in (job.output_file, job.thumb_file):
+            if os.path.exists(path):  # ffmpeg may have failed before writing either
+                os.remove(path)
+        job.downloaded_file = await download_media_safe(
+            job.client, job.file_id, job.message, job_scratch(job).path("input")
+        )
+        return await encode_stage(job)
+
+    if returncode != 0:
+        log(f"❌ Compression error!")
+        log(f"FFmpeg error: {stderr}")
+        if stats.get("stalled"):
+            raise ProcessStalled(f"ffmpeg made no progress for {watchdog.stall_timeout} seconds")
+        raise RuntimeError(f"ffmpeg exited with code {returncode}")
+
+    if streaming:
+        log_stream_stats(stats)
+
+    log("✅ Compression completed")
+
+async def remote_encode_stage(job):
+    """Pipeline stage: hand the staged input to worker.py processes and wait for the result
+
+    The job store keeps the job across bot restarts; waiting costs one
+    poll every JOB_POLL_INTERVAL seconds.
+    """
+    record = job_store.get(job.store_id)
+    if record["state"] == JOB_NEW:
+        job_store.enqueue(
+            job.store_id,
+            input_name=os.path.basename(job.downloaded_file),
+            output_name=f"job_{job.store_id}.mp4",
+            plan_action=job.plan.action if job.plan else None
+        )
+        log(f"📨 Job #{job.id}: handed to the encoder workers as store job #{job.store_id}")
+    report(job, "⏳ در صف فشرده‌سازی...")
+    while True:
+        record = job_store.get(job.store_id)
+        if record["state"] == JOB_ENCODED:
+            break
+        if record["state"] == JOB_FAILED:
+            raise RuntimeError(f"Remote encode failed: {record['error']}")
+        if record["state"] == JOB_LEASED:
+            report(job, format_progress("🎬 در حال فشرده‌سازی...", record["progress"], f"🖥 {record['worker']}"))
+        await asyncio.sleep(JOB_POLL_INTERVAL)
+    job.output_file = os.path.join(JOB_SHARED_DIR, record["payload"]["output_name"])
+    job.thumb_file = os.path.splitext(job.output_file)[0] + ".jpg"  # Written by the worker's encode, if it could
+    log(f"✅ Job #{job.id}: encoded by worker {record['worker']}")
+
+def result_caption(original_size, compressed_size):
+    """Caption sent with every compressed video"""
+    reduction = round(((original_size - compressed_size) / original_size) * 100, 2) if original_size > 0 else 0
+    return (
+        f"✅ ویدیو فشرده شد!\n\n"
+        f"📊 حجم اصلی: {round(original_size, 2)} MB\n"
+        f"📊 حجم جدید: {compressed_size} MB\n"
+        f"📉 کاهش: {reduction}%"
+    )
+
+def sent_file_id(sent):
+    """Telegram file_id of a media message we just sent"""
+    media = sent.video or sent.document or sent.animation if sent else None
+    return media.file_id if media else None
+
+async def reply_from_cache(client, message, status_msg, file_id, original_size, output_size):
+    """Answer a request with an already uploaded result - no download, encode or upload"""
+    await client.send_cached_media(
+        message.chat.id,
+        file_id,
+        caption=result_caption(original_size, output_size),
+        reply_to_message_id=message.id
+    )
+    if status_msg:
+        progress.discard(status_msg)
         try:
-            log(f"Download attempt {attempt}/{max_retries}...")
-            
-            # Create temporary file path
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.tmp') as temp_file:
-                output_path = temp_file.name
-            
-            # Get total file size for progress tracking
-            total_size = 0
-            try:
-                if hasattr(message, 'video') and message.video:
-                    total_size = message.video.file_size or 0
-                elif hasattr(message, 'document') and message.document:
-                    total_size = message.document.file_size or 0
-                elif hasattr(message, 'animation') and message.animation:
-                    total_size = message.animation.file_size or 0
-            except:
-                pass
-            
-            # Use iter_download for maximum speed with optimized chunk size
+            await status_msg.delete()
+        except Exception:
+            pass
+
+async def finish_followers(job, file_id, output_size):
+    """Send the leader's result to identical requests that were merged into it"""
+    if not job.cache_key:
+        return
+    for follower in result_cache.release(job.cache_key):
+        client, message, status_msg, original_size = follower
+        try:
+            if file_id:
+                await reply_from_cache(client, message, status_msg, file_id, original_size, output_size)
+            else:
+                progress.discard(status_msg)
+                await status_msg.edit_text(ERROR_TEXT)
+        except Exception as e:
+            log(f"❌ Could not answer merged request in chat {message.chat.id}: {str(e)}")
+
+def album_member_done(album, message, line, job=None, item=None):
+    """Record the end of an album member; the last one to finish has the album sent"""
+    if not album.finish(message, line, job, item):
+        progress.update(album.status_msg, album.text())
+        return
+    progress.discard(album.status_msg)
+    # Sent outside the pipeline: the whole album must not count against one member's upload timeout
+    task = asyncio.create_task(send_album(album), name=f"album-{album.status_msg.id}")
+    album_tasks.add(task)
+    task.add_done_callback(album_tasks.discard)
+
+async def send_single(client, message, item):
+    """Send one album result on its own; Telegram's media groups need at least two items"""
+    if item.get("local"):
+        return await client.send_video(
+            message.chat.id, item["media"], caption=item["caption"], supports_streaming=True,
+            reply_to_message_id=message.id, **item.get("upload_args", {})
+        )
+    return await client.send_cached_media(
+        message.chat.id, item["media"], caption=item["caption"], reply_to_message_id=message.id
+    )
+
+def input_media(item):
+    if item["kind"] == "document":
+        return InputMediaDocument(item["media"], caption=item["caption"])
+    return InputMediaVideo(item["media"], caption=item["caption"], supports_streaming=True, **item.get("upload_args", {}))
+
+async def send_album(album):
+    """Answer a finished album with its results as media groups, videos and documents apart"""
+    results = [(message, *result) for message, result in zip(album.messages, album.results) if result]
+    first = album.messages[0]
+    answered = set()  # Members whose followers got the result
+    try:
+        for message, _, item in results:
+            if item["kind"] == "cached":
+                await send_single(album.client, message, item)  # Stored results may be of either kind
+        for kind in ("video", "document"):
+            # Telegram does not mix videos and documents in one group
+            group = [result for result in results if result[2]["kind"] == kind]
+            for start in range(0, len(group), ALBUM_MAX_ITEMS):
+                chunk = group[start:start + ALBUM_MAX_ITEMS]
+                if len(chunk) == 1:
+                    sent = [await send_single(album.client, chunk[0][0], chunk[0][2])]
+                else:
+                    sent = await album.client.send_media_group(
+                        first.chat.id, [input_media(item) for _, _, item in chunk], reply_to_message_id=first.id
+                    )
+                for (message, job, item), sent_message in zip(chunk, sent):
+                    if job is None:
+                        continue  # A cached result
+                    file_id = sent_file_id(sent_message)
+                    if job.cache_key and file_id:
+                        result_cache.put(job.cache_key[0], job.cache_key[1], file_id, item["size"])
+                    await finish_followers(job, file_id, item["size"])
+                    answered.add(job.id)
+        log(f"📚 Album of chat {first.chat.id}: sent {len(results)} of {len(album.messages)} results")
+        if len(results) == len(album.messages):
+            await album.status_msg.delete()
+        else:
+            await album.status_msg.edit_text(album.text())  # Keeps the lines of the members that failed
+    except Exception as e:
+        log(f"❌ Album of chat {first.chat.id} could not be sent: {str(e)}")
+        for _, job, _ in results:
+            if job and job.id not in answered:
+                await finish_followers(job, None, None)
+        try:
+            await album.status_msg.edit_text(ERROR_TEXT)
+        except Exception:
+            pass
+    finally:
+        album.sent = True
+        for job in album.held:
+            cleanup_job_files(job)
+        album.held.clear()
+
+async def upload_stage(job):
+    """Pipeline stage: send the compressed file back and clean up"""
+    original_size = job.original_size
+
+    # Check output file size
+    compressed_size = get_file_size(job.output_file)
+    job.output_bytes = os.path.getsize(job.output_file)
+    reduction = round(((original_size - compressed_size) / original_size) * 100, 2) if original_size > 0 else 0
+
+    log(f"📊 Compressed file size: {compressed_size} MB")
+    log(f"📉 Size reduction: {reduction}%")
+    log(f"💾 Space saved: {round(original_size - compressed_size, 2)} MB")
+
+    if (job.plan is None or job.plan.action != PLAN_REMUX) and original_size > 0 and compressed_size >= original_size:
+        # Re-encoding made it bigger - the input is the better result
+        log(f"↩️  Job #{job.id}: output is not smaller than the input, discarding it")
+        await send_original(job)
+        return
+
+    # Send compressed file
+    log(f"📤 Job #{job.id}: starting to send compressed file...")
+    report(job, "📤 در حال ارسال...")
+    if job.album:
+        # The file stays in scratch until the whole album is sent in one go
+        item = {"kind": "video", "media": job.output_file, "caption": result_caption(original_size, compressed_size),
+                "size": compressed_size, "local": True}
+        if UPLOAD_THUMBNAILS:
+            item["upload_args"] = await video_upload_args(job.output_file, job.thumb_file)
+        job.outcome = "compressed"
+        if job.store_id:
+            job_store.mark(job.store_id, JOB_DONE)
+        album_member_done(job.album, job.message, f"✅ {compressed_size} MB (-{reduction}%)", job, item)
+        return
+    sent = await reply_media(
+        job.message, job.output_file,
+        caption=result_caption(original_size, compressed_size),
+        animation=job.animation,
+        thumb_file=job.thumb_file,
+        progress=transfer_progress(job, "📤 در حال ارسال...")
+    )
+    log("✅ File sent successfully")
+    job.outcome = "compressed"
+
+    file_id = sent_file_id(sent)
+    if job.cache_key and file_id:
+        result_cache.put(job.cache_key[0], job.cache_key[1], file_id, compressed_size)
+    await finish_followers(job, file_id, compressed_size)
+
+    progress.discard(job.status_msg)
+    try:
+        await job.status_msg.delete()
+    except Exception:
+        pass
+
+    # Clean up temporary files
+    log("🧹 Cleaning up temporary files...")
+    cleanup_job_files(job)
+    log("✅ Temporary files cleaned up")
+    if job.store_id:
+        job_store.mark(job.store_id, JOB_DONE)
+
+    log(f"⏱️  Job #{job.id} finished in {round(time.time() - job.submitted_at, 2)} seconds")
+    log("=" * 60)
+
+def stop_reason(error):
+    """Outcome and status text for a job that was stopped rather than failed, or None"""
+    if isinstance(error, JobCancelled):
+        return "cancelled", CANCELLED_TEXT
+    if isinstance(error, StageTimeout):
+        return "timeout", TIMEOUT_TEXT
+    if isinstance(error, ProcessStalled):
+        return "stuck", ERROR_TEXT
+    return None
+
+async def handle_job_error(job, error):
+    """Report a failed, cancelled or timed out job to the user and remove its files"""
+    job.failed_stage = job.stage  # "queued" while waiting for admission or the download workers
+    stopped = stop_reason(error)
+    if not job.album:  # The album's status message lives on for the other members
+        progress.discard(job.status_msg)
+    if stopped:
+        job.outcome, text = stopped
+        log(f"⏹️  Job #{job.id} stopped in stage '{job.failed_stage}' ({job.outcome}): {str(error)}")
+        metrics.inc("jobs_stopped_total", reason=job.outcome, stage=job.failed_stage)
+    else:
+        import traceback
+        log(f"Error type: {type(error).__name__}")
+        log(f"Error details:\n{''.join(traceback.format_exception(type(error), error, error.__traceback__))}")
+        job.outcome, text = "failed", ERROR_TEXT
+        metrics.inc("job_failures_total", stage=job.failed_stage, error=type(error).__name__)
+    cleanup_job_files(job)
+    if job.album:
+        album_member_done(job.album, job.message, text.split("\n")[0])
+    elif stopped:
+        try:
+            await job.status_msg.edit_text(text)  # Also removes the cancel button
+        except Exception:
+            await job.message.reply_text(text)
+    else:
+        await job.message.reply_text(ERROR_TEXT)
+    await finish_followers(job, None, None)
+    if job.store_id:
+        # A worker still encoding it loses its lease heartbeat and stops
+        job_store.mark(job.store_id, JOB_DONE, error=str(error) or type(error).__name__)
+    log("=" * 60)
+
+result_cache = ResultCache(CACHE_PATH, CACHE_MAX_ENTRIES, CACHE_TTL)
+metrics = Metrics()
+job_history = JobHistory(METRICS_HISTORY_PATH)
+CURRENT_PROFILE = result_profile()
+
+job_store = None
+if REMOTE_ENCODE:
+    os.makedirs(JOB_SHARED_DIR, exist_ok=True)
+    job_store = JobStore(JOB_STORE_PATH, JOB_LEASE_SECONDS, JOB_MAX_ATTEMPTS)
+
+active_jobs = {}  # job id -> Job, from submission until job_done; what /cancel can reach
+album_tasks = set()  # Albums being sent
+
+def transfer_timeout(job):
+    """Seconds a download or upload of the job may take"""
+    if not STAGE_TIMEOUT_BASE:
+        return None
+    return STAGE_TIMEOUT_BASE + STAGE_TIMEOUT_PER_MB * job.original_size
+
+def encode_timeout(job):
+    """Seconds an encode may take, from the input's duration; None while the duration is unknown
+
+    The size term covers streamed encodes, which include the rest of the download.
+    """
+    duration = job.plan.duration if job.plan else job.duration
+    if not STAGE_TIMEOUT_BASE or not duration:
+        return None
+    return STAGE_TIMEOUT_BASE + ENCODE_TIMEOUT_FACTOR * duration + STAGE_TIMEOUT_PER_MB * job.original_size
+
+pipeline = JobPipeline(on_error=handle_job_error, max_jobs=MAX_CONCURRENT_JOBS, on_done=job_done)
+pipeline.add_stage("download", download_stage, DOWNLOAD_WORKERS, STAGE_QUEUE_SIZE, timeout=transfer_timeout)
+if REMOTE_ENCODE:
+    # Waiting on a worker is only a poll, so every accepted job may wait at once; leases bound the workers
+    pipeline.add_stage("encode", remote_encode_stage, MAX_CONCURRENT_JOBS, MAX_CONCURRENT_JOBS)
+else:
+    pipeline.add_stage("encode", encode_stage, ENCODE_POOL_SIZE, STAGE_QUEUE_SIZE, timeout=encode_timeout)
+pipeline.add_stage("upload", upload_stage, UPLOAD_WORKERS, STAGE_QUEUE_SIZE, timeout=transfer_timeout)
+
+admission = AdmissionController(
+    pipeline, scratch, CPU_COUNT,
+    max_per_user=USER_MAX_CONCURRENT,
+    max_queued_per_user=USER_MAX_QUEUED,
+    max_waiting=ADMISSION_MAX_WAITING,
+    daily_quota_mb=USER_DAILY_QUOTA_MB,
+    weights=USER_WEIGHTS,
+    max_load=ADMISSION_MAX_LOAD
+)
+
+def collect_gauges():
+    """Figures the cache, progress updater, CPU budget and queues keep themselves"""
+    cpu = cpu_budget.stats()
+    queue = admission.stats()
+    space = scratch.stats()
+    gauges = {
+        "cache_hits": result_cache.hits,
+        "cache_misses": result_cache.misses,
+        "cache_merged": result_cache.merged,
+        "progress_edits": progress.edits,
+        "progress_coalesced": progress.coalesced,
+        "flood_waits": progress.flood_waits,
+        "cpu_threads_allocated": cpu["allocated"],
+        "cpu_load_per_core": cpu["load_per_core"],
+        "jobs_in_flight": pipeline.in_flight,
+        "jobs_waiting": queue["waiting"],
+        "jobs_deferred": queue["deferred"],
+        "scratch_reserved_bytes": int((space["reserved_mb"] + space["ram_reserved_mb"]) * MB),
+        "scratch_swept_bytes": int(space["swept_mb"] * MB),
+        "jobs_active": len(active_jobs),
+        "watchdog_kills": watchdog.kills,
+        "albums_total": albums.albums,
+    }
+    for reason, count in queue["rejected"].items():
+        gauges[f"jobs_rejected_{reason}"] = count
+    for name, stage in pipeline.stats().items():
+        gauges[f"stage_{name}_queued"] = stage["queued"]
+        gauges[f"stage_{name}_active"] = stage["active"]
+    return gauges
+
+metrics.add_collector(collect_gauges)
+
+def message_user_id(message):
+    """User a request is accounted to; channel posts have no sender"""
+    return message.from_user.id if message.from_user else message.chat.id
+
+def rejection_text(reason, user_id):
+    """Reply for a job the admission layer refused"""
+    if reason == REJECT_QUOTA:
+        used = round(admission.usage(user_id) / (1024 * 1024))
+        return f"🚫 سهمیه روزانه شما تمام شده است ({used} از {USER_DAILY_QUOTA_MB} MB). لطفا فردا دوباره تلاش کنید."
+    if reason == REJECT_USER_QUEUE:
+        return f"🚫 شما {USER_MAX_QUEUED} فایل در صف دارید. لطفا تا پایان پردازش آن‌ها صبر کنید."
+    if reason == REJECT_DISK:
+        return "🚫 این فایل برای فضای فعلی سرور بیش از حد بزرگ است."
+    return "🚫 سرور در حال حاضر مشغول است. لطفا چند دقیقه دیگر دوباره تلاش کنید."
+
+def waiting_text(position, reason):
+    """Status text for a job that was accepted but has to wait"""
+    if reason == WAIT_USER_LIMIT:
+        return f"⏳ فایل‌های قبلی شما در حال پردازش هستند؛ این فایل بعد از آن‌ها شروع می‌شود. (نفر {position} از فایل‌های شما)"
+    if reason in (WAIT_DISK, WAIT_LOAD):
+        return "⏳ سرور در حال حاضر پر است؛ فایل شما در صف ماند و به محض آزاد شدن ظرفیت پردازش می‌شود."
+    return f"⏳ در صف پردازش... (نفر {position} در صف)"
+
+def new_job(client, message, media, status_msg, target_size, cache_key, album=None):
+    """Build a Job for a video message"""
+    job = Job(client, message, media.file_id, media.file_size / (1024 * 1024) if media.file_size else 0)
+    job.duration = getattr(media, "duration", None)
+    job.animation = media is message.animation
+    job.target_size = target_size
+    job.cache_key = cache_key
+    job.status_msg = status_msg
+    job.user_id = message_user_id(message)
+    if album:
+        job.album = album
+        job.user_limit = ALBUM_MAX_CONCURRENT  # Its items download and encode side by side
+    active_jobs[job.id] = job
+    if not album:  # The album's status message has one button for all of its jobs
+        progress.set_markup(status_msg, InlineKeyboardMarkup(
+            [[InlineKeyboardButton("⏹ لغو", callback_data=f"cancel:{job.id}")]]
+        ))
+    return job
+
+def may_cancel(user_id, job):
+    """Whether user_id may cancel the job: its sender or an admin"""
+    return user_id == job.user_id or user_id in ADMIN_IDS
+
+async def cancel_job(job):
+    """Stop a job wherever it is: waiting for admission, queued in a stage or running"""
+    if job.cancelled:
+        return
+    log(f"⏹️  Job #{job.id}: cancel requested")
+    if admission.cancel(job):
+        # Never reached the pipeline, so nothing else will report it
+        job.cancelled = True
+        await handle_job_error(job, JobCancelled("cancelled while waiting"))
+        job_done(job)
+    else:
+        report(job, "⏹ در حال لغو...")
+        pipeline.cancel(job)
+
+async def submit_job(client, message, media, album=None):
+    """Queue a video for compression and tell the user where it stands
+
+    Members of an album report to the album's status message instead of
+    getting their own, and hand their results to it instead of replying.
+    """
+    file_id = media.file_id
+    original_size = media.file_size / (1024 * 1024) if media.file_size else 0
+
+    log(f"📥 Received video - File ID: {file_id}")
+    log(f"📊 Original size: {round(original_size, 2)} MB")
+
+    target_size = parse_target_size(message.caption) or TARGET_SIZE_MB
+    if target_size:
+        log(f"🎯 Target size: {target_size} MB")
+
+    cache_key = None
+    if CACHE_ENABLED and media.file_unique_id:
+        cache_key = (media.file_unique_id, result_profile(media is message.animation, target_size))
+        cached = result_cache.get(*cache_key)
+        if cached:
+            log(f"♻️  Cache hit for {media.file_unique_id}, sending stored result")
             try:
-                log("Starting high-speed download with iter_download...")
-                downloaded_bytes = 0
-                start_time = time.time()
-                last_log_time = start_time
-                
-                # Use larger chunk size (8MB) for maximum download speed
-                # Larger chunks = fewer network calls = faster download
-                chunk_size = 8 * 1024 * 1024  # 8MB chunks
-                
-                # Open file with larger buffer for faster writes
-                with open(output_path, 'wb', buffering=16 * 1024 * 1024) as f:  # 16MB buffer
-                    for chunk in client.iter_download(file_id, chunk_size=chunk_size):
-                        f.write(chunk)
-                        downloaded_bytes += len(chunk)
-                        
-                        # Update progress less frequently to reduce overhead
-                        # Log every 10MB or every 3 seconds
-                        current_time = time.time()
-                        if (downloaded_bytes % (10 * 1024 * 1024) == 0) or (current_time - last_log_time >= 3):
-                            elapsed = current_time - start_time
-                            speed = (downloaded_bytes / (1024 * 1024)) / elapsed if elapsed > 0 else 0
-                            percentage = (downloaded_bytes / total_size * 100) if total_size > 0 else 0
-                            log(f"⬇️  Downloaded: {round(downloaded_bytes / (1024 * 1024), 2)} MB / {round(total_size / (1024 * 1024), 2) if total_size > 0 else '?'} MB ({round(percentage, 1)}%) | Speed: {round(speed, 2)} MB/s")
-                            last_log_time = current_time
-                
-                elapsed_total = time.time() - start_time
-                avg_speed = (downloaded_bytes / (1024 * 1024)) / elapsed_total if elapsed_total > 0 else 0
-                log(f"✅ Download completed: {output_path} | Average speed: {round(avg_speed, 2)} MB/s")
-                return output_path
-                
-            except AttributeError:
-                # Fallback to standard download_media if iter_download is not available
-                # Still optimize by specifying file_name to avoid double writes
-                log("Using standard download_media (iter_download not available)...")
-                downloaded_file = client.download_media(
-                    file_id,
-                    file_name=output_path,
-                    progress=download_progress,
-                    progress_args=(message,),
-                    in_memory=False  # Write directly to disk for better performance
-                )
-                log(f"✅ Download completed: {downloaded_file}")
-                return downloaded_file if downloaded_file else output_path
-            
+                if album:
+                    item = {"kind": "cached", "media": cached["file_id"], "size": cached["output_size"],
+                            "caption": result_caption(original_size, cached["output_size"])}
+                    album_member_done(album, message, f"♻️ {cached['output_size']} MB", item=item)
+                else:
+                    await reply_from_cache(client, message, None, cached["file_id"], original_size, cached["output_size"])
+                log("=" * 60)
+                return
+            except Exception as e:
+                log(f"⚠️  Cached file_id could not be sent ({str(e)}), compressing again")
+
+    # Refuse early, before anything is downloaded
+    user_id = message_user_id(message)
+    reason = admission.check(user_id, media.file_size or 0)
+    if reason:
+        log(f"🚫 Job of user {user_id} rejected: {reason}")
+        if album:
+            album_member_done(album, message, rejection_text(reason, user_id))
+        else:
+            await message.reply_text(rejection_text(reason, user_id))
+        log("=" * 60)
+        return
+
+    if album:
+        status_msg = album.status_msg
+        if cache_key and result_cache.in_flight(cache_key):
+            cache_key = None  # Compressed again rather than answered outside the album
+    else:
+        status_msg = await message.reply_text("⏳ در صف پردازش...")
+    if cache_key and not result_cache.claim(cache_key, (client, message, status_msg, original_size)):
+        log(f"🔗 Identical file {media.file_unique_id} is already being processed, merging request")
+        await status_msg.edit_text("⏳ همین فایل در حال پردازش است، نتیجه به زودی ارسال می‌شود...")
+        return
+
+    job = new_job(client, message, media, status_msg, target_size, cache_key, album)
+    if job_store:
+        # Recorded before any work starts, so a restart can pick the job up again
+        job.store_id = job_store.add(message.chat.id, message.id, status_msg.id, {
+            "original_size": job.original_size,
+            "target_size": target_size,
+            "cache_profile": cache_key[1] if cache_key else None,
+        })
+    position, waiting_for = admission.enqueue(job)
+    if waiting_for:
+        log(f"⏸️  Job #{job.id} of user {user_id} deferred: {waiting_for}")
+    report(job, waiting_text(position, waiting_for))
+
+async def submit_album(client, items):
+    """Queue the videos of an album under one status message with one cancel button"""
+    album = Album(client, [message for message, _ in items])
+    album.status_msg = await items[0][0].reply_text(album.text())
+    progress.set_markup(album.status_msg, InlineKeyboardMarkup(
+        [[InlineKeyboardButton("⏹ لغو همه", callback_data=f"cancel_album:{album.status_msg.id}")]]
+    ))
+    for message, media in items:
+        await submit_job(client, message, media, album)
+
+albums = AlbumCollector(ALBUM_COLLECT_WINDOW, submit_album)
+
+async def restore_jobs(client):
+    """Resume the jobs recorded in the job store before the bot was restarted
+
+    Jobs that were not downloaded yet start over; the others wait for their
+    workers again or go straight to the upload.
+    """
+    restored = 0
+    for record in job_store.unfinished():
+        try:
+            message = await client.get_messages(record["chat_id"], record["message_id"])
+            status_msg = await client.get_messages(record["chat_id"], record["status_message_id"])
+            media = message.video or message.animation or message.document
         except Exception as e:
-            log(f"❌ Download error (attempt {attempt}): {str(e)}")
-            if output_path and os.path.exists(output_path):
-                try:
-                    os.remove(output_path)
-                except:
-                    pass
-            if attempt < max_retries:
-                wait_time = attempt * 5  # 5, 10, 15 seconds
-                log(f"⏳ Waiting {wait_time} seconds before retry...")
-                time.sleep(wait_time)
-            else:
-                raise
+            log(f"⚠️  Store job #{record['id']}: message could not be restored ({str(e)})")
+            media = None
+        if media is None:
+            job_store.mark(record["id"], JOB_DONE, error="message lost")
+            continue
+        payload = record["payload"]
+        cache_key = (media.file_unique_id, payload["cache_profile"]) if payload.get("cache_profile") else None
+        job = new_job(client, message, media, status_msg, payload.get("target_size"), cache_key)
+        job.store_id = record["id"]
+        if payload.get("input_name"):
+            job.downloaded_file = os.path.join(JOB_SHARED_DIR, payload["input_name"])
+        while True:
+            try:
+                pipeline.submit(job, stage="download" if record["state"] == JOB_NEW else "encode")
+                break
+            except PipelineFull:
+                await asyncio.sleep(JOB_POLL_INTERVAL)  # Workers are draining the queue
+        restored += 1
+    if restored:
+        log(f"♻️  Restored {restored} unfinished jobs from {JOB_STORE_PATH}")
 
 @app.on_message(filters.command("start"))
-def start(client, message):
+async def start(client, message):
     log(f"Received /start command from user: {message.from_user.id}")
-    message.reply_text("🎥 ربات کاهش حجم ویدیو\n\nویدیو خود را ارسال کنید تا حجم آن کاهش یابد.")
+    await message.reply_text("🎥 ربات کاهش حجم ویدیو\n\nویدیو خود را ارسال کنید تا حجم آن کاهش یابد.")
+
+@app.on_message(filters.command("cancel"))
+async def cancel_command(client, message):
+    """Cancel the job of the replied-to video or status message, or all jobs of the sender"""
+    user_id = message_user_id(message)
+    if message.reply_to_message:
+        replied = message.reply_to_message.id
+        jobs = [
+            job for job in active_jobs.values()
+            if job.message.chat.id == message.chat.id and replied in (job.message.id, job.status_msg.id)
+        ]
+    else:
+        jobs = [job for job in active_jobs.values() if job.user_id == user_id]
+    jobs = [job for job in jobs if may_cancel(user_id, job) and not job.cancelled]
+    for job in jobs:
+        await cancel_job(job)
+    if jobs:
+        await message.reply_text(f"⏹ {len(jobs)} فایل لغو شد.")
+    else:
+        await message.reply_text("ℹ️ فایلی در حال پردازش برای لغو پیدا نشد.")
+
+@app.on_callback_query(filters.regex(r"^cancel(_album)?:"))
+async def cancel_button(client, callback_query):
+    """Cancel button under a status message; an album's button cancels all of its jobs"""
+    kind, value = callback_query.data.split(":", 1)
+    if kind == "cancel_album":
+        chat_id = callback_query.message.chat.id
+        jobs = [
+            job for job in active_jobs.values()
+            if job.album and job.album.status_msg.id == int(value) and job.message.chat.id == chat_id
+        ]
+    else:
+        jobs = [active_jobs[int(value)]] if int(value) in active_jobs else []
+    jobs = [job for job in jobs if not job.cancelled]
+    if not jobs:
+        await callback_query.answer("این فایل دیگر در حال پردازش نیست.")
+        return
+    if not all(may_cancel(callback_query.from_user.id, job) for job in jobs):
+        await callback_query.answer("فقط فرستنده فایل می‌تواند آن را لغو کند.", show_alert=True)
+        return
+    for job in jobs:
+        await cancel_job(job)
+    await callback_query.answer("⏹ لغو شد")
+
+@app.on_message(filters.command("cache") & filters.user(ADMIN_IDS))
+async def cache_stats(client, message):
+    """Admin: show result cache counters"""
+    stats = result_cache.stats()
+    await message.reply_text(
+        f"♻️ Cache\n\n"
+        f"Entries: {stats['entries']}\n"
+        f"Hits: {stats['hits']} | Misses: {stats['misses']} ({stats['hit_rate']}% hit rate)\n"
+        f"Merged in-flight requests: {stats['merged']}\n"
+        f"Profile: {CURRENT_PROFILE}"
+    )
+
+@app.on_message(filters.command("cache_clear") & filters.user(ADMIN_IDS))
+async def cache_clear(client, message):
+    """Admin: drop results of old encoding profiles, or everything with 'all'"""
+    if len(message.command) > 1 and message.command[1] == "all":
+        removed = result_cache.invalidate()
+    else:
+        removed = result_cache.invalidate(keep_profile=CURRENT_PROFILE)
+    log(f"Cache cleared by admin {message.from_user.id}")
+    await message.reply_text(f"🗑️ {removed} cached results removed")
+
+@app.on_message(filters.command("cpu") & filters.user(ADMIN_IDS))
+async def cpu_stats(client, message):
+    """Admin: show how the encode thread budget is used"""
+    stats = cpu_budget.stats()
+    await message.reply_text(
+        f"🧮 CPU\n\n"
+        f"Cores: {stats['cores']} ({'pinned' if stats['pinned'] else 'not pinned'})\n"
+        f"Running encodes: {stats['running']}\n"
+        f"Allocated threads: {stats['allocated']} ({stats['allocated_percent']}%)\n"
+        f"Average allocation: {stats['average_percent']}% | Peak: {stats['peak_threads']} threads\n"
+        f"Load per core: {stats['load_per_core']}\n"
+        f"Encodes so far: {stats['jobs_total']}"
+    )
+
+def format_seconds(value):
+    return "-" if value is None else f"{round(value, 1)}s"
+
+@app.on_message(filters.command("stats") & filters.user(ADMIN_IDS))
+async def job_stats(client, message):
+    """Admin: throughput and p50/p95 latency of the jobs of the last hours (default 24)"""
+    try:
+        hours = float(message.command[1]) if len(message.command) > 1 else 24
+    except ValueError:
+        hours = 24
+    summary = job_history.summary(time.time() - hours * 3600)
+    outcomes = ", ".join(f"{outcome}: {count}" for outcome, count in sorted(summary["outcomes"].items())) or "-"
+    failed = ", ".join(f"{stage}: {count}" for stage, count in sorted(summary["failed_stages"].items())) or "-"
+    latency = "\n".join(
+        f"{span}: p50 {format_seconds(figures['p50'])} | p95 {format_seconds(figures['p95'])}"
+        for span, figures in summary["latency"].items()
+    )
+    bytes_in, bytes_out = summary["bytes_in"] / MB, summary["bytes_out"] / MB
+    saved = round((1 - bytes_out / bytes_in) * 100, 1) if bytes_in else 0
+    fps = summary["encode_fps_p50"]
+    await message.reply_text(
+        f"📈 Last {hours:g} hours\n\n"
+        f"Jobs: {summary['jobs']} ({round(summary['jobs'] / hours, 1)}/hour)\n"
+        f"Outcomes: {outcomes}\n"
+        f"Failures/stops by stage: {failed}\n"
+        f"In: {round(bytes_in, 1)} MB | Out: {round(bytes_out, 1)} MB | Saved: {saved}%\n"
+        f"Encode fps p50: {round(fps, 1) if fps else '-'}\n"
+        f"Cache hits: {result_cache.hits} | FloodWaits: {progress.flood_waits}\n\n"
+        f"{latency}"
+    )
+
+@app.on_message(filters.command("queue") & filters.user(ADMIN_IDS))
+async def queue_stats(client, message):
+    """Admin: show admission control and pipeline queues"""
+    stats = admission.stats()
+    space = scratch.stats()
+    rejected = ", ".join(f"{reason}: {count}" for reason, count in stats["rejected"].items())
+    stages = " | ".join(f"{name}: {s['active']}/{s['workers']} (+{s['queued']})" for name, s in pipeline.stats().items())
+    await message.reply_text(
+        f"🚦 Queue\n\n"
+        f"Running: {stats['running']} | Waiting: {stats['waiting']} from {stats['users_waiting']} users\n"
+        f"Stages: {stages}\n"
+        f"Temp space: {space['free_mb']} MB free, {space['reserved_mb']} MB reserved on disk, "
+        f"{space['ram_reserved_mb']} MB in RAM ({space['ram_jobs']} jobs), {space['swept_mb']} MB swept\n"
+        f"Admitted: {stats['admitted']} | Deferred: {stats['deferred']}\n"
+        f"Rejected: {rejected}"
+    )
+
+@app.on_message(filters.command("workers") & filters.user(ADMIN_IDS))
+async def worker_stats(client, message):
+    """Admin: show the job store queue and the active encoder workers"""
+    if not job_store:
+        await message.reply_text("Remote encoding is disabled (REMOTE_ENCODE = False)")
+        return
+    stats = job_store.stats()
+    await message.reply_text(
+        f"🖥 Workers\n\n"
+        f"Active workers: {stats.pop('workers')}\n"
+        + "\n".join(f"{state}: {count}" for state, count in sorted(stats.items()))
+    )
 
 @app.on_message(filters.video | filters.animation)
-def handle_video(client, message):
+async def handle_video(client, message):
     log("=" * 60)
     log("Starting new video processing")
     log(f"User: {message.from_user.id} (@{message.from_user.username or 'N/A'})")
     log(f"Chat ID: {message.chat.id}")
-    
-    try:
-        # Get file information
-        video = message.video if message.video else message.animation
-        file_id = video.file_id
-        original_size = video.file_size / (1024 * 1024) if video.file_size else 0
-        
-        log(f"📥 Received video - File ID: {file_id}")
-        log(f"📊 Original size: {round(original_size, 2)} MB")
-        
-        # Download file
-        log("⬇️  Starting file download...")
-        try:
-            downloaded_file = download_media_safe(client, file_id, message)
-            log(f"✅ Download completed: {downloaded_file}")
-            log(f"📊 Downloaded file size: {get_file_size(downloaded_file)} MB")
-        except Exception as download_error:
-            log(f"❌ Download error after all attempts: {str(download_error)}")
-            message.reply_text("❌ خطا در دانلود فایل. لطفا دوباره تلاش کنید.")
-            raise
-        
-        # Create temporary output file
-        with tempfile.NamedTemporaryFile(suffix='.mp4', delete=False) as temp_file:
-            output_file = temp_file.name
-        
-        log(f"📁 Output file: {output_file}")
-        
-        # Build optimized ffmpeg command for speed
-        cmd, threads = build_fast_ffmpeg_command(downloaded_file, output_file)
-        
-        log("🎬 Starting fast video compression...")
-        log(f"Using {threads} CPU threads for parallel encoding")
-        log(f"FFmpeg command: {cmd}")
-        
-        # Execute ffmpeg with timing
-        import time
-        start_time = time.time()
-        process = subprocess.run(
-            cmd,
-            shell=True,
-            capture_output=True,
-            text=True
-        )
-        elapsed_time = time.time() - start_time
-        log(f"⏱️  Compression took {round(elapsed_time, 2)} seconds")
-        
-        if process.returncode != 0:
-            log(f"❌ Compression error!")
-            log(f"FFmpeg error: {process.stderr}")
-            message.reply_text("❌ خطا در پردازش ویدیو. لطفا دوباره تلاش کنید.")
-            os.remove(downloaded_file)
-            if os.path.exists(output_file):
-                os.remove(output_file)
-            return
-        
-        log("✅ Compression completed")
-        
-        # Check output file size
-        compressed_size = get_file_size(output_file)
-        reduction = round(((original_size - compressed_size) / original_size) * 100, 2) if original_size > 0 else 0
-        
-        log(f"📊 Compressed file size: {compressed_size} MB")
-        log(f"📉 Size reduction: {reduction}%")
-        log(f"💾 Space saved: {round(original_size - compressed_size, 2)} MB")
-        
-        # Send compressed file
-        log("📤 Starting to send compressed file...")
-        message.reply_video(
-            output_file,
-            caption=f"✅ ویدیو فشرده شد!\n\n"
-                   f"📊 حجم اصلی: {round(original_size, 2)} MB\n"
-                   f"📊 حجم جدید: {compressed_size} MB\n"
-                   f"📉 کاهش: {reduction}%"
-        )
-        log("✅ File sent successfully")
-        
-        # Clean up temporary files
-        log("🧹 Cleaning up temporary files...")
-        os.remove(downloaded_file)
-        os.remove(output_file)
-        log("✅ Temporary files cleaned up")
-        
-        log("=" * 60)
-        log("Processing completed successfully\n")
-        
-    except Exception as e:
-        log(f"❌ Unexpected error: {str(e)}")
-        log(f"Error type: {type(e).__name__}")
-        import traceback
-        log(f"Error details:\n{traceback.format_exc()}")
-        message.reply_text("❌ خطا در پردازش ویدیو. لطفا دوباره تلاش کنید.")
-        log("=" * 60)
+
+    # Get file information
+    video = message.video if message.video else message.animation
+    if ALBUM_ENABLED and message.media_group_id:
+        albums.add(client, message, video)  # Waits for the rest of the album
+        return
+    await submit_job(client, message, video)
 
 @app.on_message(filters.document)
-def handle_document_video(client, message):
+async def handle_document_video(client, message):
     """Process document files that are videos (like mkv)"""
     if not message.document:
         return
     
     filename = message.document.file_name or ""
-    video_extensions = ['.mkv', '.mp4', '.avi', '.mov', '.wmv', '.flv', '.webm', '.m4v']
-    
     if not filename:
         return
     
     ext = os.path.splitext(filename.lower())[1]
-    if ext not in video_extensions:
+    if ext not in VIDEO_EXTENSIONS:
         return
     
     log("=" * 60)
     log("Starting video processing from document")
     log(f"User: {message.from_user.id} (@{message.from_user.username or 'N/A'})")
     log(f"Filename: {filename}")
-    
-    try:
-        file_id = message.document.file_id
-        original_size = message.document.file_size / (1024 * 1024) if message.document.file_size else 0
-        
-        log(f"📥 Received video - File ID: {file_id}")
-        log(f"📊 Original size: {round(original_size, 2)} MB")
-        
-        # Download file
-        log("⬇️  Starting file download...")
-        try:
-            downloaded_file = download_media_safe(client, file_id, message)
-            log(f"✅ Download completed: {downloaded_file}")
-            log(f"📊 Downloaded file size: {get_file_size(downloaded_file)} MB")
-        except Exception as download_error:
-            log(f"❌ Download error after all attempts: {str(download_error)}")
-            message.reply_text("❌ خطا در دانلود فایل. لطفا دوباره تلاش کنید.")
-            raise
-        
-        # Create temporary output file
-        with tempfile.NamedTemporaryFile(suffix='.mp4', delete=False) as temp_file:
-            output_file = temp_file.name
-        
-        log(f"📁 Output file: {output_file}")
-        
-        # Build optimized ffmpeg command for speed
-        cmd, threads = build_fast_ffmpeg_command(downloaded_file, output_file)
-        
-        log("🎬 Starting fast video compression...")
-        log(f"Using {threads} CPU threads for parallel encoding")
-        log(f"FFmpeg command: {cmd}")
-        
-        # Execute ffmpeg with timing
-        import time
-        start_time = time.time()
-        process = subprocess.run(
-            cmd,
-            shell=True,
-            capture_output=True,
-            text=True
-        )
-        elapsed_time = time.time() - start_time
-        log(f"⏱️  Compression took {round(elapsed_time, 2)} seconds")
-        
-        if process.returncode != 0:
-            log(f"❌ Compression error!")
-            log(f"FFmpeg error: {process.stderr}")
-            message.reply_text("❌ خطا در پردازش ویدیو. لطفا دوباره تلاش کنید.")
-            os.remove(downloaded_file)
-            if os.path.exists(output_file):
-                os.remove(output_file)
-            return
-        
-        log("✅ Compression completed")
-        
-        # Check output file size
-        compressed_size = get_file_size(output_file)
-        reduction = round(((original_size - compressed_size) / original_size) * 100, 2) if original_size > 0 else 0
-        
-        log(f"📊 Compressed file size: {compressed_size} MB")
-        log(f"📉 Size reduction: {reduction}%")
-        log(f"💾 Space saved: {round(original_size - compressed_size, 2)} MB")
-        
-        # Send compressed file
-        log("📤 Starting to send compressed file...")
-        message.reply_video(
-            output_file,
-            caption=f"✅ ویدیو فشرده شد!\n\n"
-                   f"📊 حجم اصلی: {round(original_size, 2)} MB\n"
-                   f"📊 حجم جدید: {compressed_size} MB\n"
-                   f"📉 کاهش: {reduction}%"
-        )
-        log("✅ File sent successfully")
-        
-        # Clean up temporary files
-        log("🧹 Cleaning up temporary files...")
-        os.remove(downloaded_file)
-        os.remove(output_file)
-        log("✅ Temporary files cleaned up")
-        
-        log("=" * 60)
-        log("Processing completed successfully\n")
-        
-    except Exception as e:
-        log(f"❌ Unexpected error: {str(e)}")
-        log(f"Error type: {type(e).__name__}")
-        import traceback
-        log(f"Error details:\n{traceback.format_exc()}")
-        message.reply_text("❌ خطا در پردازش ویدیو. لطفا دوباره تلاش کنید.")
-        log("=" * 60)
+
+    if ALBUM_ENABLED and message.media_group_id:
+        albums.add(client, message, message.document)
+        return
+    await submit_job(client, message, message.document)
+
+async def main():
+    """Run the bot with the pipeline workers and the progress updater on one event loop"""
+    async with app:
+        progress.start()
+        pipeline.start()
+        admission.start()
+        scratch.start()
+        watchdog.start()
+        job_history.purge(METRICS_HISTORY_DAYS * 86400)
+        if METRICS_PORT:
+            await metrics.serve(METRICS_HOST, METRICS_PORT)
+        if job_store:
+            await restore_jobs(app)
+        log("✅ Bot is ready to receive videos")
+        await idle()
 
 if __name__ == "__main__":
     log("🚀 Starting bot2...")
-    log("✅ Bot is ready to receive videos")
-    app.run()
-
+    app.run(main())
@@ -0,0 +1,143 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from utils import log
+
+
+def profile_hash(profile):
+    """Short stable hash of an encoding profile dict"""
+    data = json.dumps(profile, sort_keys=True, default=str).encode('utf-8')
+    return hashlib.sha256(data).hexdigest()[:16]
+
+
+class ResultCache:
+    """Persistent map of (file_unique_id, profile hash) -> uploaded output file_id
+
+    Entries expire after ttl seconds and the least recently used ones are
+    evicted once more than max_entries are stored. Identical jobs that are
+    still running are merged through claim()/release().
+    """
+
+    def __init__(self, path, max_entries, ttl):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.merged = 0
+        self._lock = threading.Lock()
+        self._in_flight = {}  # key -> list of followers waiting on the leader
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            " file_unique_id TEXT NOT NULL,"
+            " profile TEXT NOT NULL,"
+            " file_id TEXT NOT NULL,"
+            " output_size REAL,"
+            " created_at REAL NOT NULL,"
+            " last_used_at REAL NOT NULL,"
+            " PRIMARY KEY (file_unique_id, profile))"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used_at)")
+        self._db.commit()
+
+    def get(self, file_unique_id, profile):
+        """Return the cached entry dict or None, counting a hit or a miss"""
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT file_id, output_size, created_at FROM results WHERE file_unique_id = ? AND profile = ?",
+                (file_unique_id, profile)
+            ).fetchone()
+            if row and self.ttl and now - row[2] > self.ttl:
+                self._db.execute(
+                    "DELETE FROM results WHERE file_unique_id = ? AND profile = ?",
+                    (file_unique_id, profile)
+                )
+                self._db.commit()
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._db.execute(
+                "UPDATE results SET last_used_at = ? WHERE file_unique_id = ? AND profile = ?",
+                (now, file_unique_id, profile)
+            )
+            self._db.commit()
+            self.hits += 1
+        return {"file_id": row[0], "output_size": row[1]}
+
+    def put(self, file_unique_id, profile, file_id, output_size):
+        """Store an uploaded result and evict the oldest entries over the limit"""
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)",
+                (file_unique_id, profile, file_id, output_size, now, now)
+            )
+            if self.ttl:
+                self._db.execute("DELETE FROM results WHERE created_at < ?", (now - self.ttl,))
+            self._db.execute(
+                "DELETE FROM results WHERE rowid IN ("
+                " SELECT rowid FROM results ORDER BY last_used_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+            self._db.commit()
+
+    def invalidate(self, keep_profile=None):
+        """Delete cached results; with keep_profile only entries of other profiles go
+
+        Variants of a profile are stored as '<profile>:<variant>' and are
+        kept along with it.
+        """
+        with self._lock:
+            if keep_profile is None:
+                cursor = self._db.execute("DELETE FROM results")
+            else:
+                cursor = self._db.execute(
+                    "DELETE FROM results WHERE profile != ? AND substr(profile, 1, ?) != ?",
+                    (keep_profile, len(keep_profile) + 1, keep_profile + ':')
+                )
+            self._db.commit()
+        log(f"🗑️  Cache invalidated: {cursor.rowcount} entries removed")
+        return cursor.rowcount
+
+    def claim(self, key, follower):
+        """Register interest in a key; True means the caller should run the job
+
+        When an identical job is already in flight the follower is attached to
+        it and False is returned.
+        """
+        with self._lock:
+            if key in self._in_flight:
+                self._in_flight[key].append(follower)
+                self.merged += 1
+                return False
+            self._in_flight[key] = []
+            return True
+
+    def in_flight(self, key):
+        """Whether a job for this key is running, without attaching to it"""
+        with self._lock:
+            return key in self._in_flight
+
+    def release(self, key):
+        """Finish an in-flight key and return the followers that waited on it"""
+        with self._lock:
+            return self._in_flight.pop(key, [])
+
+    def stats(self):
+        """Return entry count and hit/miss counters"""
+        with self._lock:
+            entries = self._db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "entries": entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "merged": self.merged,
+            "hit_rate": round(self.hits / lookups * 100, 1) if lookups else 0,
+            "in_flight": len(self._in_flight),
+        }
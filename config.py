@@ -8,6 +8,8 @@ AUDIO_BITRATE = "32k"
 AUDIO_FORMAT = "mp3" 
 AUDIO_CHANNELS = 1     
 AUDIO_SAMPLE_RATE = 44100  
+AUDIO_SPEECH_BITRATE = "24k"  # Opus VBR target for voice notes
+AUDIO_SPEECH_SAMPLE_RATE = 24000  # Opus supports 8000, 12000, 16000, 24000 and 48000
 
 # Video compression settings
 VIDEO_SCALE = "min(1920,iw):min(1080,ih)"  
@@ -27,3 +29,114 @@ VIDEO_SCALE = '640:360'
 # Temporary file settings
 TEMP_FILE_SUFFIX_AUDIO = ".mp3"  
 TEMP_FILE_SUFFIX_VIDEO = ".mp4"  
+
+# Job pipeline settings
+MAX_CONCURRENT_JOBS = 20  # Jobs accepted at once (queued + running); more are rejected
+STAGE_QUEUE_SIZE = 10  # Bounded queue length in front of each stage
+DOWNLOAD_WORKERS = 3  # Parallel downloads (network bound)
+ENCODE_WORKERS = None  # Parallel ffmpeg encodes; None = one per 4 CPU cores
+UPLOAD_WORKERS = 3  # Parallel uploads (network bound)
+
+# Streaming settings
+STREAM_ENCODE = True  # Pipe downloads straight into ffmpeg when the container allows it
+
+# Result cache settings
+CACHE_ENABLED = True  # Answer repeated files with the already uploaded result
+CACHE_PATH = "compressbot_cache.db"  # SQLite file holding cached results
+CACHE_MAX_ENTRIES = 10000  # Least recently used entries are evicted above this
+CACHE_TTL = 30 * 24 * 3600  # Seconds before a cached result expires (0 = never)
+
+# Admin settings
+ADMIN_IDS = []  # Telegram user IDs allowed to run admin commands
+
+# Segmented encoding settings
+SEGMENTED_ENCODE = True  # Split long videos into keyframe-aligned parts encoded in parallel
+SEGMENTED_MIN_DURATION = 600  # Seconds; shorter videos use a single ffmpeg process
+SEGMENTED_WORKERS = None  # Parallel ffmpeg processes per video; None = one per 4 CPU cores
+
+# Encode planner settings
+PLAN_ENABLED = True  # Probe inputs first and skip, remux or stream-copy when re-encoding is wasted work
+PLAN_COPY_MAX_VIDEO_BITRATE = "600k"  # H.264 within VIDEO_SCALE at or below this bitrate is kept as is
+PLAN_ENCODE_BITRATE_ESTIMATE = "350k"  # Typical video bitrate of a full encode, only used to predict savings
+
+# Animation settings
+ANIMATION_MAX_SIDE = 480  # Longest side of compressed animations; short loops rarely need more
+ANIMATION_FPS = 20  # Highest frame rate of compressed animations; slower sources keep their rate
+ANIMATION_CRF = 28  # x264 quality for animations (lower = better and bigger)
+ANIMATION_PRESET = "veryfast"  # Loops are short, so a slower preset than for videos costs little
+ANIMATION_COPY_MAX_MB = 2  # Small H.264 MP4 animations within ANIMATION_MAX_SIDE are only stripped of audio
+
+# Album settings
+ALBUM_ENABLED = True  # Handle a media group as one batch: one status message, the results sent back as one album
+ALBUM_COLLECT_WINDOW = 1.5  # Seconds without a new item after which an album counts as complete
+ALBUM_MAX_CONCURRENT = 4  # Jobs of one album in the pipeline at once (never fewer than USER_MAX_CONCURRENT)
+
+# Target size settings
+TARGET_SIZE_MB = None  # Fit every video under this many MB; a caption like "20mb" sets it per video
+TARGET_SAMPLE_COUNT = 3  # Short samples encoded to calibrate the bitrate (0 = off)
+TARGET_SAMPLE_SECONDS = 4  # Length of each sample
+
+# Progress message settings
+PROGRESS_GLOBAL_RATE = 20  # Status message edits per second across all chats
+PROGRESS_CHAT_INTERVAL = 3  # Minimum seconds between edits in one chat
+
+# Download settings
+DOWNLOAD_CHUNK_SIZE = 8 * 1024 * 1024  # Bytes per request where the client supports it (multiple of 1 MB)
+DOWNLOAD_CONNECTIONS = 4  # Parallel byte ranges per large file; keep within max_concurrent_transmissions
+DOWNLOAD_PARALLEL_MIN_SIZE = 20  # MB; smaller files are downloaded as one stream
+DOWNLOAD_MAX_RETRIES = 3  # Retries in a row without progress before a download fails
+
+# Upload settings
+UPLOAD_CONNECTIONS = 4  # File parts in flight at once per upload; keep within max_concurrent_transmissions
+UPLOAD_PARALLEL_MIN_SIZE = 20  # MB; smaller files use Pyrogram's own upload (at least 10, Telegram's big-file limit)
+UPLOAD_MAX_RETRIES = 3  # Attempts per file part before the upload fails
+UPLOAD_THUMBNAILS = True  # Send videos with a preview frame and their duration and size
+
+# Timeout settings
+STAGE_TIMEOUT_BASE = 300  # Seconds every download, encode and upload gets; 0 = no stage timeouts
+STAGE_TIMEOUT_PER_MB = 3  # Extra seconds per MB of input for downloads, uploads and streamed encodes
+ENCODE_TIMEOUT_FACTOR = 5  # Encodes may also take this many times the input duration
+FFMPEG_STALL_TIMEOUT = 120  # ffmpeg that reports no progress for this long is killed with its process group (0 = off)
+WATCHDOG_INTERVAL = 10  # Seconds between watchdog checks
+
+# Remote encoding settings (bot2.py + worker.py)
+REMOTE_ENCODE = False  # Hand encodes to worker.py processes through the job store instead of encoding in the bot
+JOB_STORE_PATH = "compressbot_jobs.db"  # SQLite job queue shared by the bot and the workers
+JOB_SHARED_DIR = "shared_jobs"  # Directory visible to the bot and every worker (e.g. an NFS mount)
+JOB_LEASE_SECONDS = 60  # A worker that sends no heartbeat for this long loses its job
+JOB_MAX_ATTEMPTS = 3  # Claims before a job whose workers keep dying is failed
+JOB_POLL_INTERVAL = 2  # Seconds between job store polls
+WORKER_CONCURRENCY = 1  # Jobs one worker process encodes at the same time
+
+# Batch settings (batch.py)
+BATCH_PROCESSES = 0  # Files batch.py encodes at the same time, each in its own process; 0 = one per 4 cores
+BATCH_MANIFEST = "manifest.json"  # Written into the output directory; lets later runs skip unchanged files
+
+# CPU budget settings
+CPU_CORES = None  # CPU ids the encoders may use, e.g. [0, 1, 2, 3]; None = all cores available to the process
+CPU_PIN_CORES = False  # Pin each encode to its own set of cores and re-pin as jobs start and finish (Linux)
+
+# Admission control settings
+USER_MAX_CONCURRENT = 2  # Jobs of one user in the pipeline at once; the rest wait in their fair queue
+USER_MAX_QUEUED = 10  # Jobs one user may have waiting; more are rejected
+USER_DAILY_QUOTA_MB = 4096  # Input MB one user may submit per UTC day (0 = unlimited)
+USER_WEIGHTS = {}  # user_id -> weight; a user with weight 2 gets twice the share when busy (default 1)
+ADMISSION_MAX_WAITING = 100  # Jobs waiting across all users; more are rejected
+ADMISSION_MAX_LOAD = 1.5  # Hold new jobs while the 1-minute load per core is above this (0 = off)
+
+# Scratch space settings
+SCRATCH_DIR = None  # Where job temp files go (None = compressbot_scratch in the system temp directory)
+SCRATCH_BUDGET_MB = 20480  # Temp space all running jobs may reserve together (0 = only limited by free space)
+SCRATCH_MIN_FREE_MB = 500  # Disk space that is never handed out
+SCRATCH_SIZE_FACTOR = 2.5  # Temp space reserved per MB of input (input, output and segment parts)
+SCRATCH_RAM_DIR = "/dev/shm/compressbot"  # tmpfs tier for small jobs (None = off)
+SCRATCH_RAM_MAX_MB = 200  # Jobs that need at most this much go to the RAM tier
+SCRATCH_RAM_BUDGET_MB = 1024  # RAM the tmpfs tier may hold at once (0 = off)
+SCRATCH_ORPHAN_AGE = 6 * 3600  # Seconds after which an unclaimed scratch entry is removed
+SCRATCH_SWEEP_INTERVAL = 600  # Seconds between sweeps for files of crashed jobs
+
+# Metrics settings
+METRICS_HOST = "127.0.0.1"  # Address of the Prometheus endpoint
+METRICS_PORT = 9464  # Port of the Prometheus endpoint at /metrics (0 = off)
+METRICS_HISTORY_PATH = "compressbot_history.db"  # SQLite file with one row per finished job
+METRICS_HISTORY_DAYS = 30  # Days of job history to keep
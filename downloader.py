@@ -0,0 +1,214 @@
+import asyncio
+import os
+import time
+from config import DOWNLOAD_CHUNK_SIZE, DOWNLOAD_CONNECTIONS, DOWNLOAD_PARALLEL_MIN_SIZE, DOWNLOAD_MAX_RETRIES
+from utils import log
+
+MB = 1024 * 1024  # Telegram serves files in 1 MB aligned pieces
+
+def download_progress(current, total, on_progress=None):
+    """Display download progress - optimized for speed"""
+    if on_progress:
+        on_progress(current, total)
+    downloaded_mb = round(current / (1024 * 1024), 2)
+    total_mb = round(total / (1024 * 1024), 2)
+    percentage = round((current / total) * 100, 1) if total > 0 else 0
+    # Log less frequently to reduce overhead - every 10% or every 20 MB
+    if percentage % 10 == 0 or current % (20 * 1024 * 1024) < (1024 * 1024):
+        log(f"⬇️  Downloading: {downloaded_mb} MB / {total_mb} MB ({percentage}%)")
+
+def media_size(message):
+    """Size in bytes of the video, document or animation in a message, 0 if unknown"""
+    for attr in ('video', 'document', 'animation'):
+        media = getattr(message, attr, None)
+        if media:
+            return media.file_size or 0
+    return 0
+
+def open_chunks(client, file_id, offset):
+    """Async chunk iterator over a file starting at a 1 MB aligned byte offset"""
+    if hasattr(client, 'stream_media'):
+        return client.stream_media(file_id, offset=offset // MB)  # Offset counts 1 MB chunks
+    return client.iter_download(file_id, offset=offset, chunk_size=DOWNLOAD_CHUNK_SIZE)
+
+async def prepend_chunk(head, chunks):
+    """Async iterator that yields head and then everything left in chunks"""
+    if head:
+        yield head
+    async for chunk in chunks:
+        yield chunk
+
+async def resumable_chunks(client, file_id, offset=0, end=None, stats=None):
+    """Yield a file's bytes from offset to end, reopening the stream where it broke
+
+    After an error, or a stream that ends before end, the download resumes
+    from the last byte received instead of byte zero; DOWNLOAD_MAX_RETRIES
+    failures in a row without progress give up.
+    """
+    position = offset
+    failures = 0
+    source = None
+    skip = 0
+    while end is None or position < end:
+        if source is None:
+            aligned = position - position % MB
+            skip = position - aligned  # Bytes of the first chunk we already have
+            source = open_chunks(client, file_id, aligned)
+        try:
+            async for chunk in source:
+                if skip:
+                    if len(chunk) <= skip:
+                        skip -= len(chunk)
+                        continue
+                    chunk, skip = chunk[skip:], 0
+                if end is not None and position + len(chunk) > end:
+                    chunk = chunk[:end - position]
+                yield chunk
+                position += len(chunk)
+                failures = 0
+                if end is not None and position >= end:
+                    return
+            if end is not None:
+                # A short range would leave preallocated zeros in the file; fetch the rest again
+                raise ConnectionError(f"stream ended at {position} of {end} bytes")
+            return  # End of file
+        except AttributeError:
+            raise  # No streaming API on this client
+        except Exception as e:
+            failures += 1
+            if stats is not None:
+                stats["retries"] += 1
+            if failures > DOWNLOAD_MAX_RETRIES:
+                raise
+            wait_time = failures * 5  # 5, 10, 15 seconds
+            log(f"❌ Download error at {round(position / MB, 2)} MB: {str(e)}")
+            log(f"⏳ Resuming from {round(position / MB, 2)} MB in {wait_time} seconds (retry {failures}/{DOWNLOAD_MAX_RETRIES})...")
+            await asyncio.sleep(wait_time)
+            source = None
+
+def preallocate(path, size):
+    """Create the file and reserve its full size up front so ranged writes never extend it"""
+    with os.fdopen(os.open(path, os.O_RDWR | os.O_CREAT, 0o644), 'r+b') as f:
+        try:
+            os.posix_fallocate(f.fileno(), 0, size)
+        except (AttributeError, OSError):
+            f.truncate(size)
+
+async def download_sequential(client, file_id, path, total_size, head, chunks, on_progress, stats):
+    """Download into path as one stream, resuming from the last byte on errors"""
+    if chunks is not None:
+        source = prepend_chunk(head, chunks)
+    else:
+        # With the size known, a stream cut short is resumed instead of saved as a truncated file
+        source = resumable_chunks(client, file_id, end=total_size or None, stats=stats)
+    downloaded_bytes = 0
+    start_time = time.time()
+    last_log_time = start_time
+    # Open file with larger buffer for faster writes
+    with open(path, 'wb', buffering=16 * 1024 * 1024) as f:  # 16MB buffer
+        async for chunk in source:
+            f.write(chunk)
+            downloaded_bytes += len(chunk)
+            if on_progress:
+                on_progress(downloaded_bytes, total_size)
+
+            # Log every 3 seconds to reduce overhead
+            current_time = time.time()
+            if current_time - last_log_time >= 3:
+                elapsed = current_time - start_time
+                speed = (downloaded_bytes / MB) / elapsed if elapsed > 0 else 0
+                percentage = (downloaded_bytes / total_size * 100) if total_size > 0 else 0
+                log(f"⬇️  Downloaded: {round(downloaded_bytes / MB, 2)} MB / {round(total_size / MB, 2) if total_size > 0 else '?'} MB ({round(percentage, 1)}%) | Speed: {round(speed, 2)} MB/s")
+                last_log_time = current_time
+    return downloaded_bytes
+
+async def download_ranged(client, file_id, path, total_size, head, connections, on_progress, stats):
+    """Download several byte ranges at once, each written at its own offset
+
+    The file is preallocated, so ranges can land in any order; each range
+    resumes on its own after an error.
+    """
+    preallocate(path, total_size)
+    start = len(head)
+    part = -(-(total_size - start) // connections)  # Ceiling division
+    part += -part % MB  # Keep range starts aligned with Telegram's 1 MB pieces
+    ranges = [(offset, min(offset + part, total_size)) for offset in range(start, total_size, part)]
+    log(f"🔀 Downloading {round(total_size / MB, 2)} MB as {len(ranges)} parallel ranges")
+
+    done = [len(head)]
+    range_speeds = []
+    fd = os.open(path, os.O_WRONLY)
+    try:
+        if head:
+            os.pwrite(fd, head, 0)
+
+        async def fetch(byte_range):
+            offset, end = byte_range
+            range_start = time.time()
+            async for chunk in resumable_chunks(client, file_id, offset, end, stats=stats):
+                os.pwrite(fd, chunk, offset)
+                offset += len(chunk)
+                done[0] += len(chunk)
+                if on_progress:
+                    on_progress(done[0], total_size)
+            elapsed = time.time() - range_start
+            range_speeds.append(round((end - byte_range[0]) / MB / elapsed, 2) if elapsed > 0 else 0)
+
+        await asyncio.gather(*(fetch(byte_range) for byte_range in ranges))
+    finally:
+        os.close(fd)
+    log(f"🔀 Per-range speed (MB/s): {sorted(range_speeds)}")
+    return done[0]
+
+async def download_media_safe(client, file_id, message, output_path, head=None, chunks=None, on_progress=None):
+    """Download file to output_path with error handling and resume - optimized for speed
+
+    head/chunks continue a stream that was already opened to inspect its
+    first chunk. Large files are fetched as DOWNLOAD_CONNECTIONS parallel
+    ranges. on_progress(current, total) is called for every chunk.
+    """
+    # Get total file size for progress tracking
+    total_size = media_size(message)
+    stats = {"retries": 0}
+    start_time = time.time()
+    try:
+        if DOWNLOAD_CONNECTIONS > 1 and total_size >= DOWNLOAD_PARALLEL_MIN_SIZE * MB:
+            if chunks is not None and hasattr(chunks, 'aclose'):
+                await chunks.aclose()  # Ranges are opened afresh; only the head is reused
+            connections = DOWNLOAD_CONNECTIONS
+            downloaded_bytes = await download_ranged(
+                client, file_id, output_path, total_size, head or b'', connections, on_progress, stats
+            )
+        else:
+            connections = 1
+            log("Starting high-speed download...")
+            downloaded_bytes = await download_sequential(
+                client, file_id, output_path, total_size, head, chunks, on_progress, stats
+            )
+    except AttributeError:
+        # Fallback to standard download_media if no streaming API is available
+        # Still optimize by specifying file_name to avoid double writes
+        log("Using standard download_media (streaming download not available)...")
+        downloaded_file = await client.download_media(
+            file_id,
+            file_name=output_path,
+            progress=download_progress,
+            progress_args=(on_progress,),
+            in_memory=False  # Write directly to disk for better performance
+        )
+        log(f"✅ Download completed: {downloaded_file}")
+        return downloaded_file if downloaded_file else output_path
+    except BaseException:
+        # Also on cancellation: the job never learns the path of a partial download
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        raise
+
+    elapsed_total = time.time() - start_time
+    avg_speed = (downloaded_bytes / MB) / elapsed_total if elapsed_total > 0 else 0
+    log(
+        f"✅ Download completed: {output_path} | {round(downloaded_bytes / MB, 2)} MB in "
+        f"{round(elapsed_total, 2)} seconds | Average speed: {round(avg_speed, 2)} MB/s | "
+        f"Connections: {connections} | Retries: {stats['retries']}"
+    )
+    return output_path
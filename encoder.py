@@ -0,0 +1,237 @@
+import asyncio
+import os
+import signal
+import time
+from collections import deque
+from config import VIDEO_SCALE, VIDEO_FPS, VIDEO_CRF, VIDEO_PIXEL_FORMAT, VIDEO_AUDIO_CODEC, VIDEO_AUDIO_BITRATE, VIDEO_AUDIO_CHANNELS, VIDEO_AUDIO_SAMPLE_RATE
+from config import PLAN_ENABLED, PLAN_COPY_MAX_VIDEO_BITRATE
+from filtergraph import video_filter_args, video_input_args, preview_output_args
+from utils import log
+from watchdog import watchdog
+
+# Bump when the command template changes so cached results are not reused
+ENCODER_VERSION = 3
+
+# Top-level MP4/MOV boxes that may appear before 'moov' in a fast-start file
+MP4_LEADING_BOXES = (b'ftyp', b'moov', b'free', b'skip', b'wide', b'pdin', b'uuid', b'mdat')
+
+STREAM_LINE_LIMIT = 1024 * 1024  # Longest stdout/stderr line read from ffmpeg
+
+def video_encode_args(video_bitrate=None, threads=None, info=None):
+    """ffmpeg output options for the compressed video stream, as an argv list
+
+    With video_bitrate (bits per second) the rate is capped for a target
+    file size instead of using constant quality. threads bounds the
+    encoder, which otherwise starts 1.5 threads per core. info is the
+    input's probe data, which the filter graph is built from; pair these
+    options with video_input_args(info) before -i.
+    """
+    # Use libx264 instead of libx265 for much faster encoding (3-5x faster)
+    video_codec = "libx264"  # Much faster than libx265
+    preset = "ultrafast"    # Fastest preset
+    if video_bitrate:
+        rate_args = ['-b:v', str(video_bitrate), '-maxrate', str(int(video_bitrate * 1.2)), '-bufsize', str(video_bitrate * 2)]
+    else:
+        rate_args = ['-crf', str(VIDEO_CRF)]
+    return [
+        *video_filter_args(info),  # fps before scale, sized from the probe data
+        '-c:v', video_codec,  # Use faster codec
+        '-preset', preset,  # Fastest encoding preset
+        *rate_args,
+        '-pix_fmt', VIDEO_PIXEL_FORMAT,
+        *(['-threads', str(threads)] if threads else []),
+    ]
+
+def audio_encode_args():
+    """ffmpeg output options for the compressed audio stream, as an argv list"""
+    return [
+        '-c:a', VIDEO_AUDIO_CODEC,
+        '-b:a', VIDEO_AUDIO_BITRATE,
+        '-ac', str(VIDEO_AUDIO_CHANNELS),
+        '-ar', str(VIDEO_AUDIO_SAMPLE_RATE),
+    ]
+
+def build_fast_ffmpeg_command(input_file, output_file, threads=None, video_bitrate=None, info=None, thumb_file=None):
+    """Build optimized ffmpeg argv for maximum speed; it is run without a shell
+
+    info is the input's probe data; without it the filter graph falls back
+    to expressions that ffmpeg evaluates once it has opened the input.
+    With thumb_file a JPEG preview is written from the same decode.
+    """
+    threads = threads or os.cpu_count() or 4  # Default to all CPU cores
+
+    cmd = [
+        'ffmpeg', '-threads', str(threads),  # Decoder threads; the encoder gets the same count
+        *video_input_args(info, threads),  # Reduced-size decoding and filter threads
+        '-i', input_file,  # A file path, or pipe:0 when streaming
+        *video_encode_args(video_bitrate, threads, info),
+        '-movflags', '+faststart',  # Enable fast start for web playback
+        *audio_encode_args(),
+        '-map_metadata', '-1',  # Remove metadata to save time
+        '-progress', 'pipe:1', '-nostats',  # Machine-readable progress on stdout
+        '-y',  # Overwrite output file without asking
+        output_file,
+    ]
+    if thumb_file:
+        cmd += preview_output_args(thumb_file, info)
+    return cmd, threads
+
+def encoding_profile():
+    """Settings that determine the output of build_fast_ffmpeg_command"""
+    return {
+        "version": ENCODER_VERSION,
+        "video_codec": "libx264",
+        "preset": "ultrafast",
+        "scale": VIDEO_SCALE,
+        "fps": VIDEO_FPS,
+        "crf": VIDEO_CRF,
+        "pix_fmt": VIDEO_PIXEL_FORMAT,
+        "audio_codec": VIDEO_AUDIO_CODEC,
+        "audio_bitrate": VIDEO_AUDIO_BITRATE,
+        "audio_channels": VIDEO_AUDIO_CHANNELS,
+        "audio_sample_rate": VIDEO_AUDIO_SAMPLE_RATE,
+        "plan_copy_max_video_bitrate": PLAN_COPY_MAX_VIDEO_BITRATE if PLAN_ENABLED else None,
+    }
+
+def is_streamable(head):
+    """Check whether a container can be decoded from a pipe, given its first bytes
+
+    Matroska/WebM, MPEG-TS and FLV are read strictly front to back. MP4/MOV
+    only works when the 'moov' index comes before 'mdat' (fast start);
+    anything we cannot recognise is treated as needing a seekable file.
+    """
+    if len(head) < 12:
+        return False
+    if head[:4] == b'\x1a\x45\xdf\xa3':  # EBML header (mkv, webm)
+        return True
+    if head[:3] == b'FLV':
+        return True
+    if head[0] == 0x47 and len(head) > 376 and head[188] == 0x47 and head[376] == 0x47:  # MPEG-TS sync bytes
+        return True
+    if head[4:8] not in MP4_LEADING_BOXES:
+        return False
+
+    offset = 0
+    while offset + 8 <= len(head):
+        size = int.from_bytes(head[offset:offset + 4], 'big')
+        box_type = head[offset + 4:offset + 8]
+        if box_type == b'moov':
+            return True
+        if box_type == b'mdat':
+            return False
+        if size == 1:  # 64-bit box size follows the type
+            if offset + 16 > len(head):
+                return False
+            size = int.from_bytes(head[offset + 8:offset + 16], 'big')
+        if size < 8:  # size 0 (box runs to EOF) or a corrupt header
+            return False
+        offset += size
+    return False
+
+async def run_ffmpeg(cmd, chunks=None, on_progress=None, on_start=None):
+    """Run an ffmpeg argv built with '-progress pipe:1' and collect timing stats
+
+    When chunks (an async iterator) is given, every chunk is written to
+    ffmpeg's stdin by a feeder task while ffmpeg is already encoding.
+    on_start(pid) is called once the process exists (e.g. to pin it to
+    cores). ffmpeg runs as its own process group, which is killed if the
+    caller is cancelled or the watchdog finds it stuck (stats['stalled']).
+    Returns (returncode, stderr_tail, stats).
+    """
+    stats = {
+        "started": time.time(),
+        "first_frame": None,  # Time the first encoded frame was reported
+        "input_done": None,  # Time the last input chunk was written
+        "input_bytes": 0,
+        "input_error": None,
+        "stalled": False,
+    }
+    process = await asyncio.create_subprocess_exec(
+        *cmd,
+        stdin=asyncio.subprocess.PIPE if chunks is not None else asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        limit=STREAM_LINE_LIMIT,
+        start_new_session=True  # Own process group, so a kill reaches everything it started
+    )
+    if on_start:
+        on_start(process.pid)
+    watched = None
+    if '-progress' in cmd:
+        # Only commands that report progress can be told apart from stuck ones
+        output = cmd[cmd.index('-y') + 1] if '-y' in cmd else cmd[-1]
+        watched = watchdog.watch(process.pid, os.path.basename(output))
+
+    # Drain stderr in the background so ffmpeg never blocks on a full pipe
+    stderr_tail = deque(maxlen=50)
+    async def drain_stderr():
+        async for line in process.stderr:
+            stderr_tail.append(line.decode('utf-8', 'replace').rstrip())
+    tasks = [asyncio.create_task(drain_stderr())]
+
+    if chunks is not None:
+        async def feed_stdin():
+            try:
+                async for chunk in chunks:
+                    process.stdin.write(chunk)
+                    await process.stdin.drain()
+                    stats["input_bytes"] += len(chunk)
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # ffmpeg exited early; its return code tells why
+            except Exception as e:
+                stats["input_error"] = e
+                kill_process(process)
+            finally:
+                stats["input_done"] = time.time()
+                process.stdin.close()
+        tasks.append(asyncio.create_task(feed_stdin()))
+
+    try:
+        # Parse the key=value blocks written by -progress
+        block = {}
+        async for raw_line in process.stdout:
+            key, _, value = raw_line.decode('utf-8', 'replace').strip().partition('=')
+            block[key] = value
+            if key != 'progress':
+                continue
+            if stats["first_frame"] is None and block.get('frame', '0').isdigit() and int(block.get('frame', '0')) > 0:
+                stats["first_frame"] = time.time()
+            watchdog.progress(process.pid, (block.get('frame'), block.get('out_time_us'), block.get('total_size')))
+            if on_progress:
+                on_progress(block)
+            block = {}
+
+        await process.wait()
+        await asyncio.gather(*tasks)
+    except asyncio.CancelledError:
+        kill_process(process)
+        for task in tasks:
+            task.cancel()
+        await process.wait()  # Reap it so no zombie outlives the job
+        raise
+    finally:
+        watchdog.unwatch(process.pid)
+    stats["finished"] = time.time()
+    stats["stalled"] = bool(watched and watched["stalled"])
+    return process.returncode, "\n".join(stderr_tail), stats
+
+def kill_process(process):
+    """Kill a subprocess that may already have exited, with its process group when it leads one"""
+    try:
+        if os.getpgid(process.pid) == process.pid:
+            os.killpg(process.pid, signal.SIGKILL)
+        else:
+            process.kill()
+    except ProcessLookupError:
+        pass
+
+def log_stream_stats(stats):
+    """Log how much download and encode overlapped in a streamed job"""
+    total = stats["finished"] - stats["started"]
+    log(f"📡 Streamed {round(stats['input_bytes'] / (1024 * 1024), 2)} MB into ffmpeg in {round(total, 2)} seconds")
+    if stats["first_frame"]:
+        log(f"🎞️  Time to first encoded frame: {round(stats['first_frame'] - stats['started'], 2)} seconds")
+        if stats["input_done"]:
+            # In staged mode none of the encoding could start before the download ended
+            saved = max(0, stats["input_done"] - stats["first_frame"])
+            log(f"⚡ Download/encode overlap (latency saved): {round(saved, 2)} seconds")
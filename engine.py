@@ -0,0 +1,221 @@
+import os
+import shlex
+import time
+from config import PLAN_ENABLED, SEGMENTED_ENCODE, SEGMENTED_MIN_DURATION, SEGMENTED_WORKERS
+from animation import build_animation_command, animation_profile
+from cache import profile_hash
+from encoder import build_fast_ffmpeg_command, run_ffmpeg, encoding_profile, is_streamable
+from planner import plan_encode, plan_animation, log_plan, build_plan_command, PLAN_ORIGINAL, PLAN_ENCODE, PLAN_REMUX, PLAN_COPY_VIDEO
+from planner import PLAN_ANIMATION, PLAN_ANIMATION_COPY
+from probe import probe_media, get_duration, get_stream, read_head
+from segmented import encode_segmented
+from target_size import target_video_bitrate, calibrate_bitrate, correction_factor
+from utils import log
+
+MB = 1024 * 1024
+
+# Inputs compress_file and the bots treat as videos; GIFs are compressed as animations
+VIDEO_EXTENSIONS = ('.mkv', '.mp4', '.avi', '.mov', '.wmv', '.flv', '.webm', '.m4v')
+ANIMATION_EXTENSIONS = ('.gif',)
+
+# compress_file outcomes
+OUTCOME_COMPRESSED = "compressed"  # output_file holds the result
+OUTCOME_ORIGINAL = "original"  # The input is already the better file; output_file is not written
+OUTCOME_FAILED = "failed"
+
+
+def result_profile(animation=False, target_size=None):
+    """Key of the settings a result was made with, shared by the result cache and batch manifests
+
+    Animations and size targets are variants of the video profile, so
+    dropping old profiles keeps them.
+    """
+    profile = profile_hash(encoding_profile())
+    if animation:
+        return f"{profile}:animation{profile_hash(animation_profile())}"  # Animations ignore size targets
+    return f"{profile}:target{target_size}" if target_size else profile
+
+def plan_input(info, input_size, faststart, animation=False, target_size=None):
+    """Encode plan for a probed input; animations have their own single-pass plans"""
+    if animation:
+        return plan_animation(info, input_size, faststart)
+    return plan_encode(info, input_size, faststart, target_size=target_size)
+
+def needs_cpu(plan):
+    """Whether a plan runs an encoder and so needs a share of the CPU budget"""
+    return plan is None or plan.action in (PLAN_ENCODE, PLAN_ANIMATION)
+
+async def run_plan(plan, input_file, output_file, info, duration, allocation, scratch,
+                   chunks=None, video_bitrate=None, thumb_file=None, on_progress=None):
+    """Run the ffmpeg work chosen for an input and return (returncode, stderr, stats)
+
+    plan None means a full re-encode. allocation is the input's CPU share
+    from a CpuBudget; stream-copy plans run without one. chunks feeds the
+    input to ffmpeg while it is still downloading.
+    """
+    if plan and plan.action in (PLAN_ANIMATION, PLAN_ANIMATION_COPY):
+        # One silent pass straight to the output, whatever the video profile says
+        cmd = build_animation_command(
+            input_file, output_file, info, copy=plan.action == PLAN_ANIMATION_COPY,
+            threads=allocation.threads if allocation else None
+        )
+        log(f"🎞️  Starting single-pass {plan.action}...")
+        log(f"FFmpeg command: {shlex.join(cmd)}")
+        return await run_ffmpeg(
+            cmd, chunks=chunks, on_progress=on_progress, on_start=allocation.attach if allocation else None
+        )
+    if plan and plan.action in (PLAN_REMUX, PLAN_COPY_VIDEO):
+        # No video re-encode needed, only the container and maybe the audio change
+        cmd = build_plan_command(plan, input_file, output_file)
+        log(f"📦 Starting {plan.action} without re-encoding the video...")
+        log(f"FFmpeg command: {shlex.join(cmd)}")
+        return await run_ffmpeg(cmd, chunks=chunks, on_progress=on_progress)
+    if allocation.processes > 1:
+        # Long inputs scale better as several ffmpeg processes than as one with many threads
+        log(f"🎬 Starting segmented compression of {round(duration)} seconds of video...")
+        return await encode_segmented(
+            input_file, output_file, info, duration, allocation.processes, allocation.threads_per_process,
+            scratch, video_bitrate, on_progress=on_progress, on_start=allocation.attach
+        )
+
+    cmd, threads = build_fast_ffmpeg_command(
+        input_file, output_file, threads=allocation.threads, video_bitrate=video_bitrate, info=info,
+        thumb_file=thumb_file
+    )
+    log("🎬 Starting fast video compression...")
+    log(f"Using {threads} CPU threads for parallel encoding")
+    log(f"FFmpeg command: {shlex.join(cmd)}")
+    return await run_ffmpeg(cmd, chunks=chunks, on_progress=on_progress, on_start=allocation.attach)
+
+async def encode(input_file, output_file, info, plan, budget, scratch, label,
+                 target_size=None, chunks=None, thumb_file=None, on_progress=None):
+    """Encode one input the way its plan says and return (returncode, stderr, stats)
+
+    Takes and releases the CPU share from budget. With target_size the
+    bitrate is calibrated on samples first and one corrective pass runs
+    when the result misses the target; neither is possible while the
+    input is streamed in through chunks.
+    """
+    streaming = chunks is not None
+    duration = get_duration(info)
+    allocation = None
+    if needs_cpu(plan):
+        # Threads come from the shared CPU budget instead of every encode taking all cores
+        segmented = plan is None or plan.action == PLAN_ENCODE
+        segmented = segmented and SEGMENTED_ENCODE and not streaming and duration >= SEGMENTED_MIN_DURATION
+        allocation = budget.acquire(
+            label, (get_stream(info, "video") or {}).get("height"), processes=SEGMENTED_WORKERS if segmented else 1
+        )
+    try:
+        video_bitrate = None
+        if target_size and (plan is None or plan.action == PLAN_ENCODE):
+            if duration > 0:
+                video_bitrate = target_video_bitrate(target_size, duration, get_stream(info, "audio") is not None)
+                log(f"🎯 Target {target_size} MB over {round(duration)} seconds: {round(video_bitrate / 1000)} kbps video")
+                if not streaming:
+                    video_bitrate = await calibrate_bitrate(
+                        input_file, duration, video_bitrate, allocation.threads, scratch, info,
+                        on_start=allocation.attach
+                    )
+            else:
+                log(f"⚠️  {label}: duration unknown, cannot aim for {target_size} MB")
+
+        returncode, stderr, stats = await run_plan(
+            plan, input_file, output_file, info, duration, allocation, scratch,
+            chunks=chunks, video_bitrate=video_bitrate, thumb_file=thumb_file, on_progress=on_progress
+        )
+        if returncode != 0 or not video_bitrate or streaming:
+            return returncode, stderr, stats
+
+        output_size = os.path.getsize(output_file) / MB
+        if output_size > target_size:
+            # One corrective pass; the first result tells how far the rate control was off
+            video_bitrate = int(video_bitrate * correction_factor(target_size, output_size) * 0.97)
+            log(f"🎯 {round(output_size, 2)} MB missed the {target_size} MB target, re-encoding at {round(video_bitrate / 1000)} kbps")
+            returncode, stderr, stats = await run_plan(
+                plan, input_file, output_file, info, duration, allocation, scratch,
+                video_bitrate=video_bitrate, thumb_file=thumb_file, on_progress=on_progress
+            )
+            if returncode == 0:
+                log(f"🎯 Second pass: {round(os.path.getsize(output_file) / MB, 2)} MB")
+        return returncode, stderr, stats
+    finally:
+        if allocation:
+            budget.release(allocation)
+
+async def compress_file(input_file, output_file, budget, scratch, animation=False, target_size=None,
+                        thumb_file=None, on_progress=None, label=None):
+    """Probe, plan and encode one local file; returns a result dict for reports and manifests
+
+    outcome is OUTCOME_COMPRESSED with the result in output_file, or
+    OUTCOME_ORIGINAL when the input needs no work or the encode did not
+    make it smaller (nothing is left in output_file), or OUTCOME_FAILED.
+    on_progress(block, duration) receives ffmpeg's '-progress' blocks.
+    """
+    label = label or os.path.basename(input_file)
+    started = time.time()
+    input_bytes = os.path.getsize(input_file)
+    result = {
+        "outcome": OUTCOME_FAILED,
+        "plan": None,
+        "reason": None,
+        "input_bytes": input_bytes,
+        "output_bytes": None,
+        "reduction": None,
+        "duration": None,
+        "probe_seconds": None,
+        "encode_seconds": None,
+        "total_seconds": None,
+        "error": None,
+    }
+
+    info = await probe_media(input_file)
+    result["probe_seconds"] = round(time.time() - started, 3)
+    if info is None:
+        result["error"] = "ffprobe could not read the file"
+        result["total_seconds"] = round(time.time() - started, 3)
+        return result
+    duration = get_duration(info)
+    result["duration"] = duration
+
+    plan = None
+    if PLAN_ENABLED or animation:
+        plan = plan_input(info, input_bytes / MB, is_streamable(read_head(input_file)), animation, target_size)
+        log_plan(label, plan)
+        result["plan"], result["reason"] = plan.action, plan.reason
+    if plan and plan.action == PLAN_ORIGINAL:
+        result["outcome"] = OUTCOME_ORIGINAL
+        result["output_bytes"] = input_bytes
+        result["reduction"] = 0.0
+        result["total_seconds"] = round(time.time() - started, 3)
+        return result
+
+    encode_started = time.time()
+    returncode, stderr, stats = await encode(
+        input_file, output_file, info, plan, budget, scratch, label, target_size=target_size, thumb_file=thumb_file,
+        on_progress=(lambda block: on_progress(block, duration)) if on_progress else None
+    )
+    result["encode_seconds"] = round(time.time() - encode_started, 3)
+    result["total_seconds"] = round(time.time() - started, 3)
+    if returncode != 0:
+        log(f"❌ {label}: ffmpeg exited with code {returncode}")
+        log(f"FFmpeg error: {stderr}")
+        result["error"] = "ffmpeg made no progress" if stats.get("stalled") else f"ffmpeg exited with code {returncode}"
+        if os.path.exists(output_file):
+            os.remove(output_file)
+        return result
+
+    output_bytes = os.path.getsize(output_file)
+    if (plan is None or plan.action != PLAN_REMUX) and output_bytes >= input_bytes:
+        # Re-encoding made it bigger - the input is the better result
+        log(f"↩️  {label}: output is not smaller than the input, discarding it")
+        os.remove(output_file)
+        result["outcome"] = OUTCOME_ORIGINAL
+        result["output_bytes"] = input_bytes
+        result["reduction"] = 0.0
+        return result
+
+    result["outcome"] = OUTCOME_COMPRESSED
+    result["output_bytes"] = output_bytes
+    result["reduction"] = round((input_bytes - output_bytes) / input_bytes * 100, 2) if input_bytes else 0.0
+    return result
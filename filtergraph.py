@@ -0,0 +1,195 @@
+import math
+from config import VIDEO_SCALE, VIDEO_FPS
+
+# Decoders that can hand out frames at 1/2, 1/4 or 1/8 size (-lowres) and the deepest level each allows
+LOWRES_CODECS = {"mjpeg": 3, "mpeg4": 3, "h263": 3, "msmpeg4v3": 3, "mpeg1video": 3, "mpeg2video": 3}
+
+# (smallest downscale ratio, swscale flags): area averages away the aliasing of big reductions,
+# bilinear is the cheapest filter that still looks right for small ones
+SCALER_FLAGS = ((2, "area"), (1, "bilinear"))
+UNKNOWN_SCALER_FLAGS = "fast_bilinear"  # No probe data, same as the old fixed command
+
+FILTER_PIXELS_PER_THREAD = 1280 * 720  # Decoded pixels per frame that one filter thread keeps up with
+
+PREVIEW_MAX_SIDE = 320  # Longest side of preview frames (Telegram thumbnails)
+PREVIEW_AT = 1.0  # Seconds into the video a preview frame is taken from; shorter videos use their middle
+
+
+def first_video_stream(info):
+    """First video stream of ffprobe output (probe imports encoder, which imports this module)"""
+    return next((s for s in (info or {}).get("streams", []) if s.get("codec_type") == "video"), None)
+
+def frame_rate(stream):
+    """Frame rate of a probed video stream, None when unknown"""
+    for key in ("avg_frame_rate", "r_frame_rate"):
+        numerator, _, denominator = str((stream or {}).get(key) or "").partition("/")
+        try:
+            rate = float(numerator) / float(denominator or 1)
+        except (ValueError, ZeroDivisionError):
+            continue
+        if rate > 0:
+            return rate
+    return None
+
+def rotation(stream):
+    """Display rotation in degrees from the stream's side data or rotate tag"""
+    for side_data in (stream or {}).get("side_data_list", []):
+        if "rotation" in side_data:
+            return int(side_data["rotation"]) % 360
+    try:
+        return int((stream or {}).get("tags", {}).get("rotate", 0)) % 360
+    except ValueError:
+        return 0
+
+def display_size(stream):
+    """(width, height) as the filters see the frames: after autorotation, with square pixels"""
+    width, height = stream.get("width") or 0, stream.get("height") or 0
+    num, _, den = str(stream.get("sample_aspect_ratio") or "1:1").partition(":")
+    try:
+        if int(num) > 0 and int(den) > 0:
+            width = width * int(num) / int(den)
+    except ValueError:
+        pass
+    if rotation(stream) in (90, 270):
+        width, height = height, width
+    return width, height
+
+def scale_limits():
+    """Longest and shortest output side allowed by VIDEO_SCALE"""
+    try:
+        width, height = (int(part) for part in VIDEO_SCALE.split(':'))
+        return max(width, height), min(width, height)
+    except ValueError:
+        return None  # An expression such as min(1920,iw) - never skip the encode
+
+def even(value):
+    """Round a dimension down to an even number, as yuv420p needs"""
+    return max(2, int(value) // 2 * 2)
+
+def fit_size(width, height, longest, shortest):
+    """Largest even size with the input's aspect ratio inside longest x shortest, never upscaled"""
+    factor = min(1.0, longest / max(width, height), shortest / min(width, height))
+    return even(round(width * factor)), even(round(height * factor))
+
+def scaler_flags(ratio):
+    """swscale flags for shrinking by ratio (input side / output side)"""
+    for min_ratio, flags in SCALER_FLAGS:
+        if ratio >= min_ratio:
+            return flags
+    return SCALER_FLAGS[-1][1]
+
+def lowres_level(codec, width, height, out_width, out_height):
+    """Deepest -lowres level whose decoded frames are still at least the output size"""
+    level = 0
+    while (
+        level < LOWRES_CODECS.get(codec, 0)
+        and width / 2 ** (level + 1) >= out_width and height / 2 ** (level + 1) >= out_height
+    ):
+        level += 1
+    return level
+
+def plan_video_filter(info):
+    """Decode and filter settings for one probed input, or None without usable probe data
+
+    fps is None when the source is not faster than VIDEO_FPS and size is
+    None when the frames already fit; pixels is the decoded frame size
+    after lowres.
+    """
+    limits = scale_limits()
+    video = first_video_stream(info)
+    if not video or not video.get("width") or not video.get("height") or limits is None:
+        return None
+    rate = frame_rate(video)
+    width, height = display_size(video)
+    out_width, out_height = fit_size(width, height, *limits)
+    coded_width, coded_height = video["width"], video["height"]
+    if rotation(video) in (90, 270):
+        coded_width, coded_height = coded_height, coded_width
+    level = lowres_level(video.get("codec_name"), coded_width, coded_height, out_width, out_height)
+    decoded_width, decoded_height = coded_width / 2 ** level, coded_height / 2 ** level
+    needs_scale = level > 0 or (out_width, out_height) != (coded_width, coded_height)
+    return {
+        "fps": VIDEO_FPS if rate is None or rate > VIDEO_FPS else None,
+        "size": (out_width, out_height) if needs_scale else None,
+        "flags": scaler_flags(max(decoded_width / out_width, decoded_height / out_height)),
+        "lowres": level,
+        "pixels": decoded_width * decoded_height,
+    }
+
+def video_filter_args(info=None):
+    """-vf option for the compressed video: frames are dropped to VIDEO_FPS before scaling
+
+    The scale keeps the aspect ratio and fits the result inside VIDEO_SCALE
+    in either orientation. Returns an empty list when the input needs
+    neither, so ffmpeg does not pass frames through an empty graph.
+    """
+    plan = plan_video_filter(info)
+    if plan is None:
+        return ['-vf', f"fps={VIDEO_FPS},{fallback_scale()}"]
+    filters = [f"fps={plan['fps']}"] if plan["fps"] else []
+    if plan["size"]:
+        width, height = plan["size"]
+        filters += [f"scale={width}:{height}:flags={plan['flags']}", "setsar=1"]
+    return ['-vf', ",".join(filters)] if filters else []
+
+def fallback_scale():
+    """Scale filter for an input whose size is unknown until ffmpeg opens it"""
+    limits = scale_limits()
+    if limits is None:
+        return f"scale={VIDEO_SCALE}:flags={UNKNOWN_SCALER_FLAGS}"
+    longest, shortest = limits
+    return (
+        f"scale=w='if(gte(iw,ih),min(iw,{longest}),min(iw,{shortest}))'"
+        f":h='if(gte(iw,ih),min(ih,{shortest}),min(ih,{longest}))'"
+        f":force_original_aspect_ratio=decrease:force_divisible_by=2:flags={UNKNOWN_SCALER_FLAGS}"
+    )
+
+def video_input_args(info=None, threads=None):
+    """Options that go before -i: reduced-size decoding and filter threads for the input's resolution"""
+    plan = plan_video_filter(info)
+    if plan is None:
+        return []
+    args = ['-lowres', str(plan["lowres"])] if plan["lowres"] else []
+    if threads:
+        filter_threads = min(threads, max(1, math.ceil(plan["pixels"] / FILTER_PIXELS_PER_THREAD)))
+        args += ['-filter_threads', str(filter_threads)]
+    return args
+
+def preview_time(duration):
+    """Where in a video of duration seconds (0 = unknown) its preview frame is taken"""
+    return min(PREVIEW_AT, duration / 2) if duration > 0 else 0
+
+def preview_scale():
+    side = PREVIEW_MAX_SIDE
+    return f"scale=w='min(iw,{side})':h='min(ih,{side})':force_original_aspect_ratio=decrease:flags=bilinear"
+
+def preview_output_args(output_file, info=None):
+    """Extra ffmpeg output that saves one decoded frame as a JPEG preview
+
+    Appended after the main output, it reuses the frames that ffmpeg
+    decodes for the encode anyway instead of opening the input again.
+    """
+    try:
+        duration = float(info["format"]["duration"])
+    except (KeyError, TypeError, ValueError):
+        duration = 0
+    return [
+        '-map', '0:v:0', '-an',
+        '-vf', f"select='gte(t,{round(preview_time(duration), 3)})',{preview_scale()}",
+        '-frames:v', '1', '-q:v', '5',
+        '-map_metadata', '-1',
+        output_file,
+    ]
+
+def build_preview_command(input_file, output_file, duration=0):
+    """ffmpeg argv for one JPEG preview frame of a finished file, decoding keyframes only"""
+    return [
+        'ffmpeg', '-skip_frame', 'nokey',  # Non-keyframes are skipped before they are decoded
+        '-ss', str(round(preview_time(duration), 3)), '-i', input_file,
+        '-map', '0:v:0', '-frames:v', '1',
+        '-vf', preview_scale(),
+        '-q:v', '5',
+        '-map_metadata', '-1',
+        '-progress', 'pipe:1', '-nostats',
+        '-y', output_file,
+    ]
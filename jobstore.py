@@ -0,0 +1,203 @@
+import json
+import sqlite3
+import threading
+import time
+from utils import log
+
+# Job states, in the order a job normally passes through them
+JOB_NEW = "new"  # Accepted by the bot, input not downloaded yet
+JOB_PENDING = "pending"  # Input is in the shared directory, waiting for a worker
+JOB_LEASED = "leased"  # A worker is encoding it and must keep sending heartbeats
+JOB_ENCODED = "encoded"  # Output is in the shared directory, waiting for the upload
+JOB_FAILED = "failed"  # Gave up; the bot still has to tell the user
+JOB_DONE = "done"  # Answered, kept only for stats
+
+UNFINISHED_STATES = (JOB_NEW, JOB_PENDING, JOB_LEASED, JOB_ENCODED, JOB_FAILED)
+
+
+class JobStore:
+    """Durable job queue in SQLite, shared by the bot and the encoder workers
+
+    The bot records every job when it is accepted, so jobs survive a
+    restart. Workers claim pending jobs with a lease that they extend with
+    heartbeats; a job whose lease runs out (the worker crashed or lost its
+    connection) goes back to pending, or fails after max_attempts claims.
+    """
+
+    def __init__(self, path, lease_seconds, max_attempts):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        # Autocommit mode; claims take an explicit write lock across processes
+        self._db = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " state TEXT NOT NULL,"
+            " chat_id INTEGER NOT NULL,"
+            " message_id INTEGER NOT NULL,"
+            " status_message_id INTEGER,"
+            " payload TEXT NOT NULL,"
+            " worker TEXT,"
+            " lease_until REAL,"
+            " attempts INTEGER NOT NULL DEFAULT 0,"
+            " progress REAL NOT NULL DEFAULT 0,"
+            " error TEXT,"
+            " created_at REAL NOT NULL,"
+            " updated_at REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, id)")
+
+    def _row(self, row):
+        if row is None:
+            return None
+        keys = ("id", "state", "chat_id", "message_id", "status_message_id", "payload",
+                "worker", "lease_until", "attempts", "progress", "error")
+        job = dict(zip(keys, row))
+        job["payload"] = json.loads(job["payload"])
+        return job
+
+    def _select(self, where, params=()):
+        return self._db.execute(
+            "SELECT id, state, chat_id, message_id, status_message_id, payload,"
+            " worker, lease_until, attempts, progress, error FROM jobs " + where,
+            params
+        ).fetchall()
+
+    def add(self, chat_id, message_id, status_message_id, payload):
+        """Record a newly accepted job and return its id"""
+        now = time.time()
+        with self._lock:
+            cursor = self._db.execute(
+                "INSERT INTO jobs (state, chat_id, message_id, status_message_id, payload, created_at, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (JOB_NEW, chat_id, message_id, status_message_id, json.dumps(payload), now, now)
+            )
+        return cursor.lastrowid
+
+    def get(self, job_id):
+        """Return a job dict or None"""
+        with self._lock:
+            rows = self._select("WHERE id = ?", (job_id,))
+        return self._row(rows[0]) if rows else None
+
+    def enqueue(self, job_id, **payload):
+        """Merge payload fields (e.g. input_path) into a job and make it claimable"""
+        self._update_payload(job_id, payload, "state = ?, error = NULL", (JOB_PENDING,))
+
+    def _update_payload(self, job_id, payload, assignments, params):
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._db.execute("SELECT payload FROM jobs WHERE id = ?", (job_id,)).fetchone()
+                merged = json.loads(row[0]) if row else {}
+                merged.update(payload)
+                self._db.execute(
+                    f"UPDATE jobs SET {assignments}, payload = ?, updated_at = ? WHERE id = ?",
+                    params + (json.dumps(merged), time.time(), job_id)
+                )
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def requeue_expired(self):
+        """Return jobs with an expired lease to the queue; returns how many were requeued"""
+        now = time.time()
+        with self._lock:
+            failed = self._db.execute(
+                "UPDATE jobs SET state = ?, error = 'worker lost too many times', worker = NULL, updated_at = ?"
+                " WHERE state = ? AND lease_until < ? AND attempts >= ?",
+                (JOB_FAILED, now, JOB_LEASED, now, self.max_attempts)
+            ).rowcount
+            requeued = self._db.execute(
+                "UPDATE jobs SET state = ?, worker = NULL, progress = 0, updated_at = ?"
+                " WHERE state = ? AND lease_until < ?",
+                (JOB_PENDING, now, JOB_LEASED, now)
+            ).rowcount
+        if failed or requeued:
+            log(f"♻️  Expired leases: {requeued} jobs requeued, {failed} failed")
+        return requeued
+
+    def claim(self, worker):
+        """Lease the oldest pending job to a worker and return it, or None"""
+        self.requeue_expired()
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")  # Only one process can claim at a time
+            try:
+                rows = self._select("WHERE state = ? ORDER BY id LIMIT 1", (JOB_PENDING,))
+                if rows:
+                    self._db.execute(
+                        "UPDATE jobs SET state = ?, worker = ?, lease_until = ?, attempts = attempts + 1,"
+                        " progress = 0, updated_at = ? WHERE id = ?",
+                        (JOB_LEASED, worker, now + self.lease_seconds, now, rows[0][0])
+                    )
+                    rows = self._select("WHERE id = ?", (rows[0][0],))
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        return self._row(rows[0]) if rows else None
+
+    def heartbeat(self, job_id, worker, progress=None):
+        """Extend a lease; False means the worker lost the job and must stop"""
+        now = time.time()
+        with self._lock:
+            cursor = self._db.execute(
+                "UPDATE jobs SET lease_until = ?, progress = COALESCE(?, progress), updated_at = ?"
+                " WHERE id = ? AND state = ? AND worker = ?",
+                (now + self.lease_seconds, progress, now, job_id, JOB_LEASED, worker)
+            )
+        return cursor.rowcount == 1
+
+    def complete(self, job_id, worker, **payload):
+        """Hand a finished encode back for upload; False if the lease was already lost"""
+        return self._finish_lease(job_id, worker, JOB_ENCODED, None, payload)
+
+    def fail(self, job_id, worker, error):
+        """Give up on a job after an encode error; False if the lease was already lost"""
+        return self._finish_lease(job_id, worker, JOB_FAILED, error, {})
+
+    def _finish_lease(self, job_id, worker, state, error, payload):
+        job = self.get(job_id)
+        if not job or job["state"] != JOB_LEASED or job["worker"] != worker:
+            return False
+        self._update_payload(job_id, payload, "state = ?, error = ?, progress = 100", (state, error))
+        return True
+
+    def mark(self, job_id, state, error=None):
+        """Move a job to a new state from the bot side"""
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET state = ?, error = COALESCE(?, error), updated_at = ? WHERE id = ?",
+                (state, error, time.time(), job_id)
+            )
+
+    def unfinished(self):
+        """Jobs the bot still has to answer, oldest first"""
+        placeholders = ", ".join("?" for _ in UNFINISHED_STATES)
+        with self._lock:
+            rows = self._select(f"WHERE state IN ({placeholders}) ORDER BY id", UNFINISHED_STATES)
+        return [self._row(row) for row in rows]
+
+    def purge(self, older_than):
+        """Delete answered jobs last touched more than older_than seconds ago"""
+        with self._lock:
+            cursor = self._db.execute(
+                "DELETE FROM jobs WHERE state = ? AND updated_at < ?", (JOB_DONE, time.time() - older_than)
+            )
+        return cursor.rowcount
+
+    def stats(self):
+        """Return the number of jobs in each state and the active workers"""
+        with self._lock:
+            counts = dict(self._db.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall())
+            workers = self._db.execute(
+                "SELECT COUNT(DISTINCT worker) FROM jobs WHERE state = ? AND lease_until >= ?",
+                (JOB_LEASED, time.time())
+            ).fetchone()[0]
+        counts["workers"] = workers
+        return counts
@@ -0,0 +1,227 @@
+import asyncio
+import bisect
+import math
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from utils import log
+
+# Seconds; covers a quick cached answer up to an hour-long encode
+DEFAULT_BUCKETS = (0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1200, 1800, 3600)
+
+# Stage timings kept per job and in the history table
+SPANS = ("queue_wait", "download", "probe", "encode", "upload", "total")
+
+
+def percentile(values, q):
+    """Nearest-rank percentile (q between 0 and 100) of a list of numbers, None if empty"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, math.ceil(q / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    pairs = ",".join(f'{key}="{str(value).replace(chr(34), chr(39))}"' for key, value in labels)
+    return "{" + pairs + "}"
+
+
+class Histogram:
+    """Cumulative bucket counts, sum and count, as Prometheus histograms keep them"""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)  # The last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    """In-memory counters and histograms, exported in the Prometheus text format
+
+    Counters and histograms are keyed by name and labels. Components that
+    already keep their own counters (cache, progress updater, CPU budget)
+    are read through collectors when the endpoint is scraped, so they are
+    not counted twice.
+    """
+
+    def __init__(self, prefix="compressbot"):
+        self.prefix = prefix
+        self._lock = threading.Lock()  # Transfer progress callbacks run in executor threads
+        self._counters = {}  # (name, labels) -> value
+        self._histograms = {}  # (name, labels) -> Histogram
+        self._collectors = []  # Callables returning {name: value} gauges
+        self.started_at = time.time()
+
+    def inc(self, name, value=1, **labels):
+        """Add value to a counter"""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, buckets=DEFAULT_BUCKETS, **labels):
+        """Record one value in a histogram"""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def add_collector(self, collect):
+        """Register a callable returning {gauge name: value} that is read on every scrape"""
+        self._collectors.append(collect)
+
+    @contextmanager
+    def span(self, spans, name):
+        """Time a block and add its duration to spans[name] (seconds)"""
+        started = time.time()
+        try:
+            yield
+        finally:
+            spans[name] = spans.get(name, 0) + time.time() - started
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(self._histograms.items(), key=lambda item: item[0])
+            typed = set()
+            for (name, labels), value in counters:
+                metric = f"{self.prefix}_{name}"
+                if metric not in typed:
+                    lines.append(f"# TYPE {metric} counter")
+                    typed.add(metric)
+                lines.append(f"{metric}{format_labels(labels)} {value}")
+            for (name, labels), histogram in histograms:
+                metric = f"{self.prefix}_{name}"
+                if metric not in typed:
+                    lines.append(f"# TYPE {metric} histogram")
+                    typed.add(metric)
+                cumulative = 0
+                for bound, count in zip(histogram.buckets + ("+Inf",), histogram.counts):
+                    cumulative += count
+                    lines.append(f"{metric}_bucket{format_labels(labels + (('le', bound),))} {cumulative}")
+                lines.append(f"{metric}_sum{format_labels(labels)} {round(histogram.sum, 6)}")
+                lines.append(f"{metric}_count{format_labels(labels)} {histogram.count}")
+        gauges = {"uptime_seconds": round(time.time() - self.started_at, 1)}
+        for collect in self._collectors:
+            try:
+                gauges.update(collect())
+            except Exception as e:
+                log(f"⚠️  Metrics collector failed: {str(e)}")
+        for name, value in sorted(gauges.items()):
+            if value is None:
+                continue
+            lines.append(f"# TYPE {self.prefix}_{name} gauge")
+            lines.append(f"{self.prefix}_{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    async def _handle(self, reader, writer):
+        try:
+            request = await asyncio.wait_for(reader.readline(), timeout=10)
+            while (await asyncio.wait_for(reader.readline(), timeout=10)).strip():
+                pass  # Headers are not needed
+            parts = request.decode('latin-1').split()
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] in ("/metrics", "/"):
+                status, body = "200 OK", self.render().encode('utf-8')
+            else:
+                status, body = "404 Not Found", b"not found\n"
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode('latin-1') + body
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host, port):
+        """Serve /metrics over HTTP on host:port; must be called from the running event loop"""
+        server = await asyncio.start_server(self._handle, host, port)
+        log(f"📈 Metrics endpoint on http://{host}:{port}/metrics")
+        return server
+
+
+class JobHistory:
+    """One SQLite row per finished job, for /stats and later analysis"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS job_history ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " finished_at REAL NOT NULL,"
+            " job_id INTEGER,"
+            " user_id INTEGER,"
+            " chat_id INTEGER,"
+            " outcome TEXT NOT NULL,"
+            " failed_stage TEXT,"
+            " error TEXT,"
+            " plan TEXT,"
+            " input_bytes INTEGER,"
+            " output_bytes INTEGER,"
+            " encode_fps REAL, "
+            + ", ".join(f"{span} REAL" for span in SPANS) + ")"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS job_history_finished ON job_history (finished_at)")
+        self._db.commit()
+        self._columns = {row[1] for row in self._db.execute("PRAGMA table_info(job_history)")}
+
+    def record(self, **row):
+        """Insert one finished job; unknown columns are ignored"""
+        row.setdefault("finished_at", time.time())
+        columns = [name for name in row if name in self._columns]
+        with self._lock:
+            self._db.execute(
+                f"INSERT INTO job_history ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)})",
+                [row[name] for name in columns]
+            )
+            self._db.commit()
+
+    def purge(self, older_than):
+        """Delete rows finished more than older_than seconds ago"""
+        with self._lock:
+            cursor = self._db.execute("DELETE FROM job_history WHERE finished_at < ?", (time.time() - older_than,))
+            self._db.commit()
+        return cursor.rowcount
+
+    def summary(self, since):
+        """Counts, bytes and p50/p95 of every span over the jobs finished after since"""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT outcome, failed_stage, input_bytes, output_bytes, encode_fps, "
+                + ", ".join(SPANS) + " FROM job_history WHERE finished_at >= ?",
+                (since,)
+            ).fetchall()
+        outcomes, failed_stages = {}, {}
+        for row in rows:
+            outcomes[row[0]] = outcomes.get(row[0], 0) + 1
+            if row[1]:
+                failed_stages[row[1]] = failed_stages.get(row[1], 0) + 1
+        latency = {}
+        for index, span in enumerate(SPANS):
+            values = [row[5 + index] for row in rows if row[5 + index] is not None]
+            latency[span] = {"p50": percentile(values, 50), "p95": percentile(values, 95)}
+        fps = [row[4] for row in rows if row[4]]
+        return {
+            "jobs": len(rows),
+            "outcomes": outcomes,
+            "failed_stages": failed_stages,
+            "bytes_in": sum(row[2] or 0 for row in rows),
+            "bytes_out": sum(row[3] or 0 for row in rows),
+            "encode_fps_p50": percentile(fps, 50),
+            "latency": latency,
+        }
@@ -0,0 +1,195 @@
+import asyncio
+import itertools
+import time
+from utils import log
+
+
+class PipelineFull(Exception):
+    """Raised when the first stage queue is full and a job cannot be accepted"""
+
+
+class JobCancelled(Exception):
+    """Passed to on_error for a job that was cancelled with JobPipeline.cancel"""
+
+
+class StageTimeout(Exception):
+    """Passed to on_error for a job whose stage ran longer than its timeout"""
+
+
+class Job:
+    """A single compression request travelling through the pipeline stages"""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, client, message, file_id, original_size):
+        self.id = next(Job._ids)
+        self.client = client
+        self.message = message
+        self.file_id = file_id
+        self.original_size = original_size  # MB
+        self.duration = None  # Seconds, when Telegram reports it
+        self.animation = False  # Sent as a Telegram animation (GIF), answered with one
+        self.target_size = None  # MB the output has to fit into, if requested
+        self.cache_key = None  # (file_unique_id, profile hash) when caching is enabled
+        self.status_msg = None
+        self.album = None  # album.Album the job belongs to, when it came in a media group
+        self.user_limit = None  # Jobs of its user that may run at once, instead of the admission default
+        self.downloaded_file = None
+        self.stream_head = None  # First chunk of a download that is piped into ffmpeg
+        self.stream_chunks = None  # The rest of that download, still in flight
+        self.output_file = None
+        self.thumb_file = None  # JPEG preview sent with the output
+        self.scratch = None  # scratch.JobScratch holding the job's temp files, once opened
+        self.plan = None  # planner.EncodePlan once the input has been probed
+        self.store_id = None  # Row in the job store when encoding is remote
+        self.user_id = None  # Telegram user the job is accounted to
+        self.finished = False  # Set by a stage that fully answered the job
+        self.cancelled = False  # Set by JobPipeline.cancel; the job leaves at the next opportunity
+        self.task = None  # asyncio task of the stage handler currently running the job
+        self.outcome = None  # How it ended: compressed, original, failed, cancelled, timeout or stuck
+        self.failed_stage = None
+        self.output_bytes = None
+        self.encode_fps = None  # Average fps ffmpeg reported last
+        self.stage = "queued"
+        self.submitted_at = time.time()
+        self.enqueued_at = self.submitted_at  # When the job last entered a stage queue
+        self.timings = {}  # Seconds per span: queue_wait, then one entry per stage handler
+
+
+class Stage:
+    """A bounded queue drained by a fixed pool of worker tasks"""
+
+    def __init__(self, name, handler, workers, queue_size, timeout=None):
+        self.name = name
+        self.handler = handler
+        self.timeout = timeout  # timeout(job) -> seconds the handler may run, or None for no limit
+        self.workers = max(1, workers)
+        self.queue = asyncio.Queue(maxsize=max(1, queue_size))
+        self.active = 0
+
+
+class JobPipeline:
+    """Run jobs through download, encode and upload stages with separate worker pools
+
+    Every stage has its own bounded queue, so a slow upload never holds a
+    CPU slot and a full queue further down blocks the stage above it
+    (backpressure) instead of piling up jobs. Workers are asyncio tasks, so
+    a waiting job costs no thread.
+    """
+
+    def __init__(self, on_error, max_jobs, on_done=None):
+        self.stages = []
+        self.on_error = on_error
+        self.on_done = on_done  # Called with every job that leaves the pipeline
+        self.max_jobs = max_jobs
+        self.in_flight = 0
+        self._tasks = []
+
+    def add_stage(self, name, handler, workers, queue_size, timeout=None):
+        """Append a stage; the coroutine function handler(job) runs in one of the stage workers
+
+        timeout(job) returns how many seconds the handler may take for that
+        job (None = no limit); a job that runs over fails with StageTimeout.
+        """
+        self.stages.append(Stage(name, handler, workers, queue_size, timeout))
+
+    def start(self):
+        """Start worker tasks for every stage; must be called from the running event loop"""
+        for index, stage in enumerate(self.stages):
+            for n in range(stage.workers):
+                self._tasks.append(asyncio.create_task(self._worker(index), name=f"{stage.name}-{n + 1}"))
+            log(f"🧵 Stage '{stage.name}': {stage.workers} workers, queue size {stage.queue.maxsize}")
+
+    def submit(self, job, stage=None):
+        """Queue a job at the first stage, or the named one, and return its position in line
+
+        Raises PipelineFull when the concurrency limit or the stage queue is
+        exhausted.
+        """
+        entry = self.stages[0] if stage is None else next(s for s in self.stages if s.name == stage)
+        if self.in_flight >= self.max_jobs:
+            raise PipelineFull(f"{self.in_flight} jobs already in flight")
+        try:
+            entry.queue.put_nowait(job)
+        except asyncio.QueueFull:
+            raise PipelineFull(f"'{entry.name}' queue is full")
+        self.in_flight += 1
+        position = entry.queue.qsize()
+        log(f"📥 Job #{job.id} queued (position {position}, in flight: {self.in_flight})")
+        return position
+
+    def cancel(self, job):
+        """Stop a job that is in the pipeline; it leaves through on_error with JobCancelled
+
+        A running stage handler is cancelled right away (run_ffmpeg kills
+        its ffmpeg); a queued job is dropped when a worker picks it up.
+        """
+        job.cancelled = True
+        if job.task and not job.task.done():
+            job.task.cancel()
+
+    def stats(self):
+        """Return queue length and busy workers per stage"""
+        return {
+            stage.name: {"queued": stage.queue.qsize(), "active": stage.active, "workers": stage.workers}
+            for stage in self.stages
+        }
+
+    def _finish(self, job):
+        self.in_flight -= 1
+        if self.on_done:
+            self.on_done(job)
+
+    async def _run_handler(self, stage, job):
+        """Run the stage handler as its own task, so cancel() and the timeout stop only this job"""
+        if job.cancelled:
+            raise JobCancelled(f"cancelled before '{stage.name}'")
+        timeout = stage.timeout(job) if stage.timeout else None
+        job.task = asyncio.create_task(stage.handler(job), name=f"job-{job.id}-{stage.name}")
+        try:
+            done, _ = await asyncio.wait({job.task}, timeout=timeout)
+            if not done:
+                job.task.cancel()
+                await asyncio.gather(job.task, return_exceptions=True)
+                raise StageTimeout(f"'{stage.name}' took longer than {round(timeout)} seconds")
+            if job.task.cancelled():
+                raise JobCancelled(f"cancelled during '{stage.name}'")
+            job.task.result()  # Re-raises the handler's exception
+        finally:
+            job.task = None
+
+    async def _worker(self, index):
+        stage = self.stages[index]
+        while True:
+            job = await stage.queue.get()
+            job.stage = stage.name
+            started = time.time()
+            job.timings["queue_wait"] = job.timings.get("queue_wait", 0) + started - job.enqueued_at
+            stage.active += 1
+            try:
+                await self._run_handler(stage, job)
+            except Exception as e:
+                if not isinstance(e, (JobCancelled, StageTimeout)):
+                    log(f"❌ Job #{job.id} failed in stage '{stage.name}': {str(e)}")
+                try:
+                    await self.on_error(job, e)
+                except Exception as handler_error:
+                    log(f"❌ Error handler failed for job #{job.id}: {str(handler_error)}")
+                self._finish(job)
+                continue
+            finally:
+                job.timings[stage.name] = job.timings.get(stage.name, 0) + time.time() - started
+                stage.active -= 1
+                stage.queue.task_done()
+
+            if job.finished:
+                # Answered early (e.g. the original was sent back) - skip the remaining stages
+                job.stage = "done"
+                self._finish(job)
+            elif index + 1 < len(self.stages):
+                # Waits while the next stage is saturated - this is the backpressure
+                job.enqueued_at = time.time()
+                await self.stages[index + 1].queue.put(job)
+            else:
+                job.stage = "done"
+                self._finish(job)
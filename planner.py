@@ -0,0 +1,169 @@
+import threading
+from config import VIDEO_AUDIO_BITRATE, PLAN_COPY_MAX_VIDEO_BITRATE, PLAN_ENCODE_BITRATE_ESTIMATE
+from animation import animation_copyable
+from encoder import audio_encode_args
+from filtergraph import scale_limits
+from probe import get_duration, get_stream
+from utils import log, parse_bitrate
+
+# Possible plan outcomes, cheapest first
+PLAN_ORIGINAL = "original"  # Send the input back untouched
+PLAN_REMUX = "remux"  # Copy all streams into a fast-start MP4
+PLAN_COPY_VIDEO = "copy_video"  # Copy the video, transcode only the audio
+PLAN_ENCODE = "encode"  # Full re-encode with build_fast_ffmpeg_command
+PLAN_ANIMATION_COPY = "animation_copy"  # Keep the animation's video, drop any audio
+PLAN_ANIMATION = "animation"  # Single-pass silent re-encode with build_animation_command
+
+COPYABLE_PIXEL_FORMATS = ('yuv420p', 'yuvj420p')
+AUDIO_BITRATE_TOLERANCE = 1.25  # Audio up to 25% above the target is not worth re-encoding
+
+_totals_lock = threading.Lock()
+plan_totals = {
+    PLAN_ORIGINAL: 0,
+    PLAN_REMUX: 0,
+    PLAN_COPY_VIDEO: 0,
+    PLAN_ENCODE: 0,
+    PLAN_ANIMATION_COPY: 0,
+    PLAN_ANIMATION: 0,
+    "predicted_saved_mb": 0.0,
+}
+
+
+class EncodePlan:
+    """What to do with one input and how big the result is expected to be"""
+
+    def __init__(self, action, reason, input_size, predicted_size, duration, info):
+        self.action = action
+        self.reason = reason
+        self.input_size = input_size  # MB
+        self.predicted_size = predicted_size  # MB
+        self.duration = duration  # Seconds, 0 when unknown
+        self.info = info  # ffprobe output the plan was made from
+
+    @property
+    def predicted_saving(self):
+        return round(self.input_size - self.predicted_size, 2)
+
+
+def stream_bitrate(stream, info, input_size, duration):
+    """Bitrate of a stream in bits per second, estimated from the file when not reported"""
+    for source in (stream, (info or {}).get("format", {})):
+        try:
+            return int(source["bit_rate"])
+        except (KeyError, TypeError, ValueError):
+            continue
+    if duration > 0:
+        return int(input_size * 1024 * 1024 * 8 / duration)
+    return None
+
+def plan_encode(info, input_size, faststart, target_size=None):
+    """Choose the cheapest action that still gives a small, streamable MP4
+
+    input_size is in MB; faststart tells whether an MP4 input already has
+    its moov atom at the front. With target_size (MB) a cheap plan is only
+    kept when its result fits under the target.
+    """
+    plan = choose_plan(info, input_size, faststart)
+    if target_size and plan.action != PLAN_ENCODE and plan.predicted_size > target_size:
+        encode_estimate = plan.predicted_size
+        if plan.duration > 0:
+            encode_estimate = min(target_size, plan.predicted_size)
+        return EncodePlan(
+            PLAN_ENCODE, f"{plan.reason}, but over the {target_size} MB target",
+            input_size, round(encode_estimate, 2), plan.duration, info
+        )
+    return plan
+
+def choose_plan(info, input_size, faststart):
+    """Cheapest plan for the input regardless of any size target"""
+    duration = get_duration(info)
+    video = get_stream(info, "video")
+    audio = get_stream(info, "audio")
+
+    def make(action, reason, predicted_size):
+        return EncodePlan(action, reason, input_size, round(predicted_size, 2), duration, info)
+
+    encode_estimate = (
+        (parse_bitrate(PLAN_ENCODE_BITRATE_ESTIMATE) + parse_bitrate(VIDEO_AUDIO_BITRATE)) * duration / 8 / (1024 * 1024)
+        if duration > 0 else input_size
+    )
+    if not info or not video:
+        return make(PLAN_ENCODE, "no usable probe data", encode_estimate)
+
+    limits = scale_limits()
+    width, height = video.get("width") or 0, video.get("height") or 0
+    if limits is None:
+        return make(PLAN_ENCODE, "VIDEO_SCALE is not a fixed size", encode_estimate)
+    if video.get("codec_name") != "h264" or video.get("pix_fmt") not in COPYABLE_PIXEL_FORMATS:
+        return make(PLAN_ENCODE, f"video is {video.get('codec_name')}/{video.get('pix_fmt')}", encode_estimate)
+    if max(width, height) > limits[0] or min(width, height) > limits[1]:
+        return make(PLAN_ENCODE, f"video is {width}x{height}", encode_estimate)
+
+    audio_bitrate = stream_bitrate(audio, None, 0, 0) if audio else None
+    video_bitrate = stream_bitrate(video, info, input_size, duration)
+    if video_bitrate and audio_bitrate and not video.get("bit_rate"):
+        video_bitrate -= audio_bitrate  # Container bitrate includes the audio
+    if video_bitrate is None or video_bitrate > parse_bitrate(PLAN_COPY_MAX_VIDEO_BITRATE):
+        return make(PLAN_ENCODE, f"video bitrate {video_bitrate} bps is too high", encode_estimate)
+
+    audio_ok = audio is None or (
+        audio.get("codec_name") == "aac"
+        and audio_bitrate is not None
+        and audio_bitrate <= parse_bitrate(VIDEO_AUDIO_BITRATE) * AUDIO_BITRATE_TOLERANCE
+    )
+    format_name = (info.get("format") or {}).get("format_name", "")
+    is_mp4 = "mp4" in format_name or "mov" in format_name
+    details = f"h264 {width}x{height} @ {round(video_bitrate / 1000)} kbps"
+
+    if audio_ok and is_mp4 and faststart:
+        return make(PLAN_ORIGINAL, f"{details}, already a fast-start MP4", input_size)
+    if audio_ok:
+        return make(PLAN_REMUX, f"{details}, container needs fast start", input_size)
+
+    video_mb = video_bitrate * duration / 8 / (1024 * 1024) if duration > 0 else input_size
+    audio_mb = parse_bitrate(VIDEO_AUDIO_BITRATE) * duration / 8 / (1024 * 1024)
+    return make(PLAN_COPY_VIDEO, f"{details}, audio is {audio.get('codec_name')}", video_mb + audio_mb)
+
+def plan_animation(info, input_size, faststart):
+    """Plan for a Telegram animation: always silent, never the general video profile"""
+    duration = get_duration(info)
+    if not animation_copyable(info, input_size):
+        video = get_stream(info, "video") or {}
+        reason = f"{video.get('codec_name')} {video.get('width')}x{video.get('height')}, {round(input_size, 2)} MB"
+        return EncodePlan(PLAN_ANIMATION, reason, input_size, input_size, duration, info)
+    if get_stream(info, "audio") is None and faststart:
+        return EncodePlan(PLAN_ORIGINAL, "small silent fast-start H.264 animation", input_size, input_size, duration, info)
+    return EncodePlan(PLAN_ANIMATION_COPY, "small H.264 animation", input_size, input_size, duration, info)
+
+def log_plan(job_id, plan):
+    """Log a job's plan and the running totals across all jobs"""
+    with _totals_lock:
+        plan_totals[plan.action] += 1
+        plan_totals["predicted_saved_mb"] += plan.predicted_saving
+        totals = dict(plan_totals)
+    log(f"🧭 Job #{job_id} plan: {plan.action} ({plan.reason})")
+    log(f"🧭 Predicted size: {plan.predicted_size} MB | predicted saving: {plan.predicted_saving} MB")
+    log(
+        f"📈 Plans so far: original={totals[PLAN_ORIGINAL]} remux={totals[PLAN_REMUX]} "
+        f"copy_video={totals[PLAN_COPY_VIDEO]} encode={totals[PLAN_ENCODE]} "
+        f"animation_copy={totals[PLAN_ANIMATION_COPY]} animation={totals[PLAN_ANIMATION]} | "
+        f"predicted savings: {round(totals['predicted_saved_mb'], 2)} MB"
+    )
+
+def build_plan_command(plan, input_file, output_file):
+    """ffmpeg argv for the remux and copy_video plans"""
+    if plan.action == PLAN_REMUX:
+        codec_args = ['-c', 'copy']
+    elif plan.action == PLAN_COPY_VIDEO:
+        codec_args = ['-c:v', 'copy', *audio_encode_args()]
+    else:
+        raise ValueError(f"Plan '{plan.action}' has no copy command")
+    return [
+        'ffmpeg', '-i', input_file,
+        '-map', '0:v:0', '-map', '0:a:0?',  # Audio is optional
+        *codec_args,
+        '-movflags', '+faststart',
+        '-map_metadata', '-1',
+        '-progress', 'pipe:1', '-nostats',
+        '-y', output_file,
+    ]
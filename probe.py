@@ -0,0 +1,85 @@
+import asyncio
+import json
+from encoder import kill_process
+from utils import log
+
+async def run_probe(cmd, data=None, timeout=None):
+    """Run an ffprobe argv without a shell and return (returncode, stdout, stderr)
+
+    The process is killed when it runs longer than timeout seconds or the
+    caller is cancelled.
+    """
+    process = await asyncio.create_subprocess_exec(
+        *cmd,
+        stdin=asyncio.subprocess.PIPE if data is not None else asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE
+    )
+    try:
+        stdout, stderr = await asyncio.wait_for(process.communicate(data), timeout)
+    except BaseException:
+        kill_process(process)
+        await process.wait()
+        raise
+    return process.returncode, stdout, stderr
+
+async def probe_media(input_file, data=None):
+    """Read container and stream information with ffprobe, or None if it fails
+
+    With data, the bytes (e.g. the first chunk of a download) are probed
+    through stdin instead of a file.
+    """
+    cmd = [
+        'ffprobe', '-v', 'error',
+        '-print_format', 'json',
+        '-show_format', '-show_streams',
+        'pipe:0' if data is not None else input_file
+    ]
+    try:
+        returncode, stdout, stderr = await run_probe(cmd, data, timeout=60)
+    except (OSError, asyncio.TimeoutError) as e:
+        log(f"⚠️  ffprobe failed: {str(e) or type(e).__name__}")
+        return None
+    if returncode != 0:
+        log(f"⚠️  ffprobe error: {stderr.decode('utf-8', 'replace').strip()}")
+        return None
+    return json.loads(stdout or b'{}')
+
+def read_head(input_file, size=1024 * 1024):
+    """First bytes of a file, enough to see the container layout"""
+    with open(input_file, 'rb') as f:
+        return f.read(size)
+
+def get_duration(info):
+    """Duration in seconds from probe output, 0 when unknown"""
+    try:
+        return float(info["format"]["duration"])
+    except (KeyError, TypeError, ValueError):
+        return 0
+
+def get_stream(info, codec_type):
+    """First stream of the given type ('video' or 'audio') from probe output"""
+    for stream in (info or {}).get("streams", []):
+        if stream.get("codec_type") == codec_type:
+            return stream
+    return None
+
+async def keyframe_times(input_file):
+    """Timestamps of the video keyframes, read from packet flags without decoding"""
+    cmd = [
+        'ffprobe', '-v', 'error',
+        '-select_streams', 'v:0',
+        '-show_entries', 'packet=pts_time,flags',
+        '-of', 'csv=p=0',
+        input_file
+    ]
+    returncode, stdout, stderr = await run_probe(cmd)
+    if returncode != 0:
+        log(f"⚠️  Could not read keyframes: {stderr.decode('utf-8', 'replace').strip()}")
+        return []
+    times = []
+    for line in stdout.decode('utf-8', 'replace').splitlines():
+        pts_time, _, flags = line.partition(',')
+        if 'K' in flags and pts_time not in ('', 'N/A'):
+            times.append(float(pts_time))
+    return sorted(times)
@@ -0,0 +1,124 @@
+import asyncio
+import threading
+import time
+from pyrogram.errors import FloodWait, MessageNotModified
+from utils import log
+
+def progress_bar(percentage, width=20):
+    """Text progress bar for a percentage between 0 and 100"""
+    filled = max(0, min(width, int(percentage * width / 100)))
+    return "█" * filled + "░" * (width - filled)
+
+def format_progress(title, percentage, details=""):
+    """Status message text: title with percentage, a bar and optional details"""
+    text = f"{title} {int(percentage)}%\n{progress_bar(percentage)}"
+    return f"{text}\n{details}" if details else text
+
+def ffmpeg_percentage(block, duration):
+    """Percentage done from one ffmpeg '-progress' key=value block"""
+    if block.get('progress') == 'end':
+        return 100
+    if not duration:
+        return None
+    try:
+        # out_time_ms is in microseconds as well, despite its name
+        out_time = int(block.get('out_time_us') or block.get('out_time_ms') or 0) / 1000000
+    except ValueError:
+        return None
+    return max(0, min(100, out_time / duration * 100))
+
+
+class ProgressUpdater:
+    """Single place that edits status messages, so progress never floods Telegram
+
+    Callers only record the latest text for a message; a background task
+    sends at most one edit per chat every chat_interval seconds and at most
+    global_rate edits per second overall. Intermediate states are dropped
+    (coalesced) and a FloodWait pauses the updater for the time Telegram
+    asks for. update() is thread-safe, since Pyrogram runs plain transfer
+    progress callbacks in its executor threads.
+    """
+
+    def __init__(self, global_rate, chat_interval):
+        self.min_gap = 1.0 / global_rate
+        self.chat_interval = chat_interval
+        self._pending = {}  # (chat_id, message_id) -> (message, text)
+        self._sent_text = {}  # (chat_id, message_id) -> last text sent
+        self._markup = {}  # (chat_id, message_id) -> reply markup kept on every edit
+        self._chat_last_edit = {}
+        self._paused_until = 0
+        self._lock = threading.Lock()
+        self._task = None
+        self.edits = 0
+        self.coalesced = 0
+        self.flood_waits = 0
+
+    def update(self, message, text):
+        """Record the newest text for a status message; cheap enough to call on every tick"""
+        if message is None:
+            return
+        key = (message.chat.id, message.id)
+        with self._lock:
+            if self._sent_text.get(key) == text:
+                return
+            if key in self._pending:
+                self.coalesced += 1
+            self._pending[key] = (message, text)
+
+    def set_markup(self, message, markup):
+        """Keep markup (such as a cancel button) on a status message; editing text alone would drop it"""
+        if message is None:
+            return
+        with self._lock:
+            self._markup[(message.chat.id, message.id)] = markup
+
+    def discard(self, message):
+        """Forget pending updates for a message that is about to be edited or deleted directly"""
+        if message is None:
+            return
+        key = (message.chat.id, message.id)
+        with self._lock:
+            self._pending.pop(key, None)
+            self._sent_text.pop(key, None)
+            self._markup.pop(key, None)
+
+    def start(self):
+        """Start the background sender task; must be called from the running event loop"""
+        self._task = asyncio.create_task(self._run(), name="progress-updater")
+
+    def _next_ready(self):
+        now = time.time()
+        with self._lock:
+            for key, (message, text) in self._pending.items():
+                if now - self._chat_last_edit.get(key[0], 0) >= self.chat_interval:
+                    del self._pending[key]
+                    self._chat_last_edit[key[0]] = now
+                    return key, message, text
+        return None
+
+    async def _run(self):
+        while True:
+            wait = self._paused_until - time.time()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            item = self._next_ready()
+            if item is None:
+                await asyncio.sleep(0.2)
+                continue
+            key, message, text = item
+            try:
+                await message.edit_text(text, reply_markup=self._markup.get(key))
+                self.edits += 1
+                with self._lock:
+                    self._sent_text[key] = text
+            except FloodWait as e:
+                self.flood_waits += 1
+                log(f"🐢 FloodWait while updating progress, pausing edits for {e.value} seconds")
+                self._paused_until = time.time() + e.value
+                with self._lock:
+                    self._pending.setdefault(key, (message, text))  # Retry unless a newer state arrived
+            except MessageNotModified:
+                pass
+            except Exception as e:
+                log(f"⚠️  Progress update failed: {str(e)}")
+            await asyncio.sleep(self.min_gap)
@@ -0,0 +1,156 @@
+import itertools
+import os
+import time
+from utils import log
+
+# Threads one ffmpeg process can keep busy, by input height. Beyond this
+# x264 and the decoder mostly wait on each other, so extra threads are
+# better spent on another job.
+THREADS_BY_HEIGHT = ((480, 4), (720, 6), (1080, 8))
+MAX_THREADS_PER_PROCESS = 12  # Above 1080p
+
+
+def available_cores():
+    """CPU ids this process may run on"""
+    try:
+        return sorted(os.sched_getaffinity(0))
+    except AttributeError:  # Not available outside Linux
+        return list(range(os.cpu_count() or 4))
+
+def thread_cap(height):
+    """Useful threads for one ffmpeg process on an input of the given height"""
+    if not height:
+        height = 1080  # Unknown - assume a common HD input
+    for max_height, threads in THREADS_BY_HEIGHT:
+        if height <= max_height:
+            return threads
+    return MAX_THREADS_PER_PROCESS
+
+def pin_process(pid, cores):
+    """Set the CPU affinity of every thread of a running process"""
+    try:
+        tids = [int(tid) for tid in os.listdir(f"/proc/{pid}/task")]
+    except OSError:
+        tids = [pid]
+    for tid in tids:
+        try:
+            os.sched_setaffinity(tid, cores)
+        except (AttributeError, OSError):
+            pass  # The thread exited, or affinity is not supported here
+
+
+class Allocation:
+    """The CPU share one encode holds: a thread count and, when pinning, a core set"""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, label, threads, processes):
+        self.id = next(Allocation._ids)
+        self.label = label
+        self.threads = threads  # Total threads across the job's ffmpeg processes
+        self.processes = processes
+        self.cores = []
+        self.pids = set()
+        self.started_at = time.time()
+
+    @property
+    def threads_per_process(self):
+        return max(1, self.threads // self.processes)
+
+    def attach(self, pid):
+        """Register an ffmpeg process of this job so rebalancing can re-pin it"""
+        self.pids.add(pid)
+        if self.cores:
+            pin_process(pid, self.cores)
+
+
+class CpuBudget:
+    """Hand out ffmpeg thread counts from a fixed pool of cores
+
+    Each encode gets an equal share of the cores among the jobs running at
+    that moment, capped by what its input resolution can use. Thread counts
+    are fixed once ffmpeg starts, so with pinning enabled the running jobs
+    are re-pinned to new core sets whenever a job starts or finishes.
+    """
+
+    def __init__(self, cores=None, pin=False):
+        self.cores = list(cores) if cores else available_cores()
+        self.pin = pin and hasattr(os, 'sched_setaffinity')
+        self._allocations = {}
+        self.jobs_total = 0
+        self.peak_threads = 0
+        self._thread_seconds = 0.0  # Allocated threads integrated over time
+        self._last_change = time.time()
+        self._started = self._last_change
+
+    @property
+    def allocated(self):
+        return sum(allocation.threads for allocation in self._allocations.values())
+
+    def _account(self):
+        now = time.time()
+        self._thread_seconds += self.allocated * (now - self._last_change)
+        self._last_change = now
+
+    def acquire(self, label, height=None, processes=1):
+        """Reserve threads for a job that runs processes ffmpeg processes in parallel
+
+        processes=None lets a segmented encode use one process per 4 cores
+        of its share.
+        """
+        self._account()
+        running = len(self._allocations) + 1
+        fair_share = max(1, len(self.cores) // running)
+        if processes is None:
+            processes = max(2, fair_share // 4)
+        threads = max(processes, min(fair_share, thread_cap(height) * processes))
+        allocation = Allocation(label, threads, processes)
+        self._allocations[allocation.id] = allocation
+        self.jobs_total += 1
+        self.peak_threads = max(self.peak_threads, self.allocated)
+        self._rebalance()
+        log(f"🧮 {label}: {threads} threads ({processes} x {allocation.threads_per_process}), "
+            f"{self.allocated}/{len(self.cores)} cores allocated")
+        return allocation
+
+    def release(self, allocation):
+        """Return a job's threads to the pool and rebalance the others"""
+        self._account()
+        if self._allocations.pop(allocation.id, None):
+            self._rebalance()
+
+    def _rebalance(self):
+        """Give every running job a core set in proportion to its threads"""
+        if not self.pin or not self._allocations:
+            return
+        total = max(self.allocated, len(self.cores))  # Shrink the sets when oversubscribed
+        start = 0
+        for allocation in self._allocations.values():
+            count = max(1, allocation.threads * len(self.cores) // total)
+            allocation.cores = [self.cores[(start + n) % len(self.cores)] for n in range(count)]
+            start += count
+            for pid in list(allocation.pids):
+                if not os.path.exists(f"/proc/{pid}"):
+                    allocation.pids.discard(pid)
+                    continue
+                pin_process(pid, allocation.cores)
+
+    def stats(self):
+        """Return allocation and utilisation figures"""
+        self._account()
+        uptime = max(1e-6, time.time() - self._started)
+        try:
+            load = os.getloadavg()[0]
+        except (AttributeError, OSError):
+            load = None
+        return {
+            "cores": len(self.cores),
+            "running": len(self._allocations),
+            "allocated": self.allocated,
+            "allocated_percent": round(self.allocated / len(self.cores) * 100, 1),
+            "average_percent": round(self._thread_seconds / uptime / len(self.cores) * 100, 1),
+            "peak_threads": self.peak_threads,
+            "jobs_total": self.jobs_total,
+            "load_per_core": round(load / len(self.cores), 2) if load is not None else None,
+            "pinned": self.pin,
+        }
@@ -0,0 +1,274 @@
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+from utils import log
+
+MB = 1024 * 1024
+
+TIER_RAM = "ram"
+TIER_DISK = "disk"
+
+
+def pid_alive(pid):
+    """Whether a process with this id exists on this host"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, OSError):
+        return True  # Exists, but belongs to someone else
+    return True
+
+def tree_size(path):
+    """Bytes used by the files below path"""
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass  # Removed while walking
+    return total
+
+
+class JobScratch:
+    """The temp directory of one job; everything in it is removed by close()
+
+    The directory is created on first use, on the tier the job's
+    reservation was made on. Use it as a context manager, or call close()
+    when the job ends however it ends.
+    """
+
+    def __init__(self, space, owner, tier, reserved):
+        self.space = space
+        self.owner = owner
+        self.tier = tier
+        self.reserved = reserved
+        self.directory = None
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _ensure_directory(self):
+        if self.directory is None:
+            root = self.space.tier_root(self.tier)
+            os.makedirs(root, exist_ok=True)
+            # The pid lets the sweeper tell files of a crashed bot from live ones
+            self.directory = tempfile.mkdtemp(prefix=f"{os.getpid()}-{self.owner}-", dir=root)
+        return self.directory
+
+    def path(self, name):
+        """Path of a file in the job's directory"""
+        return os.path.join(self._ensure_directory(), name)
+
+    def subdir(self, prefix):
+        """A fresh directory inside the job's directory, e.g. for segments"""
+        return tempfile.mkdtemp(prefix=prefix, dir=self._ensure_directory())
+
+    def usage(self):
+        """Bytes the job currently has on its tier"""
+        return tree_size(self.directory) if self.directory else 0
+
+    def close(self):
+        """Remove the job's files and return its reservation"""
+        if self.closed:
+            return
+        self.closed = True
+        if self.directory:
+            shutil.rmtree(self.directory, ignore_errors=True)
+        self.space._close(self)
+
+
+class ScratchSpace:
+    """Hand out per-job temp directories within a byte budget
+
+    Jobs reserve the space they expect to need. Small jobs go to a RAM-backed
+    tier (tmpfs such as /dev/shm) to spare the disk, the rest to the disk
+    tier, which holds at most budget_mb of reservations and always leaves
+    min_free_mb free. Directories left behind by a crashed process, or leaked
+    by this one, are swept at startup and every sweep_interval seconds.
+    """
+
+    def __init__(self, root, budget_mb, min_free_mb, size_factor, ram_root=None, ram_max_mb=0,
+                 ram_budget_mb=0, orphan_age=6 * 3600, sweep_interval=600):
+        self.root = root
+        self.budget = budget_mb * MB
+        self.min_free = min_free_mb * MB
+        self.size_factor = size_factor
+        self.ram_root = ram_root if ram_root and ram_budget_mb and os.access(os.path.dirname(ram_root), os.W_OK) else None
+        self.ram_max = ram_max_mb * MB
+        self.ram_budget = ram_budget_mb * MB
+        self.orphan_age = orphan_age
+        self.sweep_interval = sweep_interval
+        self._reservations = {}  # owner -> (tier, bytes)
+        self._open = {}  # owner -> JobScratch
+        self.swept_bytes = 0
+        self.over_budget = 0
+        os.makedirs(root, exist_ok=True)
+
+    def tier_root(self, tier):
+        return self.ram_root if tier == TIER_RAM else self.root
+
+    def estimate(self, size_bytes):
+        """Peak bytes a job with an input of this size may need (input, output, parts)"""
+        return int(size_bytes * self.size_factor)
+
+    def _reserved(self, tier):
+        return sum(size for reserved_tier, size in self._reservations.values() if reserved_tier == tier)
+
+    def _disk_free(self, path):
+        try:
+            return shutil.disk_usage(path).free
+        except OSError:
+            return 0
+
+    def _tier_for(self, size):
+        """The tier that can take size more bytes right now, or None"""
+        if self.ram_root and size <= self.ram_max:
+            ram_free = self._disk_free(os.path.dirname(self.ram_root)) - self._reserved(TIER_RAM)
+            if self._reserved(TIER_RAM) + size <= self.ram_budget and size <= ram_free:
+                return TIER_RAM
+        reserved = self._reserved(TIER_DISK)
+        within_budget = not self.budget or reserved + size <= self.budget
+        if within_budget and size <= self._disk_free(self.root) - reserved - self.min_free:
+            return TIER_DISK
+        return None
+
+    def fits(self, size):
+        """Whether a job needing size bytes can start now"""
+        return self._tier_for(size) is not None
+
+    def could_fit(self, size):
+        """Whether a job needing size bytes could ever start, with nothing else running"""
+        if self.budget and size > self.budget:
+            return False
+        return size <= self._disk_free(self.root) + self._reserved(TIER_DISK) - self.min_free
+
+    def reserve(self, owner, size):
+        """Set size bytes aside for owner; False when no tier has room"""
+        if owner in self._reservations:
+            return True
+        tier = self._tier_for(size)
+        if tier is None:
+            return False
+        self._reservations[owner] = (tier, size)
+        return True
+
+    def release(self, owner):
+        """Return a reservation that no job directory was opened for"""
+        if owner not in self._open:
+            self._reservations.pop(owner, None)
+
+    def open(self, owner, size):
+        """Return the JobScratch of owner, reserving size bytes unless already reserved
+
+        A job that does not fit anywhere still gets a disk directory - it was
+        admitted already - but is counted and logged as over budget.
+        """
+        if owner in self._open:
+            return self._open[owner]
+        if not self.reserve(owner, size):
+            self.over_budget += 1
+            log(f"⚠️  Scratch: {owner} needs {round(size / MB, 1)} MB, more than the budget has left")
+            self._reservations[owner] = (TIER_DISK, size)
+        tier, reserved = self._reservations[owner]
+        scratch = JobScratch(self, owner, tier, reserved)
+        self._open[owner] = scratch
+        return scratch
+
+    def _close(self, scratch):
+        if self._open.get(scratch.owner) is scratch:
+            del self._open[scratch.owner]
+            self._reservations.pop(scratch.owner, None)
+
+    def sweep(self):
+        """Remove directories of dead processes and leaked ones older than orphan_age"""
+        live = {scratch.directory for scratch in self._open.values() if scratch.directory}
+        now = time.time()
+        removed, freed = 0, 0
+        for root in filter(None, (self.root, self.ram_root)):
+            try:
+                entries = os.listdir(root)
+            except OSError:
+                continue
+            for name in entries:
+                path = os.path.join(root, name)
+                if path in live:
+                    continue
+                pid = name.split("-", 1)[0]
+                try:
+                    age = now - os.path.getmtime(path)
+                except OSError:
+                    continue
+                if pid.isdigit() and int(pid) != os.getpid() and not pid_alive(int(pid)):
+                    orphaned = True  # Its process crashed or was killed
+                else:
+                    orphaned = age > self.orphan_age  # Ours or unknown, but long untouched
+                if not orphaned:
+                    continue
+                size = tree_size(path) if os.path.isdir(path) else os.path.getsize(path)
+                if os.path.isdir(path):
+                    shutil.rmtree(path, ignore_errors=True)
+                else:
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        continue
+                removed += 1
+                freed += size
+        if removed:
+            self.swept_bytes += freed
+            log(f"🧹 Scratch sweep: removed {removed} orphaned entries, {round(freed / MB, 1)} MB freed")
+        return removed
+
+    def start(self):
+        """Sweep now and then every sweep_interval seconds; must be called from the running event loop"""
+        self.sweep()
+        asyncio.create_task(self._run(), name="scratch-sweeper")
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                self.sweep()
+                used = sum(scratch.usage() for scratch in list(self._open.values()) if scratch.tier == TIER_DISK)
+                if self.budget and used > self.budget:
+                    log(f"⚠️  Scratch: jobs are using {round(used / MB)} MB, over the {round(self.budget / MB)} MB budget")
+            except Exception as e:
+                log(f"⚠️  Scratch sweep failed: {str(e)}")
+
+    def stats(self):
+        """Return reservations, live usage and sweep counters per tier"""
+        scratches = list(self._open.values())
+        return {
+            "jobs": len(scratches),
+            "ram_jobs": sum(1 for scratch in scratches if scratch.tier == TIER_RAM),
+            "reserved_mb": round(self._reserved(TIER_DISK) / MB, 1),
+            "ram_reserved_mb": round(self._reserved(TIER_RAM) / MB, 1),
+            "used_mb": round(sum(scratch.usage() for scratch in scratches) / MB, 1),
+            "budget_mb": round(self.budget / MB) if self.budget else None,
+            "free_mb": round(self._disk_free(self.root) / MB, 1),
+            "swept_mb": round(self.swept_bytes / MB, 1),
+            "over_budget": self.over_budget,
+        }
+
+
+def scratch_from_config(root=None, ram=True):
+    """ScratchSpace with the SCRATCH_* settings; ram=False for directories other hosts read"""
+    from config import (SCRATCH_DIR, SCRATCH_BUDGET_MB, SCRATCH_MIN_FREE_MB, SCRATCH_SIZE_FACTOR, SCRATCH_RAM_DIR,
+                        SCRATCH_RAM_MAX_MB, SCRATCH_RAM_BUDGET_MB, SCRATCH_ORPHAN_AGE, SCRATCH_SWEEP_INTERVAL)
+    return ScratchSpace(
+        root or SCRATCH_DIR or os.path.join(tempfile.gettempdir(), "compressbot_scratch"),
+        SCRATCH_BUDGET_MB, SCRATCH_MIN_FREE_MB, SCRATCH_SIZE_FACTOR,
+        ram_root=SCRATCH_RAM_DIR if ram else None,
+        ram_max_mb=SCRATCH_RAM_MAX_MB,
+        ram_budget_mb=SCRATCH_RAM_BUDGET_MB,
+        orphan_age=SCRATCH_ORPHAN_AGE,
+        sweep_interval=SCRATCH_SWEEP_INTERVAL
+    )
@@ -0,0 +1,124 @@
+import asyncio
+import os
+import shutil
+import time
+from encoder import video_encode_args, audio_encode_args, run_ffmpeg
+from filtergraph import video_input_args
+from probe import keyframe_times, get_stream
+from utils import log
+
+MIN_SEGMENT_SECONDS = 30  # Shorter segments cost more in process start-up than they gain
+
+def plan_segments(duration, keyframes, count):
+    """Split [0, duration) into about count ranges that start on keyframes"""
+    count = max(1, min(count, int(duration // MIN_SEGMENT_SECONDS)))
+    starts = [0.0]
+    for n in range(1, count):
+        target = duration * n / count
+        # The first keyframe at or after the ideal cut point
+        candidates = [t for t in keyframes if t >= target and t > starts[-1] + 1]
+        if candidates and candidates[0] < duration - 1:
+            starts.append(candidates[0])
+    ends = starts[1:] + [None]  # The last segment runs to the end of the input
+    return list(zip(starts, ends))
+
+async def encode_segment(input_file, output_file, start, end, threads, info, video_bitrate=None, on_progress=None, on_start=None):
+    """Encode the video of one time range; audio is handled separately"""
+    duration_args = ['-t', str(round(end - start, 6))] if end is not None else []
+    cmd = [
+        'ffmpeg', '-threads', str(threads),
+        *video_input_args(info, threads),
+        '-ss', str(round(start, 6)),  # Input seek lands exactly on the keyframe
+        '-i', input_file,
+        *duration_args,
+        '-map', '0:v:0', '-an',
+        *video_encode_args(video_bitrate, threads, info),
+        '-map_metadata', '-1',
+        '-progress', 'pipe:1', '-nostats',
+        '-y', output_file,
+    ]
+    return await run_ffmpeg(cmd, on_progress=on_progress, on_start=on_start)
+
+async def encode_audio(input_file, output_file, on_start=None):
+    """Encode the whole audio track once so the joined file has no audio seams"""
+    cmd = [
+        'ffmpeg', '-i', input_file,
+        '-map', '0:a:0', '-vn',
+        *audio_encode_args(),
+        '-map_metadata', '-1',
+        '-progress', 'pipe:1', '-nostats',
+        '-y', output_file,
+    ]
+    return await run_ffmpeg(cmd, on_start=on_start)
+
+async def encode_segmented(input_file, output_file, info, duration, workers, threads, scratch, video_bitrate=None, on_progress=None, on_start=None):
+    """Encode a long input as parallel keyframe-aligned segments and join them losslessly
+
+    Each segment is a separate ffmpeg process, at most workers of them at a
+    time; the video parts are joined with the concat demuxer and muxed with
+    the separately encoded audio without re-encoding. on_progress receives
+    '-progress' style blocks with the encoded time summed over all segments.
+    on_start(pid) is called for every ffmpeg process. The parts are kept in
+    a directory of the job's scratch.JobScratch. Returns
+    (returncode, stderr_tail, stats) like run_ffmpeg.
+    """
+    started = time.time()
+    work_dir = scratch.subdir('segments_')
+    try:
+        keyframes = await keyframe_times(input_file)
+        segments = plan_segments(duration, keyframes, workers * 2)  # Extra segments even out slow ones
+        log(f"🧩 Segmented encode: {len(segments)} segments on {workers} processes x {threads} threads")
+
+        has_audio = get_stream(info, "audio") is not None
+        audio_file = os.path.join(work_dir, 'audio.m4a')
+        segment_files = [os.path.join(work_dir, f'segment_{n:04d}.mp4') for n in range(len(segments))]
+
+        # Sum the progress of all running segments into one figure
+        encoded_us = [0] * len(segments)
+        def segment_progress(index):
+            def update(block):
+                try:
+                    encoded_us[index] = int(block.get('out_time_us') or 0)
+                except ValueError:
+                    return
+                if on_progress:
+                    on_progress({'out_time_us': sum(encoded_us), 'progress': 'continue'})
+            return update
+
+        slots = asyncio.Semaphore(workers)
+        async def limited(coroutine):
+            async with slots:
+                return await coroutine
+
+        jobs = [
+            limited(encode_segment(input_file, path, start, end, threads, info, video_bitrate, segment_progress(n), on_start))
+            for n, (path, (start, end)) in enumerate(zip(segment_files, segments))
+        ]
+        if has_audio:
+            jobs.append(limited(encode_audio(input_file, audio_file, on_start)))
+        results = await asyncio.gather(*jobs)
+
+        for returncode, stderr, stats in results:
+            if returncode != 0:
+                return returncode, stderr, {"started": started, "finished": time.time(), "stalled": stats["stalled"]}
+
+        list_file = os.path.join(work_dir, 'segments.txt')
+        with open(list_file, 'w') as f:
+            for path in segment_files:
+                f.write(f"file '{path}'\n")
+
+        audio_input = ['-i', audio_file] if has_audio else []
+        audio_map = ['-map', '1:a'] if has_audio else []
+        cmd = [
+            'ffmpeg', '-f', 'concat', '-safe', '0', '-i', list_file,
+            *audio_input,
+            '-map', '0:v', *audio_map, '-c', 'copy',
+            '-movflags', '+faststart',
+            '-map_metadata', '-1',
+            '-progress', 'pipe:1', '-nostats',
+            '-y', output_file,
+        ]
+        returncode, stderr, stats = await run_ffmpeg(cmd, on_start=on_start)
+        return returncode, stderr, {"started": started, "finished": time.time(), "stalled": stats["stalled"]}
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
@@ -0,0 +1,81 @@
+import asyncio
+import os
+import re
+import shutil
+from config import VIDEO_AUDIO_BITRATE, TARGET_SAMPLE_COUNT, TARGET_SAMPLE_SECONDS
+from encoder import video_encode_args, run_ffmpeg
+from filtergraph import video_input_args
+from utils import log, parse_bitrate
+
+CONTAINER_OVERHEAD = 0.03  # Share of the file taken by MP4 headers and index
+MIN_VIDEO_BITRATE = 40 * 1000  # Below this the picture is unusable, so the target is missed instead
+MAX_CORRECTION = 0.4  # Samples may move the bitrate by at most 40% either way
+
+# A caption of only "20mb", "20 MB" or "20 مگ" requests a target size; sizes inside other text do not
+TARGET_SIZE_PATTERN = re.compile(r'\s*(\d+(?:\.\d+)?)\s*(?:mb|مگ)\s*', re.IGNORECASE)
+
+def parse_target_size(caption):
+    """Target size in MB requested in a message caption, or None"""
+    match = TARGET_SIZE_PATTERN.fullmatch(caption or '')
+    if not match:
+        return None
+    size = float(match.group(1))
+    return size if size > 0 else None
+
+def target_video_bitrate(target_mb, duration, has_audio=True):
+    """Video bitrate in bits per second that makes the whole file fit into target_mb"""
+    total_bits = target_mb * 1024 * 1024 * 8 * (1 - CONTAINER_OVERHEAD)
+    audio_bits = parse_bitrate(VIDEO_AUDIO_BITRATE) * duration if has_audio else 0
+    bitrate = int((total_bits - audio_bits) / duration)
+    if bitrate < MIN_VIDEO_BITRATE:
+        log(f"⚠️  {target_mb} MB is too small for {round(duration)} seconds, using the minimum bitrate")
+        return MIN_VIDEO_BITRATE
+    return bitrate
+
+def correction_factor(target, actual):
+    """Ratio that moves a bitrate from actual towards target, bounded by MAX_CORRECTION"""
+    if actual <= 0:
+        return 1.0
+    return min(1 + MAX_CORRECTION, max(1 - MAX_CORRECTION, target / actual))
+
+async def calibrate_bitrate(input_file, duration, bitrate, threads, scratch, info=None, on_start=None):
+    """Encode a few short samples at bitrate and correct it by how far they miss
+
+    x264's rate control over- or undershoots depending on the content, so
+    measuring a handful of seconds spread over the video is much cheaper
+    than finding out after a full encode.
+    """
+    sample_seconds = TARGET_SAMPLE_SECONDS
+    if TARGET_SAMPLE_COUNT <= 0 or duration < sample_seconds * TARGET_SAMPLE_COUNT * 2:
+        return bitrate  # Too short to be worth sampling
+    work_dir = scratch.subdir('samples_')
+    try:
+        starts = [duration * (n + 1) / (TARGET_SAMPLE_COUNT + 1) for n in range(TARGET_SAMPLE_COUNT)]
+        paths = [os.path.join(work_dir, f'sample_{n}.mp4') for n in range(len(starts))]
+        sample_threads = max(1, threads // len(starts))  # The samples run side by side
+
+        async def encode_sample(start, path):
+            cmd = [
+                'ffmpeg', '-threads', str(sample_threads),
+                *video_input_args(info, sample_threads),
+                '-ss', str(round(start, 3)), '-i', input_file,
+                '-t', str(sample_seconds),
+                '-map', '0:v:0', '-an',
+                *video_encode_args(video_bitrate=bitrate, threads=sample_threads, info=info),
+                '-progress', 'pipe:1', '-nostats',
+                '-y', path,
+            ]
+            return (await run_ffmpeg(cmd, on_start=on_start))[0]
+
+        returncodes = await asyncio.gather(*(encode_sample(start, path) for start, path in zip(starts, paths)))
+        if any(returncodes) or not all(os.path.exists(path) for path in paths):
+            log("⚠️  Sample encode failed, keeping the computed bitrate")
+            return bitrate
+
+        sample_bits = sum(os.path.getsize(path) for path in paths) * 8
+        measured = sample_bits / (sample_seconds * len(paths))
+        corrected = int(bitrate * correction_factor(bitrate, measured))
+        log(f"🎯 Samples came out at {round(measured / 1000)} kbps for {round(bitrate / 1000)} kbps, using {round(corrected / 1000)} kbps")
+        return max(MIN_VIDEO_BITRATE, corrected)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
@@ -0,0 +1,160 @@
+from types import SimpleNamespace
+
+import pytest
+
+from admission import (
+    AdmissionController, MB, REJECT_BUSY, REJECT_DISK, REJECT_QUOTA, REJECT_USER_QUEUE,
+    WAIT_CAPACITY, WAIT_DISK, WAIT_USER_LIMIT
+)
+
+
+class FakePipeline:
+    def __init__(self, max_jobs):
+        self.max_jobs = max_jobs
+        self.jobs = []
+
+    @property
+    def in_flight(self):
+        return len(self.jobs)
+
+    def submit(self, job):
+        self.jobs.append(job)
+        return len(self.jobs)
+
+    def finish(self, admission, job, refund=False):
+        self.jobs.remove(job)
+        admission.release(job, refund=refund)
+        admission._admit()  # What the admission task does when woken up
+
+
+class FakeScratch:
+    def __init__(self, total_mb):
+        self.total = total_mb * MB
+        self.reserved = {}
+
+    def estimate(self, size_bytes):
+        return size_bytes * 2
+
+    def could_fit(self, needed):
+        return needed <= self.total
+
+    def fits(self, needed):
+        return needed <= self.total - sum(self.reserved.values())
+
+    def reserve(self, job_id, needed):
+        if not self.fits(needed):
+            return False
+        self.reserved[job_id] = needed
+        return True
+
+    def release(self, job_id):
+        self.reserved.pop(job_id, None)
+
+
+def make_job(job_id, user_id, size_mb=1, user_limit=None):
+    return SimpleNamespace(id=job_id, user_id=user_id, original_size=size_mb, submitted_at=job_id,
+                           user_limit=user_limit)
+
+
+@pytest.fixture
+def pipeline():
+    return FakePipeline(max_jobs=2)
+
+
+def make_admission(pipeline, scratch_mb=100, max_per_user=1, max_queued_per_user=5, max_waiting=10,
+                   daily_quota_mb=0, weights=None):
+    return AdmissionController(pipeline, FakeScratch(scratch_mb), cores=1, max_per_user=max_per_user,
+                               max_queued_per_user=max_queued_per_user, max_waiting=max_waiting,
+                               daily_quota_mb=daily_quota_mb, weights=weights or {}, max_load=0)
+
+
+def test_users_take_turns(pipeline):
+    admission = make_admission(pipeline)
+    heavy = [make_job(n, "heavy") for n in range(1, 5)]
+    assert admission.enqueue(heavy[0]) == (1, None)
+    assert admission.enqueue(heavy[1]) == (1, WAIT_USER_LIMIT)
+    assert admission.enqueue(heavy[2]) == (2, WAIT_USER_LIMIT)
+    light = make_job(5, "light")
+    assert admission.enqueue(light) == (2, None)  # Skips the heavy user's backlog
+    assert admission.enqueue(heavy[3]) == (3, WAIT_USER_LIMIT)
+
+    pipeline.finish(admission, light)
+    assert pipeline.jobs == [heavy[0]]  # The heavy user is still at their limit
+    pipeline.finish(admission, heavy[0])
+    assert pipeline.jobs == [heavy[1]]
+    assert admission.stats()["waiting"] == 2
+
+
+def test_weights_decide_who_goes_first(pipeline):
+    admission = make_admission(pipeline, max_per_user=2, weights={"vip": 2})
+    pipeline.max_jobs = 0
+    for job in [make_job(1, "a"), make_job(2, "a"), make_job(3, "vip"), make_job(4, "vip")]:
+        assert admission.enqueue(job)[1] == WAIT_CAPACITY
+    pipeline.max_jobs = 3
+    admission._admit()
+    assert [job.id for job in pipeline.jobs] == [1, 3, 4]
+
+
+def test_album_jobs_may_run_together(pipeline):
+    admission = make_admission(pipeline)
+    album = [make_job(n, "u", user_limit=2) for n in range(1, 4)]
+    results = [admission.enqueue(job) for job in album]
+    assert results == [(1, None), (2, None), (1, WAIT_USER_LIMIT)]
+
+
+def test_waiting_for_disk(pipeline):
+    admission = make_admission(pipeline, scratch_mb=10)
+    assert admission.enqueue(make_job(1, "a", size_mb=4)) == (1, None)
+    assert admission.enqueue(make_job(2, "b", size_mb=4)) == (1, WAIT_DISK)
+    small = make_job(3, "c", size_mb=1)
+    assert admission.enqueue(small) == (2, None)  # A smaller file still fits
+
+
+def test_rejections(pipeline):
+    admission = make_admission(pipeline, scratch_mb=10, max_queued_per_user=1, max_waiting=2,
+                               daily_quota_mb=8)
+    pipeline.max_jobs = 0
+    assert admission.check("a", 9 * MB) == REJECT_QUOTA
+    assert admission.check("a", 6 * MB) == REJECT_DISK
+    admission.enqueue(make_job(1, "a"))
+    assert admission.check("a", MB) == REJECT_USER_QUEUE
+    admission.enqueue(make_job(2, "b"))
+    assert admission.check("c", MB) == REJECT_BUSY
+    assert admission.stats()["rejected"] == {
+        REJECT_QUOTA: 1, REJECT_USER_QUEUE: 1, REJECT_BUSY: 1, REJECT_DISK: 1
+    }
+
+
+def test_quota_counts_accepted_bytes(pipeline):
+    admission = make_admission(pipeline, daily_quota_mb=5)
+    admission.enqueue(make_job(1, "a", size_mb=3))
+    assert admission.usage("a") == 3 * MB
+    assert admission.check("a", 3 * MB) == REJECT_QUOTA
+    assert admission.check("b", 3 * MB) is None
+
+
+def test_cancelled_job_is_refunded(pipeline):
+    admission = make_admission(pipeline, daily_quota_mb=10)
+    pipeline.max_jobs = 0
+    job = make_job(1, "a", size_mb=3)
+    admission.enqueue(job)
+    assert admission.cancel(job)
+    assert admission.usage("a") == 0
+    assert not admission.cancel(job)
+    assert admission.stats()["waiting"] == 0
+
+
+def test_refund_on_release_only_when_asked(pipeline):
+    admission = make_admission(pipeline, daily_quota_mb=10)
+    done, failed = make_job(1, "a", size_mb=3), make_job(2, "a", size_mb=2)
+    admission.max_per_user = 2
+    admission.enqueue(done)
+    admission.enqueue(failed)
+    pipeline.finish(admission, done)
+    assert admission.usage("a") == 5 * MB
+    pipeline.finish(admission, failed, refund=True)
+    assert admission.usage("a") == 3 * MB
+    admission.refund(failed)  # Already refunded
+    admission.refund(done)  # Released without refund, nothing left to give back
+    assert admission.usage("a") == 3 * MB
+    assert admission.stats()["running"] == 0
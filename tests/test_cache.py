@@ -0,0 +1,83 @@
+import pytest
+
+import cache
+from cache import ResultCache, profile_hash
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache, "time", clock)
+    return clock
+
+
+def test_profile_hash_is_stable_and_order_independent():
+    assert profile_hash({"a": 1, "b": 2}) == profile_hash({"b": 2, "a": 1})
+    assert profile_hash({"a": 1}) != profile_hash({"a": 2})
+    assert len(profile_hash({})) == 16
+
+
+def test_put_and_get(tmp_path, clock):
+    results = ResultCache(str(tmp_path / "cache.db"), 10, 0)
+    assert results.get("u1", "p") is None
+    results.put("u1", "p", "file1", 1.5)
+    assert results.get("u1", "p") == {"file_id": "file1", "output_size": 1.5}
+    assert results.get("u1", "other") is None
+    assert (results.hits, results.misses) == (1, 2)
+
+
+def test_entries_survive_a_restart(tmp_path, clock):
+    ResultCache(str(tmp_path / "cache.db"), 10, 0).put("u1", "p", "file1", 1.5)
+    assert ResultCache(str(tmp_path / "cache.db"), 10, 0).get("u1", "p")["file_id"] == "file1"
+
+
+def test_entries_expire(tmp_path, clock):
+    results = ResultCache(str(tmp_path / "cache.db"), 10, 60)
+    results.put("u1", "p", "file1", 1.5)
+    clock.now += 61
+    assert results.get("u1", "p") is None
+    assert results.stats()["entries"] == 0
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path, clock):
+    results = ResultCache(str(tmp_path / "cache.db"), 2, 0)
+    results.put("u1", "p", "file1", 1)
+    clock.now += 1
+    results.put("u2", "p", "file2", 1)
+    clock.now += 1
+    results.get("u1", "p")  # u2 is now the least recently used
+    clock.now += 1
+    results.put("u3", "p", "file3", 1)
+    assert results.get("u2", "p") is None
+    assert results.get("u1", "p") and results.get("u3", "p")
+
+
+def test_invalidate_keeps_the_current_profile_and_its_variants(tmp_path, clock):
+    results = ResultCache(str(tmp_path / "cache.db"), 10, 0)
+    for profile in ("new", "new:target20", "old", "old:animation", "newer"):
+        results.put("u1", profile, f"file-{profile}", 1)
+    assert results.invalidate(keep_profile="new") == 3
+    assert results.get("u1", "new") and results.get("u1", "new:target20")
+    assert results.get("u1", "newer") is None
+    assert results.invalidate() == 2
+
+
+def test_identical_jobs_are_merged(tmp_path, clock):
+    results = ResultCache(str(tmp_path / "cache.db"), 10, 0)
+    key = ("u1", "p")
+    assert results.claim(key, "leader")
+    assert results.in_flight(key)
+    assert not results.claim(key, "follower1")
+    assert not results.claim(key, "follower2")
+    assert results.release(key) == ["follower1", "follower2"]
+    assert not results.in_flight(key)
+    assert results.release(key) == []
+    assert results.merged == 2
@@ -0,0 +1,104 @@
+import asyncio
+import os
+
+import pytest
+
+import downloader
+from benchmarks.fake_client import FakeClient
+
+MB = downloader.MB
+
+
+async def no_sleep(seconds):
+    pass
+
+
+def write_source(path, size):
+    data = bytes(range(256)) * (size // 256) + bytes(size % 256)
+    with open(path, 'wb') as f:
+        f.write(data)
+    return data
+
+
+def test_ranged_download_creates_the_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(downloader, "DOWNLOAD_CONNECTIONS", 3)
+    monkeypatch.setattr(downloader, "DOWNLOAD_PARALLEL_MIN_SIZE", 1)
+    data = write_source(tmp_path / "source.mp4", 5 * MB + 123)
+    client = FakeClient()
+    message = client.message("video", str(tmp_path / "source.mp4"))
+    target = tmp_path / "input"
+
+    result = asyncio.run(downloader.download_media_safe(client, message.video.file_id, message, str(target)))
+
+    assert result == str(target)
+    assert target.read_bytes() == data
+
+
+def test_sequential_download(tmp_path, monkeypatch):
+    monkeypatch.setattr(downloader, "DOWNLOAD_CONNECTIONS", 1)
+    data = write_source(tmp_path / "source.mp4", 2 * MB + 7)
+    client = FakeClient()
+    message = client.message("video", str(tmp_path / "source.mp4"))
+
+    asyncio.run(downloader.download_media_safe(client, message.video.file_id, message, str(tmp_path / "input")))
+
+    assert (tmp_path / "input").read_bytes() == data
+
+
+class ShortStreamClient(FakeClient):
+    """Ends the stream after cut_after chunks for the first `short` requests"""
+
+    def __init__(self, short, cut_after=1):
+        super().__init__()
+        self.short = short
+        self.cut_after = cut_after
+        self.requests = 0
+
+    async def stream_media(self, file_id, offset=0, limit=0):
+        self.requests += 1
+        cut = self.requests <= self.short
+        sent = 0
+        async for chunk in super().stream_media(file_id, offset, limit):
+            if cut and sent == self.cut_after:
+                return
+            sent += 1
+            yield chunk
+
+
+def test_sequential_download_resumes_a_stream_cut_short(tmp_path, monkeypatch):
+    monkeypatch.setattr(downloader, "DOWNLOAD_CONNECTIONS", 1)
+    monkeypatch.setattr(downloader.asyncio, "sleep", no_sleep)
+    data = write_source(tmp_path / "source.mp4", 3 * MB)
+    client = ShortStreamClient(short=1)
+    message = client.message("video", str(tmp_path / "source.mp4"))
+
+    asyncio.run(downloader.download_media_safe(client, message.video.file_id, message, str(tmp_path / "input")))
+
+    assert (tmp_path / "input").read_bytes() == data
+    assert client.requests == 2
+
+
+def test_download_that_stays_short_fails(tmp_path, monkeypatch):
+    monkeypatch.setattr(downloader, "DOWNLOAD_CONNECTIONS", 1)
+    monkeypatch.setattr(downloader, "DOWNLOAD_MAX_RETRIES", 1)
+    monkeypatch.setattr(downloader.asyncio, "sleep", no_sleep)
+    write_source(tmp_path / "source.mp4", 3 * MB)
+    client = ShortStreamClient(short=100, cut_after=0)
+    message = client.message("video", str(tmp_path / "source.mp4"))
+
+    with pytest.raises(ConnectionError):
+        asyncio.run(downloader.download_media_safe(client, message.video.file_id, message, str(tmp_path / "input")))
+    assert not os.path.exists(tmp_path / "input")
+
+
+def test_ranged_download_resumes_short_ranges(tmp_path, monkeypatch):
+    monkeypatch.setattr(downloader, "DOWNLOAD_CONNECTIONS", 2)
+    monkeypatch.setattr(downloader, "DOWNLOAD_PARALLEL_MIN_SIZE", 1)
+    monkeypatch.setattr(downloader.asyncio, "sleep", no_sleep)
+    data = write_source(tmp_path / "source.mp4", 6 * MB)
+    client = ShortStreamClient(short=2)
+    message = client.message("video", str(tmp_path / "source.mp4"))
+
+    asyncio.run(downloader.download_media_safe(client, message.video.file_id, message, str(tmp_path / "input")))
+
+    assert (tmp_path / "input").read_bytes() == data
@@ -0,0 +1,66 @@
+import pytest
+
+import filtergraph
+
+
+@pytest.fixture(autouse=True)
+def fixed_settings(monkeypatch):
+    monkeypatch.setattr(filtergraph, "VIDEO_SCALE", "640:360")
+    monkeypatch.setattr(filtergraph, "VIDEO_FPS", 24)
+
+
+def probe(width, height, rate="30/1", codec="h264", **stream):
+    return {"streams": [{
+        "codec_type": "video", "codec_name": codec, "width": width, "height": height, "avg_frame_rate": rate, **stream
+    }]}
+
+
+def test_fps_is_dropped_before_scaling():
+    assert filtergraph.video_filter_args(probe(1920, 1080)) == ['-vf', "fps=24,scale=640:360:flags=area,setsar=1"]
+
+
+def test_input_that_fits_is_left_alone():
+    assert filtergraph.video_filter_args(probe(640, 360, rate="24/1")) == []
+    assert filtergraph.video_filter_args(probe(320, 240, rate="15/1")) == []
+
+
+def test_portrait_and_rotated_inputs_keep_their_orientation():
+    assert filtergraph.plan_video_filter(probe(1080, 1920))["size"] == (360, 640)
+    rotated = probe(1920, 1080, side_data_list=[{"rotation": -90}])
+    assert filtergraph.plan_video_filter(rotated)["size"] == (360, 640)
+
+
+def test_non_square_pixels_are_resolved():
+    # 720x576 with 16:15 pixels displays as 768x576
+    assert filtergraph.plan_video_filter(probe(720, 576, sample_aspect_ratio="16:15"))["size"] == (480, 360)
+
+
+def test_small_reductions_use_bilinear():
+    assert filtergraph.plan_video_filter(probe(960, 540))["flags"] == "bilinear"
+
+
+def test_lowres_decoding_for_large_mpeg4():
+    plan = filtergraph.plan_video_filter(probe(2560, 1440, codec="mpeg4"))
+    assert plan["lowres"] == 2
+    assert filtergraph.video_input_args(probe(2560, 1440, codec="mpeg4"))[:2] == ['-lowres', '2']
+    assert filtergraph.plan_video_filter(probe(2560, 1440))["lowres"] == 0  # h264 cannot
+
+
+def test_filter_threads_follow_the_resolution():
+    assert filtergraph.video_input_args(probe(640, 360), threads=8) == ['-filter_threads', '1']
+    assert filtergraph.video_input_args(probe(3840, 2160), threads=8) == ['-filter_threads', '8']
+
+
+def test_unknown_input_gets_the_fallback_filter():
+    args = filtergraph.video_filter_args(None)
+    assert args[0] == '-vf' and args[1].startswith("fps=24,scale=w=")
+    assert filtergraph.video_input_args(None, threads=4) == []
+
+
+@pytest.mark.parametrize("stream, expected", [
+    ({"avg_frame_rate": "30000/1001"}, 30000 / 1001),
+    ({"avg_frame_rate": "0/0", "r_frame_rate": "25/1"}, 25.0),
+    ({}, None),
+])
+def test_frame_rate(stream, expected):
+    assert filtergraph.frame_rate(stream) == expected
@@ -0,0 +1,107 @@
+import pytest
+
+import jobstore
+from jobstore import JobStore, JOB_NEW, JOB_PENDING, JOB_LEASED, JOB_ENCODED, JOB_FAILED, JOB_DONE
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(jobstore, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def store(tmp_path, clock):
+    return JobStore(str(tmp_path / "jobs.db"), lease_seconds=60, max_attempts=2)
+
+
+def test_job_lifecycle(store):
+    job_id = store.add(1, 10, 11, {"original_size": 5})
+    assert store.get(job_id)["state"] == JOB_NEW
+    assert store.claim("w1") is None  # Not downloaded yet
+
+    store.enqueue(job_id, input_name="job_1.input")
+    job = store.claim("w1")
+    assert job["id"] == job_id and job["state"] == JOB_LEASED and job["attempts"] == 1
+    assert job["payload"] == {"original_size": 5, "input_name": "job_1.input"}
+    assert store.claim("w2") is None
+
+    assert store.heartbeat(job_id, "w1", progress=40)
+    assert store.get(job_id)["progress"] == 40
+    assert store.complete(job_id, "w1", output_size=1.5)
+    job = store.get(job_id)
+    assert job["state"] == JOB_ENCODED and job["payload"]["output_size"] == 1.5
+
+    store.mark(job_id, JOB_DONE)
+    assert store.unfinished() == []
+
+
+def test_jobs_are_claimed_oldest_first(store):
+    ids = [store.add(1, n, None, {}) for n in range(3)]
+    for job_id in reversed(ids):
+        store.enqueue(job_id)
+    assert [store.claim("w")["id"] for _ in ids] == ids
+
+
+def test_expired_lease_is_requeued_and_the_old_worker_is_locked_out(store, clock):
+    job_id = store.add(1, 10, None, {})
+    store.enqueue(job_id)
+    store.claim("w1")
+    clock.now += 61
+    job = store.claim("w2")
+    assert job["id"] == job_id and job["worker"] == "w2" and job["attempts"] == 2
+    assert not store.heartbeat(job_id, "w1")
+    assert not store.complete(job_id, "w1")
+    assert store.fail(job_id, "w2", "ffmpeg exited with code 1")
+    assert store.get(job_id)["state"] == JOB_FAILED
+
+
+def test_job_fails_after_max_attempts(store, clock):
+    job_id = store.add(1, 10, None, {})
+    store.enqueue(job_id)
+    for _ in range(2):
+        store.claim("w1")
+        clock.now += 61
+    assert store.claim("w1") is None
+    job = store.get(job_id)
+    assert job["state"] == JOB_FAILED and job["error"] == "worker lost too many times"
+
+
+def test_heartbeat_keeps_the_lease(store, clock):
+    job_id = store.add(1, 10, None, {})
+    store.enqueue(job_id)
+    store.claim("w1")
+    clock.now += 50
+    assert store.heartbeat(job_id, "w1")
+    clock.now += 50
+    assert store.claim("w2") is None
+    assert store.stats() == {JOB_LEASED: 1, "workers": 1}
+
+
+def test_unfinished_jobs_survive_a_restart(tmp_path, clock):
+    path = str(tmp_path / "jobs.db")
+    first = JobStore(path, 60, 2)
+    kept = first.add(1, 10, 11, {"a": 1})
+    first.mark(first.add(1, 12, 13, {}), JOB_DONE)
+    assert [job["id"] for job in JobStore(path, 60, 2).unfinished()] == [kept]
+
+
+def test_purge_removes_old_answered_jobs(store, clock):
+    old = store.add(1, 10, None, {})
+    store.mark(old, JOB_DONE)
+    clock.now += 100
+    recent = store.add(1, 11, None, {})
+    store.mark(recent, JOB_DONE)
+    assert store.purge(50) == 1
+    assert store.get(old) is None and store.get(recent)["state"] == JOB_DONE
+    assert store.get(store.add(1, 12, None, {}))["state"] == JOB_NEW
+    assert JOB_PENDING not in store.stats()
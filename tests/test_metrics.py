@@ -0,0 +1,21 @@
+import pytest
+
+from metrics import percentile
+
+
+@pytest.mark.parametrize("n, p50, p95", [
+    (1, 1, 1),
+    (2, 1, 2),
+    (4, 2, 4),
+    (20, 10, 19),
+])
+def test_percentile_is_nearest_rank(n, p50, p95):
+    values = list(range(n, 0, -1))  # Unsorted on purpose
+    assert percentile(values, 50) == p50
+    assert percentile(values, 95) == p95
+
+
+def test_percentile_bounds():
+    assert percentile([], 50) is None
+    assert percentile([3, 1, 2], 0) == 1
+    assert percentile([3, 1, 2], 100) == 3
@@ -0,0 +1,86 @@
+import pytest
+
+import animation
+import filtergraph
+import planner
+from planner import (
+    plan_encode, plan_animation, build_plan_command,
+    PLAN_ORIGINAL, PLAN_REMUX, PLAN_COPY_VIDEO, PLAN_ENCODE, PLAN_ANIMATION, PLAN_ANIMATION_COPY,
+)
+
+
+@pytest.fixture(autouse=True)
+def fixed_settings(monkeypatch):
+    monkeypatch.setattr(filtergraph, "VIDEO_SCALE", "640:360")
+    monkeypatch.setattr(planner, "VIDEO_AUDIO_BITRATE", "64k")
+    monkeypatch.setattr(planner, "PLAN_COPY_MAX_VIDEO_BITRATE", "600k")
+    monkeypatch.setattr(planner, "PLAN_ENCODE_BITRATE_ESTIMATE", "350k")
+    monkeypatch.setattr(animation, "ANIMATION_COPY_MAX_MB", 2)
+    monkeypatch.setattr(animation, "ANIMATION_MAX_SIDE", 480)
+
+
+def probe(width=640, height=360, codec="h264", video_bitrate=400000, audio="aac", audio_bitrate=64000,
+          format_name="mov,mp4,m4a,3gp,3g2,mj2", duration=60):
+    streams = [{"codec_type": "video", "codec_name": codec, "pix_fmt": "yuv420p",
+                "width": width, "height": height, "bit_rate": str(video_bitrate)}]
+    if audio:
+        streams.append({"codec_type": "audio", "codec_name": audio, "bit_rate": str(audio_bitrate)})
+    return {"streams": streams, "format": {"format_name": format_name, "duration": str(duration)}}
+
+
+def test_fast_start_mp4_within_limits_is_kept():
+    assert plan_encode(probe(), 3.5, faststart=True).action == PLAN_ORIGINAL
+
+
+def test_mp4_without_fast_start_is_remuxed():
+    assert plan_encode(probe(), 3.5, faststart=False).action == PLAN_REMUX
+    assert plan_encode(probe(format_name="matroska,webm"), 3.5, faststart=True).action == PLAN_REMUX
+
+
+def test_foreign_audio_is_transcoded_with_the_video_copied():
+    plan = plan_encode(probe(audio="opus"), 3.5, faststart=True)
+    assert plan.action == PLAN_COPY_VIDEO
+    assert plan.predicted_size == round((400000 + 64000) * 60 / 8 / 1024 / 1024, 2)
+
+
+@pytest.mark.parametrize("info, reason", [
+    (probe(width=1280, height=720), "1280x720"),
+    (probe(codec="hevc"), "hevc"),
+    (probe(video_bitrate=2000000), "too high"),
+    (None, "no usable probe data"),
+])
+def test_encode_when_a_copy_would_not_do(info, reason):
+    plan = plan_encode(info, 3.5, faststart=True)
+    assert plan.action == PLAN_ENCODE
+    assert reason in plan.reason
+
+
+def test_target_size_forces_an_encode_when_a_copy_is_too_big():
+    plan = plan_encode(probe(), 3.5, faststart=True, target_size=2)
+    assert plan.action == PLAN_ENCODE
+    assert plan.predicted_size == 2
+    assert plan_encode(probe(), 3.5, faststart=True, target_size=10).action == PLAN_ORIGINAL
+
+
+def test_expression_scale_never_skips_the_encode(monkeypatch):
+    monkeypatch.setattr(filtergraph, "VIDEO_SCALE", "min(1920,iw):min(1080,ih)")
+    assert plan_encode(probe(), 3.5, faststart=True).action == PLAN_ENCODE
+
+
+def test_animation_plans():
+    small = probe(width=320, height=240, audio=None)
+    assert plan_animation(small, 1, faststart=True).action == PLAN_ORIGINAL
+    assert plan_animation(small, 1, faststart=False).action == PLAN_ANIMATION_COPY
+    assert plan_animation(probe(width=320, height=240), 1, faststart=True).action == PLAN_ANIMATION_COPY
+    assert plan_animation(small, 5, faststart=True).action == PLAN_ANIMATION
+    assert plan_animation(probe(width=320, height=240, codec="gif", audio=None), 1, True).action == PLAN_ANIMATION
+
+
+def test_copy_commands():
+    remux = build_plan_command(plan_encode(probe(), 3.5, faststart=False), "in.mkv", "out.mp4")
+    assert remux[remux.index('-c') + 1] == 'copy'
+    assert '+faststart' in remux and remux[-1] == "out.mp4"
+    copy_video = build_plan_command(plan_encode(probe(audio="opus"), 3.5, faststart=True), "in.mkv", "out.mp4")
+    assert copy_video[copy_video.index('-c:v') + 1] == 'copy'
+    with pytest.raises(ValueError):
+        build_plan_command(plan_encode(None, 3.5, faststart=True), "in.mkv", "out.mp4")
@@ -0,0 +1,29 @@
+from segmented import plan_segments, MIN_SEGMENT_SECONDS
+
+
+def test_segments_start_on_keyframes_and_cover_the_input():
+    keyframes = [float(t) for t in range(0, 600, 7)]
+    segments = plan_segments(600, keyframes, 4)
+    assert len(segments) == 4
+    assert segments[0][0] == 0.0
+    assert segments[-1][1] is None  # The last one runs to the end
+    for (start, end), (next_start, _) in zip(segments, segments[1:]):
+        assert end == next_start
+        assert start in keyframes
+    assert [start for start, _ in segments[1:]] == [154.0, 301.0, 455.0]
+
+
+def test_short_inputs_get_fewer_segments():
+    keyframes = [float(t) for t in range(0, 90, 2)]
+    assert len(plan_segments(90, keyframes, 8)) == 90 // MIN_SEGMENT_SECONDS
+    assert plan_segments(20, keyframes, 8) == [(0.0, None)]
+
+
+def test_without_usable_keyframes_there_is_one_segment():
+    assert plan_segments(600, [], 4) == [(0.0, None)]
+    assert plan_segments(600, [0.0, 599.5], 4) == [(0.0, None)]  # Too close to the end
+
+
+def test_sparse_keyframes_are_not_used_twice():
+    segments = plan_segments(600, [0.0, 500.0], 4)
+    assert segments == [(0.0, 500.0), (500.0, None)]
@@ -0,0 +1,80 @@
+import asyncio
+import tempfile
+
+import pytest
+
+import target_size
+from target_size import parse_target_size, target_video_bitrate, correction_factor, calibrate_bitrate, MIN_VIDEO_BITRATE
+
+
+@pytest.mark.parametrize("caption, expected", [
+    ("20mb", 20.0),
+    (" 20 MB ", 20.0),
+    ("2.5 مگ", 2.5),
+    ("4mbps", None),
+    ("Size: 300MB", None),
+    ("2.5 MB file", None),
+    ("0mb", None),
+    ("", None),
+    (None, None),
+])
+def test_parse_target_size(caption, expected):
+    assert parse_target_size(caption) == expected
+
+
+def test_bitrate_fills_the_target(monkeypatch):
+    monkeypatch.setattr(target_size, "VIDEO_AUDIO_BITRATE", "64k")
+    bitrate = target_video_bitrate(10, 100)
+    total_bits = 10 * 1024 * 1024 * 8 * (1 - target_size.CONTAINER_OVERHEAD)
+    assert bitrate == int((total_bits - 64000 * 100) / 100)
+    assert target_video_bitrate(10, 100, has_audio=False) > bitrate
+
+
+def test_bitrate_never_drops_below_the_minimum():
+    assert target_video_bitrate(1, 3600) == MIN_VIDEO_BITRATE
+
+
+@pytest.mark.parametrize("target, actual, expected", [
+    (10, 10, 1.0),
+    (10, 12.5, 0.8),
+    (10, 100, 1 - target_size.MAX_CORRECTION),
+    (10, 1, 1 + target_size.MAX_CORRECTION),
+    (10, 0, 1.0),
+])
+def test_correction_factor(target, actual, expected):
+    assert correction_factor(target, actual) == pytest.approx(expected)
+
+
+class FakeScratch:
+    def subdir(self, prefix):
+        return tempfile.mkdtemp(prefix=prefix)
+
+
+def test_calibration_corrects_by_the_samples(monkeypatch):
+    monkeypatch.setattr(target_size, "TARGET_SAMPLE_COUNT", 3)
+    monkeypatch.setattr(target_size, "TARGET_SAMPLE_SECONDS", 4)
+
+    async def fake_ffmpeg(cmd, on_start=None):
+        # Every sample comes out at 125 kbps for the requested 100 kbps
+        with open(cmd[-1], 'wb') as f:
+            f.write(bytes(125000 * 4 // 8))
+        return 0, "", {}
+
+    monkeypatch.setattr(target_size, "run_ffmpeg", fake_ffmpeg)
+    assert asyncio.run(calibrate_bitrate("in.mp4", 600, 100000, 4, FakeScratch())) == 80000
+
+
+def test_calibration_is_skipped_for_short_videos(monkeypatch):
+    async def fail(*args, **kwargs):
+        raise AssertionError("no samples expected")
+
+    monkeypatch.setattr(target_size, "run_ffmpeg", fail)
+    assert asyncio.run(calibrate_bitrate("in.mp4", 10, 100000, 4, FakeScratch())) == 100000
+
+
+def test_failed_samples_keep_the_computed_bitrate(monkeypatch):
+    async def broken(cmd, on_start=None):
+        return 1, "error", {}
+
+    monkeypatch.setattr(target_size, "run_ffmpeg", broken)
+    assert asyncio.run(calibrate_bitrate("in.mp4", 600, 100000, 4, FakeScratch())) == 100000
@@ -0,0 +1,159 @@
+import asyncio
+import contextlib
+import inspect
+import os
+import time
+from pyrogram import Client, raw
+from pyrogram.errors import FloodWait
+from pyrogram.session import Session
+from config import UPLOAD_CONNECTIONS, UPLOAD_PARALLEL_MIN_SIZE, UPLOAD_MAX_RETRIES, UPLOAD_THUMBNAILS
+from encoder import run_ffmpeg
+from filtergraph import build_preview_command, display_size
+from probe import probe_media, get_duration, get_stream
+from utils import log
+
+MB = 1024 * 1024
+PART_SIZE = 512 * 1024  # Largest part Telegram accepts; every part but the last has this size
+BIG_FILE_SIZE = 10 * MB  # Larger files have to be sent with SaveBigFilePart
+
+
+async def report_progress(progress, current, total, progress_args=()):
+    """Call a Pyrogram style progress callback, sync or async"""
+    if progress:
+        result = progress(current, total, *progress_args)
+        if inspect.isawaitable(result):
+            await result
+
+async def upload_parts(client, path, progress=None, progress_args=()):
+    """Upload a big file as parallel SaveBigFilePart calls and return its InputFileBig
+
+    UPLOAD_CONNECTIONS parts are in flight at once over one media session,
+    like Pyrogram's own uploader. A failed part is retried on its own, up
+    to UPLOAD_MAX_RETRIES attempts, instead of restarting the file;
+    FloodWaits are waited out without counting as failures.
+    """
+    size = os.path.getsize(path)
+    total_parts = -(-size // PART_SIZE)  # Ceiling division
+    file_id = client.rnd_id()
+    parts = asyncio.Queue()
+    for part in range(total_parts):
+        parts.put_nowait(part)
+    sent = [0]
+    stats = {"retries": 0}
+
+    session = Session(
+        client, await client.storage.dc_id(), await client.storage.auth_key(), await client.storage.test_mode(),
+        is_media=True
+    )
+    fd = os.open(path, os.O_RDONLY)
+
+    async def send_part(part):
+        data = os.pread(fd, PART_SIZE, part * PART_SIZE)
+        attempt = 1
+        while True:
+            try:
+                await session.invoke(raw.functions.upload.SaveBigFilePart(
+                    file_id=file_id, file_part=part, file_total_parts=total_parts, bytes=data
+                ))
+                break
+            except FloodWait as e:
+                log(f"🐢 FloodWait on upload part {part}, waiting {e.value} seconds")
+                await asyncio.sleep(e.value)
+            except Exception as e:
+                if attempt >= UPLOAD_MAX_RETRIES:
+                    raise
+                stats["retries"] += 1
+                log(f"❌ Upload part {part}/{total_parts} failed: {str(e)}, retrying ({attempt}/{UPLOAD_MAX_RETRIES})")
+                await asyncio.sleep(attempt * 2)
+                attempt += 1
+        sent[0] += len(data)
+        await report_progress(progress, sent[0], size, progress_args)
+
+    async def worker():
+        while not parts.empty():
+            await send_part(parts.get_nowait())
+
+    start_time = time.time()
+    tasks = []
+    try:
+        await session.start()
+        tasks = [asyncio.create_task(worker()) for _ in range(min(UPLOAD_CONNECTIONS, total_parts))]
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()  # Only still running when another part failed for good
+        await asyncio.gather(*tasks, return_exceptions=True)
+        os.close(fd)
+        await session.stop()
+
+    elapsed = time.time() - start_time
+    log(
+        f"✅ Upload completed: {round(size / MB, 2)} MB in {round(elapsed, 2)} seconds | "
+        f"Average speed: {round(size / MB / elapsed, 2) if elapsed > 0 else 0} MB/s | "
+        f"Parts: {total_parts} x {min(UPLOAD_CONNECTIONS, total_parts)} in flight | Retries: {stats['retries']}"
+    )
+    return raw.types.InputFileBig(id=file_id, parts=total_parts, name=os.path.basename(path))
+
+
+class UploadClient(Client):
+    """pyrogram.Client that uploads large files as parallel parts
+
+    Every send method goes through save_file, so reply_video and friends
+    get the parallel upload without changes. Small files, file objects and
+    resumed uploads are left to Pyrogram.
+    """
+
+    async def save_file(self, path, file_id=None, file_part=0, progress=None, progress_args=()):
+        parallel = (
+            UPLOAD_CONNECTIONS > 1 and file_id is None and isinstance(path, str) and os.path.isfile(path)
+            and os.path.getsize(path) > max(UPLOAD_PARALLEL_MIN_SIZE * MB, BIG_FILE_SIZE)
+        )
+        if parallel:
+            # Pyrogram bounds concurrent uploads with this semaphore where it has one
+            async with getattr(self, "save_file_semaphore", None) or contextlib.nullcontext():
+                try:
+                    return await upload_parts(self, path, progress, progress_args)
+                except Exception as e:
+                    log(f"⚠️  Parallel upload of {path} failed ({str(e)}), sending it as one stream")
+        return await super().save_file(
+            path, file_id=file_id, file_part=file_part, progress=progress, progress_args=progress_args
+        )
+
+
+async def make_thumbnail(video_file, thumb_file, duration=0):
+    """Write a preview frame of a finished video, returns thumb_file or None"""
+    returncode, stderr, _ = await run_ffmpeg(build_preview_command(video_file, thumb_file, duration))
+    if returncode != 0 or not os.path.exists(thumb_file) or os.path.getsize(thumb_file) == 0:
+        log(f"⚠️  No thumbnail for {video_file}: {stderr.splitlines()[-1] if stderr else returncode}")
+        return None
+    return thumb_file
+
+async def video_upload_args(video_file, thumb_file=None):
+    """duration, width, height and thumb of a finished video, for reply_video/reply_animation
+
+    Telegram works these out itself when they are missing, and shows no
+    preview until it has. thumb_file is reused when the encoder already
+    wrote it and generated otherwise.
+    """
+    info = await probe_media(video_file)
+    video = get_stream(info, "video")
+    if not video:
+        return {}
+    duration = get_duration(info)
+    width, height = display_size(video)
+    args = {"duration": int(round(duration)), "width": int(width), "height": int(height)}
+    if thumb_file:
+        if not (os.path.exists(thumb_file) and os.path.getsize(thumb_file) > 0):
+            thumb_file = await make_thumbnail(video_file, thumb_file, duration)
+        if thumb_file:
+            args["thumb"] = thumb_file
+    return args
+
+async def reply_media(message, video_file, caption=None, animation=False, thumb_file=None, progress=None):
+    """Send a finished video (or animation) as a reply with its metadata and preview"""
+    kwargs = {"caption": caption, "progress": progress}
+    if UPLOAD_THUMBNAILS:
+        kwargs.update(await video_upload_args(video_file, thumb_file))
+    if animation:
+        return await message.reply_animation(video_file, **kwargs)
+    return await message.reply_video(video_file, supports_streaming=True, **kwargs)
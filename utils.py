@@ -0,0 +1,20 @@
+import os
+from datetime import datetime
+
+def log(message):
+    """Log messages to console with timestamp"""
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    print(f"[{timestamp}] {message}")
+
+def get_file_size(filepath):
+    """Get file size in megabytes"""
+    size = os.path.getsize(filepath)
+    return round(size / (1024 * 1024), 2)
+
+def parse_bitrate(value):
+    """Convert an ffmpeg style bitrate ('64k', '1.5M', 800000) to bits per second"""
+    text = str(value).strip().lower()
+    multipliers = {'k': 1000, 'm': 1000 * 1000}
+    if text and text[-1] in multipliers:
+        return int(float(text[:-1]) * multipliers[text[-1]])
+    return int(float(text))
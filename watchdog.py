@@ -0,0 +1,82 @@
+import asyncio
+import os
+import signal
+import time
+from config import FFMPEG_STALL_TIMEOUT, WATCHDOG_INTERVAL
+from utils import log
+
+
+class ProcessStalled(RuntimeError):
+    """Raised for an encode whose ffmpeg the watchdog killed for making no progress"""
+
+
+def kill_group(pid):
+    """SIGKILL a process and everything it started; ffmpeg is started as its own process group"""
+    try:
+        os.killpg(pid, signal.SIGKILL)
+        return True
+    except (ProcessLookupError, PermissionError):
+        return False
+
+
+class Watchdog:
+    """Kill ffmpeg process groups that stop making progress
+
+    run_ffmpeg registers every process it starts and reports each
+    '-progress' block; a process whose position (frame, time, bytes
+    written) has not moved for stall_timeout seconds is killed with its
+    process group. The caller then sees a failed run with stats['stalled']
+    set and cleans up like after any other error.
+    """
+
+    def __init__(self, stall_timeout, interval):
+        self.stall_timeout = stall_timeout
+        self.interval = interval
+        self._watched = {}  # pid -> {"label", "position", "last_progress", "stalled"}
+        self._task = None
+        self.kills = 0
+
+    def watch(self, pid, label):
+        """Start watching a process; returns the entry whose 'stalled' flag tells if it was killed"""
+        entry = {"label": label, "position": None, "last_progress": time.time(), "stalled": False}
+        self._watched[pid] = entry
+        return entry
+
+    def progress(self, pid, position):
+        """Record a progress report; only a changed position counts as progress"""
+        entry = self._watched.get(pid)
+        if entry and position != entry["position"]:
+            entry["position"] = position
+            entry["last_progress"] = time.time()
+
+    def unwatch(self, pid):
+        self._watched.pop(pid, None)
+
+    def check(self):
+        """Kill every watched process that has been stuck for longer than stall_timeout"""
+        now = time.time()
+        for pid, entry in list(self._watched.items()):
+            idle = now - entry["last_progress"]
+            if entry["stalled"] or idle < self.stall_timeout:
+                continue
+            entry["stalled"] = True
+            self.kills += 1
+            log(f"🐕 ffmpeg {pid} ({entry['label']}) made no progress for {round(idle)} seconds, killing its process group")
+            kill_group(pid)
+
+    def start(self):
+        """Start the periodic check; must be called from the running event loop"""
+        if self.stall_timeout and self._task is None:
+            self._task = asyncio.create_task(self._run(), name="watchdog")
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            self.check()
+
+    def stats(self):
+        return {"watched": len(self._watched), "kills": self.kills}
+
+
+# One per process: run_ffmpeg registers with it wherever it is called from
+watchdog = Watchdog(FFMPEG_STALL_TIMEOUT, WATCHDOG_INTERVAL)
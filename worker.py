@@ -0,0 +1,127 @@
+import argparse
+import asyncio
+import os
+import socket
+from config import JOB_STORE_PATH, JOB_SHARED_DIR, JOB_LEASE_SECONDS, JOB_MAX_ATTEMPTS, JOB_POLL_INTERVAL, WORKER_CONCURRENCY
+from config import CPU_CORES, CPU_PIN_CORES, UPLOAD_THUMBNAILS
+from engine import encode
+from jobstore import JobStore
+from planner import EncodePlan
+from progress import ffmpeg_percentage
+from probe import probe_media, get_duration
+from resources import CpuBudget
+from scratch import scratch_from_config, MB
+from utils import log, get_file_size
+from watchdog import watchdog
+
+def shared_path(name):
+    """Path of a job file inside the shared directory on this host"""
+    return os.path.join(JOB_SHARED_DIR, name)
+
+def thumb_path(output_file):
+    """Where the preview of a job's output goes; the bot looks for it next to the output"""
+    return os.path.splitext(output_file)[0] + ".jpg"
+
+def remove_outputs(output_file):
+    """Remove what an unfinished encode left in the shared directory"""
+    for path in (output_file, thumb_path(output_file)):
+        if os.path.exists(path):
+            os.remove(path)
+
+async def encode_job(job_id, payload, budget, space, state):
+    """Run the encode the bot planned for a job; returns (returncode, stderr)"""
+    input_file = shared_path(payload["input_name"])
+    output_file = shared_path(payload["output_name"])
+    info = await probe_media(input_file)
+    duration = get_duration(info)
+
+    def on_progress(block):
+        percentage = ffmpeg_percentage(block, duration)
+        if percentage is not None:
+            state["progress"] = round(percentage, 1)
+
+    plan = None
+    if payload.get("plan_action"):
+        size = payload["original_size"]
+        plan = EncodePlan(payload["plan_action"], "planned by the bot", size, size, duration, info)
+    # Segments and samples go to scratch; the input and output stay in the shared directory
+    scratch = space.open(f"store{job_id}", space.estimate(payload["original_size"] * MB))
+    try:
+        returncode, stderr, _ = await encode(
+            input_file, output_file, info, plan, budget, scratch, f"Store job #{job_id}",
+            target_size=payload.get("target_size"), on_progress=on_progress,
+            thumb_file=thumb_path(output_file) if UPLOAD_THUMBNAILS else None
+        )
+        return returncode, stderr
+    finally:
+        scratch.close()
+
+async def keep_lease(store, job_id, worker, state, encode):
+    """Send heartbeats with the current progress; cancel the encode if the lease is lost"""
+    while True:
+        await asyncio.sleep(store.lease_seconds / 3)
+        if not store.heartbeat(job_id, worker, state["progress"]):
+            log(f"⚠️  Worker {worker}: lease on job #{job_id} lost, stopping the encode")
+            state["lost"] = True
+            encode.cancel()
+            return
+
+async def run_job(store, worker, job, budget, space):
+    """Encode one claimed job and report the result back to the store"""
+    payload = job["payload"]
+    output_file = shared_path(payload["output_name"])
+    log(f"🛠️  Worker {worker}: job #{job['id']} (attempt {job['attempts']})")
+    state = {"progress": 0, "lost": False}
+    encode = asyncio.create_task(encode_job(job["id"], payload, budget, space, state))
+    heartbeat = asyncio.create_task(keep_lease(store, job["id"], worker, state, encode))
+    try:
+        returncode, stderr = await encode
+    except asyncio.CancelledError:
+        if not state["lost"]:
+            raise  # The worker itself is shutting down; the lease will expire
+        remove_outputs(output_file)
+        return
+    except Exception as e:
+        log(f"❌ Worker {worker}: job #{job['id']} failed: {str(e)}")
+        store.fail(job["id"], worker, str(e))
+        return
+    finally:
+        heartbeat.cancel()
+
+    if returncode != 0:
+        log(f"❌ Worker {worker}: ffmpeg exited with code {returncode} on job #{job['id']}")
+        log(f"FFmpeg error: {stderr}")
+        remove_outputs(output_file)
+        store.fail(job["id"], worker, f"ffmpeg exited with code {returncode}")
+    elif store.complete(job["id"], worker, output_size=get_file_size(output_file)):
+        log(f"✅ Worker {worker}: job #{job['id']} encoded ({get_file_size(output_file)} MB)")
+    else:
+        log(f"⚠️  Worker {worker}: job #{job['id']} was requeued meanwhile, dropping the result")
+
+async def worker_loop(store, worker, budget, space):
+    """Claim and encode jobs one after another"""
+    while True:
+        job = store.claim(worker)
+        if job is None:
+            await asyncio.sleep(JOB_POLL_INTERVAL)
+            continue
+        await run_job(store, worker, job, budget, space)
+
+async def main():
+    parser = argparse.ArgumentParser(description="Encoder worker for bot2 jobs in the shared job store")
+    parser.add_argument("--id", default=f"{socket.gethostname()}-{os.getpid()}", help="Worker name shown in leases")
+    parser.add_argument("--concurrency", type=int, default=WORKER_CONCURRENCY, help="Jobs encoded at the same time")
+    args = parser.parse_args()
+
+    os.makedirs(JOB_SHARED_DIR, exist_ok=True)
+    store = JobStore(JOB_STORE_PATH, JOB_LEASE_SECONDS, JOB_MAX_ATTEMPTS)
+    budget = CpuBudget(CPU_CORES, pin=CPU_PIN_CORES)
+    space = scratch_from_config()
+    space.start()
+    watchdog.start()
+    concurrency = max(1, args.concurrency)
+    log(f"🚀 Worker {args.id} started: {concurrency} jobs on {len(budget.cores)} cores, store {JOB_STORE_PATH}")
+    await asyncio.gather(*(worker_loop(store, args.id, budget, space) for _ in range(concurrency)))
+
+if __name__ == "__main__":
+    asyncio.run(main())